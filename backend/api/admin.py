@@ -1,23 +1,98 @@
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import Staff, Customer, Product, Order, OrderProduct, AllergenInfo
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.html import format_html, format_html_join
+from django.utils.functional import cached_property
+from .models import (
+    Branch, Staff, Customer, CustomerSegment, Product, Order, OrderProduct, AllergenInfo, Job, RequestProfile,
+    CapacitySlot, OrderDocument
+)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that uses PostgreSQL's planner estimate for unfiltered tables.
+
+    An exact COUNT(*) scans the whole table; pg_class.reltuples is kept up to
+    date by autovacuum/ANALYZE. The estimate is only used when the changelist
+    has no filters or search and it's above ADMIN_ESTIMATED_COUNT_THRESHOLD;
+    otherwise (and on other databases) the exact count is used.
+    """
+    
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = getattr(queryset, 'query', None)
+        if query is not None and not query.where:
+            connection = connections[queryset.db]
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                        [queryset.model._meta.db_table]
+                    )
+                    row = cursor.fetchone()
+                threshold = getattr(settings, 'ADMIN_ESTIMATED_COUNT_THRESHOLD', 10000)
+                if row and row[0] > threshold:
+                    return row[0]
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Admin defaults for tables that grow without bound"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(Branch)
+class BranchAdmin(admin.ModelAdmin):
+    list_display = ['branch_id', 'code', 'name', 'database', 'is_active']
+    search_fields = ['code', 'name']
+    list_filter = ['database', 'is_active']
 
 
 @admin.register(Staff)
 class StaffAdmin(UserAdmin):
     list_display = ['username', 'email', 'first_name', 'last_name', 'is_active', 'is_staff']
     search_fields = ['username', 'email', 'first_name', 'last_name']
-    list_filter = ['is_active', 'is_staff']
+    list_filter = ['is_active', 'is_staff', 'branches']
+    fieldsets = UserAdmin.fieldsets + (('Branches', {'fields': ('branches',)}),)
+    filter_horizontal = UserAdmin.filter_horizontal + ('branches',)
 
 
 @admin.register(Customer)
-class CustomerAdmin(admin.ModelAdmin):
+class CustomerAdmin(LargeTableAdmin):
     list_display = ['customer_id', 'full_name', 'phone_number', 'email', 'created_at']
     search_fields = ['first_name', 'last_name', 'email', 'phone_number']
     list_filter = ['created_at']
     readonly_fields = ['full_name', 'created_at', 'updated_at']
 
 
+@admin.register(CustomerSegment)
+class CustomerSegmentAdmin(LargeTableAdmin):
+    list_display = ['customer', 'segment', 'rfm_score', 'recency_days', 'frequency', 'monetary', 'computed_at']
+    list_filter = ['segment', 'r_score', 'f_score', 'm_score']
+    search_fields = ['customer__first_name', 'customer__last_name', 'rfm_score']
+    list_select_related = ['customer']
+    readonly_fields = [field.name for field in CustomerSegment._meta.fields]
+
+
+@admin.register(CapacitySlot)
+class CapacitySlotAdmin(LargeTableAdmin):
+    list_display = ['slot_start', 'branch', 'product_type', 'quantity']
+    list_filter = ['branch', 'product_type']
+    date_hierarchy = 'slot_start'
+    readonly_fields = [field.name for field in CapacitySlot._meta.fields]
+
+
+@admin.register(OrderDocument)
+class OrderDocumentAdmin(LargeTableAdmin):
+    list_display = ['order_id', 'built_at']
+    readonly_fields = [field.name for field in OrderDocument._meta.fields]
+
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ['product_id', 'product_name', 'product_price', 'product_type', 'product_suitability', 'is_active']
@@ -29,16 +104,28 @@ class ProductAdmin(admin.ModelAdmin):
 class OrderProductInline(admin.TabularInline):
     model = OrderProduct
     extra = 1
-    readonly_fields = ['unit_price']
+    readonly_fields = ['unit_price', 'product_name']
+    autocomplete_fields = ['product']
+    
+    def get_queryset(self, request):
+        # Each line's label includes its order and the order's customer
+        return super().get_queryset(request).select_related('order__customer')
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(LargeTableAdmin):
     list_display = ['order_id', 'customer', 'total_price', 'method_of_payment', 'status', 'order_placed', 'order_due']
     search_fields = ['customer__first_name', 'customer__last_name']
     list_filter = ['status', 'method_of_payment', 'order_placed']
+    list_select_related = ['customer']
+    autocomplete_fields = ['customer']
     inlines = [OrderProductInline]
     readonly_fields = ['total_price', 'created_at', 'updated_at']
+    
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Inline line edits change the total, so recompute it from the stored lines
+        Order.objects.filter(pk=form.instance.pk).recalculate_totals()
 
 
 @admin.register(AllergenInfo)
@@ -46,3 +133,49 @@ class AllergenInfoAdmin(admin.ModelAdmin):
     list_display = ['allergen_id', 'allergen_name', 'description']
     search_fields = ['allergen_name', 'description']
     filter_horizontal = ['products']
+
+
+@admin.register(Job)
+class JobAdmin(LargeTableAdmin):
+    list_display = ['job_id', 'name', 'status', 'progress', 'attempts', 'created_by', 'created_at', 'finished_at']
+    search_fields = ['name']
+    list_filter = ['status', 'name']
+    list_select_related = ['created_by']
+    readonly_fields = [
+        'progress', 'progress_message', 'result', 'error', 'attempts', 'worker',
+        'heartbeat_at', 'created_by', 'created_at', 'started_at', 'finished_at'
+    ]
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(LargeTableAdmin):
+    list_display = ['profile_id', 'method', 'path', 'status_code', 'duration_ms', 'sql_count', 'sql_time_ms', 'user', 'created_at']
+    search_fields = ['path']
+    list_filter = ['method', 'status_code', 'created_at']
+    list_select_related = ['user']
+    fields = [
+        'method', 'path', 'query_string', 'status_code', 'duration_ms', 'sql_count',
+        'sql_time_ms', 'user', 'created_at', 'slowest_queries', 'stats_report'
+    ]
+    readonly_fields = fields
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    @admin.display(description='Queries (slowest first)')
+    def slowest_queries(self, obj):
+        queries = sorted(obj.queries, key=lambda query: query['duration_ms'], reverse=True)
+        return format_html_join(
+            '', '<p><strong>{} ms</strong> [{}]<br><code>{}</code><br><small>{}</small></p>',
+            (
+                (query['duration_ms'], query['db'], query['sql'], ' <- '.join(reversed(query['stack'])))
+                for query in queries
+            )
+        )
+    
+    @admin.display(description='Profile')
+    def stats_report(self, obj):
+        return format_html('<pre>{}</pre>', obj.stats)
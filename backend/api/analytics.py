@@ -0,0 +1,192 @@
+"""
+Customer segmentation by recency, frequency and monetary value (RFM).
+
+Orders are read as three columns - customer id, placed time as epoch
+seconds and total - straight into a NumPy array, so no model instances are
+built. Per-customer recency, frequency and spend come from grouped NumPy
+reductions, each is scored 1-5 by quintile, and the scores are mapped to a
+segment label. The results replace the stored `CustomerSegment` rows,
+streamed in with batched executemany inserts.
+"""
+import itertools
+import time
+
+import numpy as np
+from django.db import connections, transaction
+from django.db.models import FloatField, Func, Value
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
+
+from .models import Customer, CustomerSegment, Order
+
+SECONDS_PER_DAY = 86400.0
+
+
+class Epoch(Func):
+    """Seconds since 1970-01-01 UTC for a datetime column"""
+    output_field = FloatField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template="((julianday(%(expressions)s) - 2440587.5) * 86400.0)",
+            **extra_context
+        )
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template="EXTRACT(EPOCH FROM %(expressions)s)", **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template="UNIX_TIMESTAMP(%(expressions)s)", **extra_context)
+
+
+def load_order_columns(orders):
+    """(customer_id, placed epoch, total) for each order as an n x 3 float array"""
+    rows = orders.order_by().values_list(
+        'customer_id',
+        Epoch('order_placed'),
+        Coalesce(Cast('total_price', FloatField()), Value(0.0)),
+    ).iterator(chunk_size=50000)
+    return np.fromiter(itertools.chain.from_iterable(rows), dtype=np.float64).reshape(-1, 3)
+
+
+def quintile_scores(values, higher_is_better=True):
+    """Score values 1-5 by quintile; equal values always get the same score"""
+    edges = np.quantile(values, [0.2, 0.4, 0.6, 0.8])
+    buckets = np.searchsorted(edges, values, side='left')
+    return buckets + 1 if higher_is_better else 5 - buckets
+
+
+def segment_labels(r, f, m):
+    fm = (f + m) / 2
+    conditions = [
+        (r >= 4) & (fm >= 4),
+        (r >= 3) & (fm >= 4),
+        (r <= 2) & (fm >= 3),
+        (r >= 4) & (f <= 1),
+        (r >= 3) & (fm >= 2),
+        (r <= 2),
+    ]
+    choices = ['champions', 'loyal', 'at_risk', 'new', 'potential_loyalist', 'hibernating']
+    return np.select(conditions, choices, default='need_attention')
+
+
+def compute_rfm(columns, now):
+    """
+    Per-customer RFM from an order column array.
+
+    Returns a dict of equal-length arrays: customer_id, recency_days,
+    frequency, monetary, r_score, f_score, m_score and segment.
+    """
+    customer_ids, inverse = np.unique(columns[:, 0].astype(np.int64), return_inverse=True)
+    frequency = np.bincount(inverse)
+    monetary = np.bincount(inverse, weights=columns[:, 2])
+    last_order = np.full(len(customer_ids), -np.inf)
+    np.maximum.at(last_order, inverse, columns[:, 1])
+    recency_days = np.maximum((now.timestamp() - last_order) / SECONDS_PER_DAY, 0.0)
+
+    r_score = quintile_scores(recency_days, higher_is_better=False)
+    f_score = quintile_scores(frequency)
+    m_score = quintile_scores(monetary)
+    return {
+        'customer_id': customer_ids,
+        'recency_days': recency_days,
+        'frequency': frequency,
+        'monetary': monetary,
+        'r_score': r_score,
+        'f_score': f_score,
+        'm_score': m_score,
+        'segment': segment_labels(r_score, f_score, m_score),
+    }
+
+
+SEGMENT_COLUMNS = (
+    'customer_id', 'recency_days', 'frequency', 'monetary',
+    'r_score', 'f_score', 'm_score', 'rfm_score', 'segment', 'computed_at',
+)
+
+
+def _segment_rows(rfm, computed_at):
+    columns = zip(*(rfm[name].tolist() for name in (
+        'customer_id', 'recency_days', 'frequency', 'monetary', 'r_score', 'f_score', 'm_score', 'segment'
+    )))
+    for customer_id, recency_days, frequency, monetary, r, f, m, segment in columns:
+        yield (
+            customer_id, round(recency_days, 2), frequency, f"{monetary:.2f}",
+            r, f, m, f"{r}{f}{m}", segment, computed_at,
+        )
+
+
+def _store_segments(rfm, computed_at, using, batch_size, progress=None):
+    """
+    Stream segment rows into the table with executemany.
+
+    Building model instances for bulk_create costs more than the whole RFM
+    computation at this size, so rows go in as plain tuples.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    sql = "INSERT INTO {} ({}) VALUES ({})".format(
+        quote(CustomerSegment._meta.db_table),
+        ', '.join(quote(column) for column in SEGMENT_COLUMNS),
+        ', '.join(['%s'] * len(SEGMENT_COLUMNS)),
+    )
+    rows = _segment_rows(rfm, connection.ops.adapt_datetimefield_value(computed_at))
+    total = len(rfm['customer_id'])
+    stored = 0
+    with connection.cursor() as cursor:
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            cursor.executemany(sql, batch)
+            stored += len(batch)
+            if progress:
+                progress(stored, total)
+
+
+def recompute_segments(branch=None, using='default', batch_size=5000, progress=None):
+    """
+    Recompute and store RFM segments for every customer with orders.
+
+    Cancelled orders are ignored. With `branch`, only that branch's orders
+    and segments are touched. `progress(stored, total)` is called after
+    each batch is written.
+    """
+    started = time.perf_counter()
+    now = timezone.now()
+    orders = Order.objects.using(using).exclude(status='cancelled')
+    segments = CustomerSegment.objects.using(using)
+    if branch is not None:
+        orders = orders.filter(branch=branch)
+        segments = segments.filter(
+            customer_id__in=Customer.objects.using(using).filter(branch=branch).values('pk')
+        )
+
+    columns = load_order_columns(orders)
+    loaded = time.perf_counter()
+    rfm = compute_rfm(columns, now) if len(columns) else None
+    computed = time.perf_counter()
+
+    total = len(rfm['customer_id']) if rfm is not None else 0
+    with transaction.atomic(using=using):
+        segments.delete()
+        if rfm is not None:
+            _store_segments(rfm, now, using, batch_size, progress)
+    finished = time.perf_counter()
+
+    counts = {}
+    if rfm is not None:
+        labels, label_counts = np.unique(rfm['segment'], return_counts=True)
+        counts = {str(label): int(count) for label, count in zip(labels, label_counts)}
+    return {
+        'orders': len(columns),
+        'customers': total,
+        'segments': counts,
+        'seconds': {
+            'load': round(loaded - started, 3),
+            'compute': round(computed - loaded, 3),
+            'store': round(finished - computed, 3),
+            'total': round(finished - started, 3),
+        },
+    }
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+    
+    def ready(self):
+        # Connect signal handlers and register background tasks
+        from . import signals, tasks  # noqa: F401
@@ -0,0 +1,251 @@
+"""
+Type-ahead search for customers and products.
+
+Each worker process keeps a sorted in-memory list of (search key, id) pairs
+per model and database, so a prefix lookup is a binary search followed by a
+short scan rather than a LIKE over the whole table. Keys are lower-cased
+names (whole and per word), e-mail addresses and phone digits.
+
+Saves and deletes made through this process update the index via signals;
+changes made elsewhere are picked up when it is rebuilt after
+`AUTOCOMPLETE_MAX_AGE` seconds. Only the first build runs on a request
+thread; later rebuilds run in a background thread while searches keep
+using the old index. Callers re-read matches from the database,
+so a stale entry can only cost a result, never return a deleted row. Tables
+with more than `AUTOCOMPLETE_INDEX_MAX_ROWS` rows fall back to a
+`LIKE 'prefix%'` query.
+"""
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models import Q
+
+from .models import Customer, Product
+from .utils import normalize_phone
+
+logger = logging.getLogger(__name__)
+
+_whitespace = re.compile(r'\s+')
+_non_digits = re.compile(r'\D')
+_phone_query = re.compile(r'^[\d\s()+-]+$')
+
+
+def _text(value):
+    return _whitespace.sub(' ', (value or '').strip().lower())
+
+
+def _words(value):
+    text = _text(value)
+    keys = {text} if text else set()
+    keys.update(text.split(' ')[1:])
+    return keys
+
+
+def _customer_keys(first_name, last_name, email, phone_number, phone_normalized):
+    keys = _words(f'{first_name} {last_name}') | _words(last_name)
+    if email:
+        keys.add(email.strip().lower())
+    for phone in (phone_number, phone_normalized):
+        digits = _non_digits.sub('', phone or '')
+        if digits:
+            keys.add(digits)
+    return keys
+
+
+def _product_keys(product_name):
+    return _words(product_name)
+
+
+INDEXED_MODELS = {
+    Customer: {
+        'fields': ('first_name', 'last_name', 'email', 'phone_number', 'phone_normalized'),
+        'keys': _customer_keys,
+        'filter': {},
+    },
+    Product: {
+        'fields': ('product_name',),
+        'keys': _product_keys,
+        'filter': {'is_active': True},
+    },
+}
+
+
+def normalize_query(query):
+    """The key form of a search string: phone digits or lower-cased text"""
+    if _phone_query.match(query) and any(char.isdigit() for char in query):
+        return _non_digits.sub('', query)
+    return _text(query)
+
+
+class PrefixIndex:
+    """Sorted (key, id) pairs for one model in one database"""
+
+    def __init__(self, model, using='default'):
+        self.model = model
+        self.using = using
+        self.spec = INDEXED_MODELS[model]
+        self._lock = threading.Lock()
+        self._keys = []
+        self._entries = {}
+        self._built_at = None
+        self._available = False
+        self._refreshing = False
+
+    @property
+    def max_age(self):
+        return getattr(settings, 'AUTOCOMPLETE_MAX_AGE', 300)
+
+    @property
+    def max_rows(self):
+        return getattr(settings, 'AUTOCOMPLETE_INDEX_MAX_ROWS', 500000)
+
+    def is_stale(self):
+        return self._built_at is None or time.monotonic() - self._built_at > self.max_age
+
+    def build(self):
+        queryset = self.model.objects.using(self.using).filter(**self.spec['filter']).order_by()
+        keys, entries = [], {}
+        available = queryset.count() <= self.max_rows
+        if available:
+            rows = queryset.values_list('pk', 'branch_id', *self.spec['fields']).iterator(chunk_size=10000)
+            for pk, branch_id, *values in rows:
+                row_keys = tuple(self.spec['keys'](*values))
+                entries[pk] = (branch_id, row_keys)
+                keys.extend((key, pk) for key in row_keys)
+            keys.sort()
+
+        with self._lock:
+            self._keys = keys
+            self._entries = entries
+            self._available = available
+            self._built_at = time.monotonic()
+
+    def ensure_built(self):
+        if self._built_at is None:
+            self.build()
+        elif self.is_stale():
+            self.refresh_in_background()
+
+    def refresh_in_background(self):
+        """Rebuild in a background thread; searches use the current index meanwhile"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(
+            target=self._refresh, name=f'autocomplete-{self.model._meta.model_name}', daemon=True
+        ).start()
+
+    def _refresh(self):
+        try:
+            self.build()
+        except DatabaseError:
+            logger.warning("Couldn't rebuild the %s autocomplete index", self.model._meta.label, exc_info=True)
+        finally:
+            self._refreshing = False
+            # The thread's own connection
+            connections[self.using].close()
+
+    def _remove(self, pk):
+        branch_id, row_keys = self._entries.pop(pk, (None, ()))
+        for key in row_keys:
+            position = bisect_left(self._keys, (key, pk))
+            if position < len(self._keys) and self._keys[position] == (key, pk):
+                del self._keys[position]
+
+    def update(self, instance):
+        """Re-index one saved row"""
+        if self._built_at is None:
+            return
+        with self._lock:
+            if not self._available:
+                return
+            self._remove(instance.pk)
+            if all(getattr(instance, field) == value for field, value in self.spec['filter'].items()):
+                row_keys = tuple(self.spec['keys'](*(getattr(instance, field) for field in self.spec['fields'])))
+                self._entries[instance.pk] = (instance.branch_id, row_keys)
+                for key in row_keys:
+                    insort(self._keys, (key, instance.pk))
+
+    def discard(self, pks):
+        if self._built_at is None:
+            return
+        with self._lock:
+            for pk in pks:
+                self._remove(pk)
+
+    def search(self, query, branch_id=None, limit=10):
+        """Ids of up to `limit` rows with a key starting with `query`, or None if unavailable"""
+        self.ensure_built()
+        with self._lock:
+            if not self._available:
+                return None
+            keys, entries = self._keys, self._entries
+            position = bisect_left(keys, (query,))
+            matches = []
+            while position < len(keys) and len(matches) < limit:
+                key, pk = keys[position]
+                if not key.startswith(query):
+                    break
+                if pk not in matches and (branch_id is None or entries[pk][0] == branch_id):
+                    matches.append(pk)
+                position += 1
+        return matches
+
+
+def _database_search(model, query, branch_id, limit):
+    """Fallback: prefix match in the database"""
+    queryset = model.objects.filter(**INDEXED_MODELS[model]['filter'])
+    if branch_id is not None:
+        queryset = queryset.filter(branch_id=branch_id)
+
+    if model is Customer:
+        if query.isdigit():
+            condition = Q(phone_normalized__startswith='+' + query)
+            phone = normalize_phone(query)
+            if phone:
+                condition |= Q(phone_normalized__startswith=phone)
+        else:
+            condition = (
+                Q(first_name__istartswith=query) |
+                Q(last_name__istartswith=query) |
+                Q(email__istartswith=query)
+            )
+            if ' ' in query:
+                first_name, last_name = query.split(' ', 1)
+                condition |= Q(first_name__istartswith=first_name, last_name__istartswith=last_name)
+        ordering = ['first_name', 'last_name', 'pk']
+    else:
+        condition = Q(product_name__istartswith=query) | Q(product_name__icontains=' ' + query)
+        ordering = ['product_name', 'pk']
+    return list(queryset.filter(condition).order_by(*ordering).values_list('pk', flat=True)[:limit])
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def prefix_index_for(model, using='default'):
+    """The prefix index for a model in a database alias"""
+    index = _indexes.get((model, using))
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.setdefault((model, using), PrefixIndex(model, using))
+    return index
+
+
+def autocomplete(model, query, using='default', branch_id=None, limit=10):
+    """Up to `limit` matching rows for a type-ahead prefix, in key order"""
+    query = normalize_query(query)
+    if not query:
+        return []
+    pks = prefix_index_for(model, using).search(query, branch_id=branch_id, limit=limit)
+    if pks is None:
+        pks = _database_search(model, query, branch_id, limit)
+    rows = model.objects.filter(pk__in=pks, **INDEXED_MODELS[model]['filter']).in_bulk()
+    return [rows[pk] for pk in pks if pk in rows]
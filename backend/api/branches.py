@@ -0,0 +1,104 @@
+"""
+Per-request branch selection.
+
+The active branch is held in a context variable for the duration of a
+request (or a `use_branch()` block). `api.routers.BranchRouter` reads it
+to send branch-scoped models to that branch's database, and the
+`BranchScopedMixin` viewsets filter querysets by it so branches that
+share a database still only see their own rows.
+"""
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+from rest_framework.exceptions import NotFound, PermissionDenied
+
+from .models import Branch
+
+_current_branch = contextvars.ContextVar('current_branch', default=None)
+
+
+def current_branch():
+    """The active Branch, or None outside a branch context"""
+    return _current_branch.get()
+
+
+def current_database():
+    """Database alias of the active branch, or 'default'"""
+    branch = _current_branch.get()
+    return branch.database if branch is not None else 'default'
+
+
+@contextmanager
+def use_branch(branch):
+    """Run a block with `branch` (a Branch, a code or None) as the active branch"""
+    if isinstance(branch, str):
+        branch = Branch.objects.using('default').get(code=branch)
+    token = _current_branch.set(branch)
+    try:
+        yield branch
+    finally:
+        _current_branch.reset(token)
+
+
+def default_branch():
+    code = getattr(settings, 'DEFAULT_BRANCH', 'main')
+    return Branch.objects.using('default').filter(code=code, is_active=True).first()
+
+
+def resolve_branch(request):
+    """
+    Pick the branch for a request.
+
+    An explicit `X-Branch` header (or `?branch=`) wins; otherwise the user's
+    first assigned branch, then `DEFAULT_BRANCH`. Staff may only use branches
+    they're assigned to; unassigned staff may use the default branch.
+    """
+    code = request.META.get('HTTP_X_BRANCH') or request.query_params.get('branch')
+    user = request.user
+    assigned = list(user.branches.using('default').filter(is_active=True)) if user.is_authenticated else []
+
+    if not code:
+        return assigned[0] if assigned else default_branch()
+
+    branch = Branch.objects.using('default').filter(code=code, is_active=True).first()
+    if branch is None:
+        raise NotFound(f"Unknown branch '{code}'.")
+    if user.is_superuser or branch in assigned:
+        return branch
+    if not assigned and branch.code == getattr(settings, 'DEFAULT_BRANCH', 'main'):
+        return branch
+    raise PermissionDenied(f"You are not assigned to branch '{code}'.")
+
+
+class BranchScopedMixin:
+    """
+    Activates the request's branch for a viewset and scopes its data to it.
+
+    Use `self.branch_filter(queryset)` for querysets built outside
+    `get_queryset()`; new objects get the branch via `perform_create`.
+    """
+    branch = None
+    _branch_token = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.branch = resolve_branch(request)
+        self._branch_token = _current_branch.set(self.branch)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if self._branch_token is not None:
+            _current_branch.reset(self._branch_token)
+            self._branch_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def branch_filter(self, queryset):
+        if self.branch is not None and any(f.name == 'branch' for f in queryset.model._meta.fields):
+            return queryset.filter(branch=self.branch)
+        return queryset
+
+    def perform_create(self, serializer):
+        if self.branch is not None and any(f.name == 'branch' for f in serializer.Meta.model._meta.fields):
+            serializer.save(branch=self.branch)
+        else:
+            serializer.save()
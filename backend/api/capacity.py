@@ -0,0 +1,226 @@
+"""
+Kitchen capacity calendar.
+
+`CapacitySlot` holds the total quantity of order lines due in each slot
+(`KITCHEN_SLOT_MINUTES` long) per branch and product type, so checking a
+due time or drawing a day's grid is one indexed range read instead of a
+scan of overlapping orders and lines. Cancelled orders don't count.
+
+The table is maintained incrementally: signal handlers add or subtract a
+line's quantity when it is saved or deleted and move an order's lines when
+its due time, branch or status changes; cancelling in bulk and the fast
+delete helpers adjust it set-wise. `manage.py rebuild_capacity` recomputes
+it from the orders.
+"""
+from collections import defaultdict
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CapacitySlot, Order, OrderProduct
+
+
+def slot_length():
+    return timedelta(minutes=getattr(settings, 'KITCHEN_SLOT_MINUTES', 15))
+
+
+def slot_start(when):
+    """Start of the slot containing `when`"""
+    seconds = int(slot_length().total_seconds())
+    timestamp = int(when.timestamp())
+    return datetime.fromtimestamp(timestamp - timestamp % seconds, tz=dt_timezone.utc)
+
+
+def slot_capacity():
+    """Maximum quantity per slot for each product type; types not listed are unlimited"""
+    return getattr(settings, 'KITCHEN_SLOT_CAPACITY', {})
+
+
+def adjust(deltas, using='default'):
+    """Apply {(branch_id, slot_start, product_type): quantity change} to the calendar"""
+    for (branch_id, start, product_type), change in deltas.items():
+        if not change:
+            continue
+        slots = CapacitySlot.objects.using(using).filter(
+            branch_id=branch_id, slot_start=start, product_type=product_type
+        )
+        if slots.update(quantity=F('quantity') + change):
+            continue
+        try:
+            with transaction.atomic(using=using):
+                CapacitySlot.objects.using(using).create(
+                    branch_id=branch_id, slot_start=start, product_type=product_type, quantity=change
+                )
+        except IntegrityError:
+            # Created by a concurrent request since the UPDATE above
+            slots.update(quantity=F('quantity') + change)
+
+
+def _add(deltas, key, lines, sign):
+    branch_id, order_due = key
+    start = slot_start(order_due)
+    for product_type, quantity in lines:
+        deltas[(branch_id, start, product_type)] += sign * quantity
+
+
+def order_saved(order, using='default'):
+    """Move an order's lines if its branch, due time or status changed"""
+    old_key = getattr(order, '_saved_capacity_key', None)
+    new_key = order.capacity_key()
+    order._saved_capacity_key = new_key
+    if old_key == new_key:
+        return
+    lines = list(order.order_products.using(using).values_list('product_type', 'quantity'))
+    if not lines:
+        return
+    deltas = defaultdict(int)
+    if old_key is not None:
+        _add(deltas, old_key, lines, -1)
+    if new_key is not None:
+        _add(deltas, new_key, lines, 1)
+    adjust(deltas, using)
+
+
+def _saved_key(order):
+    """Where the order's lines are counted now, which may differ from its unsaved fields"""
+    if hasattr(order, '_saved_capacity_key'):
+        return order._saved_capacity_key
+    return order.capacity_key()
+
+
+def line_saved(line, created, using='default'):
+    key = _saved_key(line.order)
+    if key is None:
+        return
+    deltas = defaultdict(int)
+    if not created and hasattr(line, '_loaded_capacity'):
+        _add(deltas, key, [line._loaded_capacity], -1)
+    _add(deltas, key, [(line.product_type, line.quantity)], 1)
+    line._loaded_capacity = (line.product_type, line.quantity)
+    adjust(deltas, using)
+
+
+def line_deleted(line, using='default'):
+    try:
+        key = _saved_key(line.order)
+    except Order.DoesNotExist:
+        return
+    if key is None:
+        return
+    loaded = getattr(line, '_loaded_capacity', (line.product_type, line.quantity))
+    deltas = defaultdict(int)
+    _add(deltas, key, [loaded], -1)
+    adjust(deltas, using)
+
+
+def _line_deltas(orders, sign):
+    deltas = defaultdict(int)
+    rows = (
+        OrderProduct.objects.using(orders.db)
+        .filter(order__in=orders.exclude(status='cancelled').values('pk'))
+        .values_list('order__branch_id', 'order__order_due', 'product_type', 'quantity')
+    )
+    for branch_id, order_due, product_type, quantity in rows.iterator(chunk_size=5000):
+        deltas[(branch_id, slot_start(order_due), product_type)] += sign * quantity
+    return deltas
+
+
+def release_orders(orders):
+    """Subtract the lines of the given orders (a queryset) before they are cancelled or deleted"""
+    adjust(_line_deltas(orders, -1), orders.db)
+
+
+def rebuild(using='default'):
+    """Recompute the whole calendar from the orders; returns the number of slots"""
+    deltas = _line_deltas(Order.objects.using(using).all(), 1)
+    with transaction.atomic(using=using):
+        CapacitySlot.objects.using(using).all().delete()
+        CapacitySlot.objects.using(using).bulk_create([
+            CapacitySlot(branch_id=branch_id, slot_start=start, product_type=product_type, quantity=quantity)
+            for (branch_id, start, product_type), quantity in deltas.items()
+            if quantity
+        ], batch_size=2000)
+    return sum(1 for quantity in deltas.values() if quantity)
+
+
+def booked(start, end, branch=None, using='default'):
+    """{slot start: {product type: quantity}} for slots in [start, end)"""
+    slots = CapacitySlot.objects.using(using).filter(slot_start__gte=start, slot_start__lt=end)
+    if branch is not None:
+        slots = slots.filter(branch=branch)
+    grid = defaultdict(lambda: defaultdict(int))
+    for start_at, product_type, quantity in slots.values_list('slot_start', 'product_type', 'quantity'):
+        grid[start_at][product_type] += quantity
+    return grid
+
+
+def opening_hours(day):
+    """Aware (open, close) datetimes for a local date"""
+    opens, closes = getattr(settings, 'KITCHEN_OPENING_HOURS', ('00:00', '24:00'))
+    tz = timezone.get_current_timezone()
+
+    def at(hhmm):
+        hours, minutes = map(int, hhmm.split(':'))
+        return timezone.make_aware(datetime.combine(day, dt_time()), tz) + timedelta(hours=hours, minutes=minutes)
+
+    return at(opens), at(closes)
+
+
+def day_grid(day, branch=None, using='default'):
+    """Every slot in a day's opening hours with booked and free quantity per product type"""
+    opens, closes = opening_hours(day)
+    first = slot_start(opens)
+    grid = booked(first, closes, branch=branch, using=using)
+    capacity = slot_capacity()
+    length = slot_length()
+    slots = []
+    start = first
+    while start < closes:
+        used = grid.get(start, {})
+        available = {
+            product_type: max(limit - used.get(product_type, 0), 0)
+            for product_type, limit in capacity.items()
+        }
+        slots.append({
+            'start': timezone.localtime(start),
+            'booked': {product_type: quantity for product_type, quantity in used.items() if quantity > 0},
+            'available': available,
+            'full': bool(available) and all(free == 0 for free in available.values()),
+        })
+        start += length
+    return slots
+
+
+def shortfall(order_due, requested, branch_id=None, order=None, using='default'):
+    """
+    Product types for which `requested` {type: quantity} doesn't fit in the
+    slot at `order_due`, as {type: (requested, free)}. Lines of `order` that
+    are already counted in that slot are treated as free, since an update
+    replaces them.
+    """
+    capacity = slot_capacity()
+    requested = {product_type: quantity for product_type, quantity in requested.items() if product_type in capacity}
+    if not requested:
+        return {}
+    start = slot_start(order_due)
+    used = defaultdict(int)
+    slots = CapacitySlot.objects.using(using).filter(
+        branch_id=branch_id, slot_start=start, product_type__in=list(requested)
+    )
+    for product_type, quantity in slots.values_list('product_type', 'quantity'):
+        used[product_type] += quantity
+    if order is not None and order.pk:
+        key = _saved_key(order)
+        if key is not None and key[0] == branch_id and slot_start(key[1]) == start:
+            for product_type, quantity in order.order_products.using(using).values_list('product_type', 'quantity'):
+                used[product_type] -= quantity
+
+    short = {}
+    for product_type, quantity in requested.items():
+        free = max(capacity[product_type] - used[product_type], 0)
+        if quantity > free:
+            short[product_type] = (quantity, free)
+    return short
@@ -0,0 +1,110 @@
+"""
+Write-path helpers for SQLite deployments.
+
+On SQLite a transaction that starts by reading and later writes can fail
+straight away with "database is locked" when another connection is
+writing, since SQLite can't wait for the lock without risking deadlock.
+`write_transaction` runs a block of order writes in a BEGIN IMMEDIATE
+transaction, which waits (up to busy_timeout) for the write lock before
+doing anything, and retries the block with backoff if the lock still can't
+be had. On other databases it is a plain `transaction.atomic()`.
+
+`commit_batch` lets code running inside such a block queue follow-up work
+(e.g. regenerating derived rows) that is done once, at the end of the
+block but still inside its transaction.
+"""
+import functools
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import OperationalError, connections, transaction
+
+from .branches import current_database
+
+
+_batches = ContextVar('write_transaction_batches', default=None)
+
+
+def commit_batch(key, flush):
+    """
+    The set of items queued under `key` in the enclosing `write_transaction`
+    block, or None outside one. `flush(items)` is called with whatever has
+    been added when the block's work is done, before it commits.
+    """
+    batches = _batches.get()
+    if batches is None:
+        return None
+    if key not in batches:
+        batches[key] = (set(), flush)
+    return batches[key][0]
+
+
+def _run_batched(func):
+    if _batches.get() is not None:
+        return func()
+    batches = {}
+    token = _batches.set(batches)
+    try:
+        result = func()
+        # Flushing can queue more work, so repeat until everything is done
+        while any(items for items, _ in batches.values()):
+            for items, flush in list(batches.values()):
+                if items:
+                    pending = set(items)
+                    items.clear()
+                    flush(pending)
+        return result
+    finally:
+        _batches.reset(token)
+
+
+def _is_lock_error(exc):
+    message = str(exc).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+
+@contextmanager
+def immediate_atomic(using='default'):
+    """`transaction.atomic()` that begins with BEGIN IMMEDIATE on SQLite"""
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        with transaction.atomic(using=using):
+            yield
+        return
+    connection.begin_immediate = True
+    try:
+        with transaction.atomic(using=using):
+            yield
+    finally:
+        connection.begin_immediate = False
+
+
+def run_in_write_transaction(func, using=None):
+    """Call `func()` in an immediate transaction, retrying on SQLite lock errors"""
+    using = using or current_database()
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        with transaction.atomic(using=using):
+            return _run_batched(func)
+
+    retries = getattr(settings, 'SQLITE_WRITE_RETRIES', 5)
+    backoff = getattr(settings, 'SQLITE_WRITE_RETRY_BACKOFF', 0.05)
+    for attempt in range(retries + 1):
+        try:
+            with immediate_atomic(using):
+                return _run_batched(func)
+        except OperationalError as exc:
+            if not _is_lock_error(exc) or attempt == retries:
+                raise
+            time.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+def write_transaction(view_method):
+    """Decorator for viewset handlers that write orders"""
+    @functools.wraps(view_method)
+    def wrapper(*args, **kwargs):
+        return run_in_write_transaction(lambda: view_method(*args, **kwargs))
+    return wrapper
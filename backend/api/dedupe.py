@@ -0,0 +1,231 @@
+"""
+Duplicate customer detection.
+
+Repeat callers are often entered again with a slightly different name or
+phone format. Comparing every customer with every other is O(n^2), so
+customers are first grouped into blocks that share a blocking key - the
+normalized phone number, the lower-cased email, or the Soundex code of the
+surname with the first initial - and only pairs within a block are scored.
+Blocks larger than `max_block_size` (a surname like Smith, a shop's
+placeholder number) are skipped rather than exploding into pairs.
+
+Candidate pairs are scored in one vectorized pass: half the score is a
+shared phone number or email, the rest the cosine similarity of
+character-bigram vectors of the last and first names (a sparse matrix, one
+row per customer). A shared contact needs a similar name, and a same name
+needs a shared contact, to reach the default `min_score`. Pairs at or
+above `min_score` are joined into groups with connected components; each
+group's suggested survivor is the customer with the most orders (oldest
+on ties). Merging is left to staff via the customer `merge` endpoint.
+"""
+import re
+import time
+import zlib
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from .models import Customer, Order
+
+# Hashed bigram columns of the name vectors
+NAME_FEATURES = 1 << 18
+
+# Score weights: a shared phone or email, last name, first name
+WEIGHTS = (0.5, 0.3, 0.2)
+
+_soundex_digits = {
+    letter: digit
+    for digit, letters in {'1': 'bfpv', '2': 'cgjkqsxz', '3': 'dt', '4': 'l', '5': 'mn', '6': 'r'}.items()
+    for letter in letters
+}
+_non_letters = re.compile(r'[^a-z]')
+
+
+def soundex(name):
+    """American Soundex code of a name ('Robert' -> 'R163'); '' if it has no letters"""
+    letters = _non_letters.sub('', (name or '').lower())
+    if not letters:
+        return ''
+    code = letters[0].upper()
+    previous = _soundex_digits.get(letters[0], '')
+    for letter in letters[1:]:
+        digit = _soundex_digits.get(letter, '')
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # H and W don't separate letters with the same code; vowels do
+        if letter not in 'hw':
+            previous = digit
+    return code.ljust(4, '0')
+
+
+def blocking_keys(first_name, last_name, phone_normalized, email):
+    """The blocks a customer falls into"""
+    keys = []
+    if phone_normalized:
+        keys.append('p:' + phone_normalized)
+    if email and email.strip():
+        keys.append('e:' + email.strip().lower())
+    surname = soundex(last_name)
+    if surname:
+        initial = _non_letters.sub('', (first_name or '').lower())[:1]
+        keys.append(f'n:{surname}{initial}')
+    return keys
+
+
+def candidate_pairs(keys_per_row, max_block_size):
+    """
+    Unique (i, j) row pairs, i < j, sharing a blocking key, as two index
+    arrays; also returns the number of blocks skipped as too large.
+    """
+    blocks = defaultdict(list)
+    for row, keys in enumerate(keys_per_row):
+        for key in keys:
+            blocks[key].append(row)
+
+    left, right = [], []
+    oversized = 0
+    for rows in blocks.values():
+        if len(rows) < 2:
+            continue
+        if len(rows) > max_block_size:
+            oversized += 1
+            continue
+        rows = np.asarray(rows, dtype=np.int64)
+        i, j = np.triu_indices(len(rows), k=1)
+        left.append(rows[i])
+        right.append(rows[j])
+    if not left:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, oversized
+
+    n = len(keys_per_row)
+    codes = np.unique(np.concatenate(left) * n + np.concatenate(right))
+    return codes // n, codes % n, oversized
+
+
+def name_vectors(names):
+    """L2-normalized sparse rows of hashed character bigrams, one per name"""
+    rows, columns = [], []
+    for row, name in enumerate(names):
+        padded = f" {_non_letters.sub('', (name or '').lower())} "
+        for start in range(len(padded) - 1):
+            rows.append(row)
+            columns.append(zlib.crc32(padded[start:start + 2].encode()) % NAME_FEATURES)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float64), (rows, columns)),
+        shape=(len(names), NAME_FEATURES),
+    )
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(1.0 / norms) @ matrix
+
+
+def pair_similarity(vectors, left, right):
+    """Cosine similarity of vectors[left[k]] and vectors[right[k]] for every k"""
+    return np.asarray(vectors[left].multiply(vectors[right]).sum(axis=1)).ravel()
+
+
+def score_pairs(columns, left, right):
+    """Duplicate score in [0, 1] for each candidate pair"""
+    phone, email = columns['phone'], columns['email']
+    same_phone = (phone[left] == phone[right]) & (phone[left] != '')
+    same_email = (email[left] == email[right]) & (email[left] != '')
+    last = pair_similarity(columns['last_vectors'], left, right)
+    first = pair_similarity(columns['first_vectors'], left, right)
+    contact_weight, last_weight, first_weight = WEIGHTS
+    return contact_weight * (same_phone | same_email) + last_weight * last + first_weight * first
+
+
+def find_duplicates(branch=None, using='default', min_score=None, max_block_size=None,
+                    max_reported=500, progress=None):
+    """
+    Find groups of probable duplicate customers.
+
+    Returns counts, timings and up to `max_reported` groups (highest score
+    first), each with the suggested survivor and the other customer ids.
+    `progress(step, steps)` is called after each phase.
+    """
+    if min_score is None:
+        min_score = getattr(settings, 'DEDUPE_MIN_SCORE', 0.6)
+    if max_block_size is None:
+        max_block_size = getattr(settings, 'DEDUPE_MAX_BLOCK_SIZE', 200)
+    started = time.perf_counter()
+
+    customers = Customer.objects.using(using)
+    orders = Order.objects.using(using)
+    if branch is not None:
+        customers = customers.filter(branch=branch)
+        orders = orders.filter(branch=branch)
+    rows = list(
+        customers.order_by('customer_id')
+        .values_list('customer_id', 'first_name', 'last_name', 'phone_normalized', 'email')
+    )
+    order_counts = dict(
+        orders.order_by().values('customer_id').annotate(count=Count('pk')).values_list('customer_id', 'count')
+    )
+    loaded = time.perf_counter()
+    if progress:
+        progress(1, 3)
+
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    left, right, oversized = candidate_pairs([blocking_keys(*row[1:]) for row in rows], max_block_size)
+    blocked = time.perf_counter()
+    if progress:
+        progress(2, 3)
+
+    summary = {
+        'customers': len(rows),
+        'candidate_pairs': int(len(left)),
+        'oversized_blocks': oversized,
+        'duplicate_pairs': 0,
+        'groups': 0,
+        'duplicates': [],
+    }
+    if len(left):
+        columns = {
+            'phone': np.array([row[3] or '' for row in rows], dtype=object),
+            'email': np.array([(row[4] or '').strip().lower() for row in rows], dtype=object),
+            'first_vectors': name_vectors([row[1] for row in rows]),
+            'last_vectors': name_vectors([row[2] for row in rows]),
+        }
+        scores = score_pairs(columns, left, right)
+        matched = scores >= min_score
+        left, right, scores = left[matched], right[matched], scores[matched]
+        summary['duplicate_pairs'] = int(len(left))
+
+        graph = sparse.coo_matrix((np.ones(len(left)), (left, right)), shape=(len(rows), len(rows)))
+        _, labels = connected_components(graph, directed=False)
+        group_scores = defaultdict(float)
+        for label, score in zip(labels[left], scores):
+            group_scores[label] = max(group_scores[label], float(score))
+        members = defaultdict(list)
+        for row in np.flatnonzero(np.isin(labels, list(group_scores))):
+            members[labels[row]].append(int(ids[row]))
+
+        groups = []
+        for label, customer_ids in members.items():
+            survivor = max(customer_ids, key=lambda customer_id: (order_counts.get(customer_id, 0), -customer_id))
+            groups.append({
+                'survivor': survivor,
+                'duplicate_ids': sorted(customer_id for customer_id in customer_ids if customer_id != survivor),
+                'score': round(group_scores[label], 3),
+            })
+        groups.sort(key=lambda group: (-group['score'], group['survivor']))
+        summary['groups'] = len(groups)
+        summary['duplicates'] = groups[:max_reported]
+    finished = time.perf_counter()
+    if progress:
+        progress(3, 3)
+
+    summary['seconds'] = {
+        'load': round(loaded - started, 3),
+        'block': round(blocked - loaded, 3),
+        'score': round(finished - blocked, 3),
+    }
+    return summary
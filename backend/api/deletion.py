@@ -0,0 +1,143 @@
+"""
+Fast set-based deletes for customers and orders.
+
+Django's delete collector loads every cascaded `Order` and `OrderProduct`
+into memory so it can send per-object signals. Our only delete handler is
+the sync tombstone recorder, which we can replicate in bulk, so when no
+other handlers are connected these helpers delete with a few plain
+DELETE ... WHERE id IN (...) statements per chunk inside one transaction.
+The autocomplete index, kitchen capacity, order document and working set
+handlers are replicated the same way.
+If any other pre/post_delete receiver is connected they fall back to the
+regular collector so those receivers still run.
+
+`QuerySet._raw_delete` and `Signal._live_receivers` are private Django
+APIs. requirements.txt pins Django below 5.0, and the deletion tests cover
+both the raw path and the collector fallback, so an upgrade that changes
+either API fails the test suite.
+"""
+from django.db import transaction
+from django.db.models.signals import pre_delete, post_delete
+
+from . import read_models
+from .branches import current_database
+from .autocomplete import prefix_index_for
+from .capacity import release_orders
+from .working_set import orders_deleted
+from .models import Customer, CustomerSegment, Order, OrderDocument, OrderProduct, Tombstone
+from .signals import (
+    record_tombstone, forget_autocomplete, release_line_capacity, refresh_document_after_line_delete,
+    forget_working_set
+)
+
+# Keeps every IN (...) list under SQLite's bound-parameter limit
+CHUNK_SIZE = 500
+
+# post_delete receivers these helpers replicate in bulk
+BULK_RECEIVERS = (
+    record_tombstone, forget_autocomplete, release_line_capacity, refresh_document_after_line_delete,
+    forget_working_set
+)
+
+
+def _live_receivers(signal, model):
+    receivers = signal._live_receivers(model)
+    if isinstance(receivers, tuple):
+        # Django 5.0+ returns (sync_receivers, async_receivers)
+        receivers = [*receivers[0], *receivers[1]]
+    return receivers
+
+
+def can_fast_delete(*models):
+    """True when deleting these models needs no Python signal handlers"""
+    for model in models:
+        if pre_delete.has_listeners(model):
+            return False
+        if any(receiver not in BULK_RECEIVERS for receiver in _live_receivers(post_delete, model)):
+            return False
+    return True
+
+
+def _chunks(ids):
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def _tombstones(model, rows):
+    """Tombstones for (pk, branch_id) rows"""
+    label = model._meta.label_lower
+    Tombstone.objects.using(current_database()).bulk_create(
+        [Tombstone(model_name=label, object_id=object_id, branch_id=branch_id) for object_id, branch_id in rows],
+        batch_size=CHUNK_SIZE,
+    )
+
+
+def _delete_orders(rows):
+    """Delete orders given as (order_id, branch_id) rows"""
+    for chunk_rows in _chunks(rows):
+        chunk = [order_id for order_id, _ in chunk_rows]
+        _tombstones(Order, chunk_rows)
+        release_orders(Order.objects.filter(order_id__in=chunk))
+        lines = OrderProduct.objects.filter(order_id__in=chunk)
+        lines._raw_delete(lines.db)
+        documents = OrderDocument.objects.filter(order_id__in=chunk)
+        documents._raw_delete(documents.db)
+        orders = Order.objects.filter(order_id__in=chunk)
+        orders._raw_delete(orders.db)
+        orders_deleted(chunk, orders.db)
+
+
+def delete_orders(order_ids):
+    """Delete orders and their lines; returns the number of orders deleted"""
+    if not can_fast_delete(Order, OrderProduct, OrderDocument):
+        return Order.objects.filter(order_id__in=order_ids).delete()[1].get(Order._meta.label, 0)
+
+    deleted = 0
+    with transaction.atomic(using=current_database()):
+        for chunk in _chunks(list(order_ids)):
+            existing = list(
+                Order.objects.filter(order_id__in=chunk).order_by().values_list('order_id', 'branch_id')
+            )
+            _delete_orders(existing)
+            deleted += len(existing)
+    return deleted
+
+
+def delete_order_lines(order_ids):
+    """Delete every line of the given orders, keeping the orders; returns the number of lines deleted"""
+    if not can_fast_delete(OrderProduct):
+        return OrderProduct.objects.filter(order_id__in=order_ids).delete()[0]
+
+    deleted = 0
+    with transaction.atomic(using=current_database()):
+        for chunk in _chunks(list(order_ids)):
+            release_orders(Order.objects.filter(order_id__in=chunk))
+            lines = OrderProduct.objects.filter(order_id__in=chunk)
+            deleted += lines._raw_delete(lines.db)
+            read_models.schedule_refresh(chunk, lines.db)
+    return deleted
+
+
+def delete_customers(customer_ids):
+    """Delete customers with all their orders; returns the number of customers deleted"""
+    if not can_fast_delete(Customer, CustomerSegment, Order, OrderProduct, OrderDocument):
+        return Customer.objects.filter(customer_id__in=customer_ids).delete()[1].get(Customer._meta.label, 0)
+
+    deleted = 0
+    with transaction.atomic(using=current_database()):
+        for chunk in _chunks(list(customer_ids)):
+            rows = list(
+                Customer.objects.filter(customer_id__in=chunk).order_by().values_list('customer_id', 'branch_id')
+            )
+            existing = [customer_id for customer_id, _ in rows]
+            _delete_orders(list(
+                Order.objects.filter(customer_id__in=existing).order_by().values_list('order_id', 'branch_id')
+            ))
+            _tombstones(Customer, rows)
+            segments = CustomerSegment.objects.filter(customer_id__in=existing)
+            segments._raw_delete(segments.db)
+            customers = Customer.objects.filter(customer_id__in=existing)
+            customers._raw_delete(customers.db)
+            prefix_index_for(Customer, customers.db).discard(existing)
+            deleted += len(existing)
+    return deleted
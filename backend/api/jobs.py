@@ -0,0 +1,220 @@
+"""
+Lightweight DB-backed background jobs.
+
+Tasks are plain functions registered with `@task`; `enqueue()` stores a
+`Job` row and `manage.py run_worker` runs them in a pool of processes.
+Jobs are claimed with a conditional UPDATE (status='queued' -> 'running'),
+so any number of workers can poll the same table without a broker and
+without row locks, on PostgreSQL and SQLite alike. For tasks with a
+`concurrency` cap the same UPDATE also requires fewer than that many
+running jobs of the task; on PostgreSQL it runs under a per-task advisory
+lock so two workers can't both take the last free place.
+
+Workers requeue jobs whose heartbeat stopped (their worker crashed or was
+killed) every `JOB_REQUEUE_INTERVAL` seconds; a job that has already used
+all its attempts is marked failed instead, so a job that kills its worker
+isn't retried forever.
+"""
+import logging
+import os
+import socket
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count, F, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .branches import current_branch
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+class Task:
+    """A registered background task"""
+
+    def __init__(self, func, name, max_attempts=3, concurrency=None):
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+        self.concurrency = concurrency
+
+    def enqueue(self, user=None, **kwargs):
+        return enqueue(self.name, user=user, **kwargs)
+
+
+def task(name=None, max_attempts=3, concurrency=None):
+    """
+    Register a function as a background task.
+
+    The function is called as func(job, **kwargs) and its return value
+    (anything JSON-serializable) is stored as the job result. `concurrency`
+    caps how many jobs of this task may run at once across all workers.
+    """
+    def decorator(func):
+        registered = Task(func, name or func.__name__, max_attempts, concurrency)
+        _registry[registered.name] = registered
+        return registered
+    return decorator
+
+
+def get_task(name):
+    return _registry[name]
+
+
+def enqueue(name, user=None, **kwargs):
+    """Queue a registered task and return its Job"""
+    registered = get_task(name)
+    return Job.objects.create(
+        name=registered.name,
+        kwargs=kwargs,
+        max_attempts=registered.max_attempts,
+        created_by=user if user is not None and user.is_authenticated else None,
+        branch=current_branch(),
+    )
+
+
+def set_progress(job, done, total=None, message=''):
+    """Record progress on a running job (also serves as its heartbeat)"""
+    fraction = done if total is None else (done / total if total else 1.0)
+    job.progress = max(0.0, min(float(fraction), 1.0))
+    job.progress_message = message[:255]
+    job.heartbeat_at = timezone.now()
+    Job.objects.filter(pk=job.pk).update(
+        progress=job.progress,
+        progress_message=job.progress_message,
+        heartbeat_at=job.heartbeat_at,
+    )
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def requeue_stale_jobs():
+    """
+    Put back jobs whose worker stopped sending heartbeats; those out of
+    attempts are marked failed. Returns the number requeued.
+    """
+    timeout = getattr(settings, 'JOB_STALE_AFTER', 600)
+    now = timezone.now()
+    stale = Job.objects.filter(status='running', heartbeat_at__lt=now - timedelta(seconds=timeout))
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status='failed',
+        error='Worker stopped responding',
+        finished_at=now,
+    )
+    if failed:
+        logger.warning("Marked %s stale job(s) failed after their last attempt", failed)
+    return stale.update(status='queued', worker='', run_after=now)
+
+
+@contextmanager
+def _task_lock(name):
+    """Serialize claims of one capped task across workers"""
+    with transaction.atomic(using=Job.objects.db):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [f'job:{name}'])
+        yield
+
+
+def _claim(job_id, name, worker, now):
+    """Claim one queued job; False if it was taken or its task is at its concurrency cap"""
+    claimed = Job.objects.filter(pk=job_id, status='queued')
+    updates = {'status': 'running', 'worker': worker, 'started_at': now, 'heartbeat_at': now}
+    registered = _registry.get(name)
+    if registered is None or registered.concurrency is None:
+        return bool(claimed.update(**updates))
+
+    running = (
+        Job.objects.filter(name=name, status='running')
+        .order_by().values('name').annotate(count=Count('job_id')).values('count')
+    )
+    with _task_lock(name):
+        return bool(
+            claimed.alias(running=Coalesce(Subquery(running), Value(0)))
+            .filter(running__lt=registered.concurrency)
+            .update(**updates)
+        )
+
+
+def claim_next(worker):
+    """Atomically claim the next runnable job, or return None"""
+    now = timezone.now()
+    candidates = list(
+        Job.objects.filter(status='queued', run_after__lte=now)
+        .order_by('run_after', 'job_id')
+        .values_list('job_id', 'name')[:20]
+    )
+    for job_id, name in candidates:
+        if _claim(job_id, name, worker, now):
+            return Job.objects.get(pk=job_id)
+    return None
+
+
+def run_job(job):
+    """Execute a claimed job and record its outcome"""
+    job.attempts += 1
+    Job.objects.filter(pk=job.pk).update(attempts=job.attempts)
+
+    try:
+        registered = get_task(job.name)
+        result = registered.func(job, **job.kwargs)
+    except Exception:
+        job.error = traceback.format_exc()
+        logger.exception("Job #%s (%s) failed on attempt %s", job.pk, job.name, job.attempts)
+        if job.attempts < job.max_attempts:
+            backoff = getattr(settings, 'JOB_RETRY_BACKOFF', 30) * 2 ** (job.attempts - 1)
+            Job.objects.filter(pk=job.pk).update(
+                status='queued',
+                error=job.error,
+                worker='',
+                run_after=timezone.now() + timedelta(seconds=backoff),
+            )
+        else:
+            Job.objects.filter(pk=job.pk).update(
+                status='failed',
+                error=job.error,
+                finished_at=timezone.now(),
+            )
+        return False
+
+    Job.objects.filter(pk=job.pk).update(
+        status='succeeded',
+        result=result,
+        progress=1.0,
+        error='',
+        finished_at=timezone.now(),
+    )
+    return True
+
+
+def work(stop_event, poll_interval=1.0, burst=False):
+    """
+    Poll for and run jobs until stop_event is set (one worker process).
+
+    With burst=True the loop exits as soon as no job is runnable.
+    """
+    name = worker_name()
+    requeue_interval = getattr(settings, 'JOB_REQUEUE_INTERVAL', 60)
+    requeued_at = time.monotonic()
+    while not stop_event.is_set():
+        close_old_connections()
+        if time.monotonic() - requeued_at >= requeue_interval:
+            requeue_stale_jobs()
+            requeued_at = time.monotonic()
+        job = claim_next(name)
+        if job is None:
+            if burst:
+                break
+            stop_event.wait(poll_interval)
+            continue
+        run_job(job)
@@ -0,0 +1,124 @@
+"""
+Benchmark API renderers and response compression on large order pages.
+
+Builds in-memory orders (no database access) shaped exactly like the
+`OrderViewSet` list payload and times serialization, rendering and
+compression for each renderer.
+
+Usage:
+    python manage.py bench_renderers --orders 1000 --lines 3 --repeat 5
+"""
+import gzip
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from api.models import Customer, Product, Order, OrderProduct
+from api.renderers import ORJSONRenderer, MessagePackRenderer
+from api.serializers import OrderSerializer
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+
+class Command(BaseCommand):
+    help = 'Benchmark JSON/MessagePack rendering and compression on order list pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000, help='Orders per page')
+        parser.add_argument('--lines', type=int, default=3, help='Line items per order')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed iterations (best is reported)')
+
+    def handle(self, *args, **options):
+        orders = self.build_orders(options['orders'], options['lines'])
+        repeat = options['repeat']
+
+        elapsed, data = self.best_of(repeat, lambda: OrderSerializer(orders, many=True).data)
+        self.stdout.write(f"Serializer ({len(orders)} orders): {elapsed * 1000:.1f} ms")
+
+        page = {'count': len(data), 'next': None, 'previous': None, 'results': data}
+        renderers = [
+            ('DRF JSONRenderer', JSONRenderer()),
+            ('ORJSONRenderer', ORJSONRenderer()),
+            ('MessagePackRenderer', MessagePackRenderer()),
+        ]
+
+        baseline = None
+        for name, renderer in renderers:
+            elapsed, body = self.best_of(repeat, lambda: renderer.render(page))
+            if baseline is None:
+                baseline = body
+            elif isinstance(renderer, ORJSONRenderer) and body != baseline:
+                self.stderr.write(self.style.ERROR('ORJSONRenderer output differs from DRF JSONRenderer'))
+            self.stdout.write(f"{name:<22} {elapsed * 1000:8.1f} ms  {len(body):>10,} bytes")
+
+        gzip_elapsed, gzipped = self.best_of(repeat, lambda: gzip.compress(baseline, compresslevel=6))
+        self.stdout.write(f"{'gzip (level 6)':<22} {gzip_elapsed * 1000:8.1f} ms  {len(gzipped):>10,} bytes")
+        if brotli is not None:
+            br_elapsed, brotlied = self.best_of(repeat, lambda: brotli.compress(baseline, quality=4))
+            self.stdout.write(f"{'brotli (quality 4)':<22} {br_elapsed * 1000:8.1f} ms  {len(brotlied):>10,} bytes")
+
+    def best_of(self, repeat, func):
+        best, result = None, None
+        for _ in range(max(repeat, 1)):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def build_orders(self, count, lines):
+        now = timezone.now()
+        products = [
+            Product(
+                product_id=i + 1,
+                product_name=f"Product {i + 1}",
+                product_price=Decimal('4.50') + Decimal(i) / 4,
+                product_type=Product.PRODUCT_TYPES[i % len(Product.PRODUCT_TYPES)][0],
+                product_suitability=Product.SUITABILITY_CHOICES[i % len(Product.SUITABILITY_CHOICES)][0],
+            )
+            for i in range(50)
+        ]
+
+        orders = []
+        for i in range(count):
+            customer = Customer(
+                customer_id=i % 500 + 1,
+                first_name='Customer',
+                last_name=str(i % 500 + 1),
+                phone_number='07700 900000',
+            )
+            customer.full_name = f"{customer.first_name} {customer.last_name}"
+            order = Order(
+                order_id=i + 1,
+                customer=customer,
+                method_of_payment='card',
+                order_placed=now - timedelta(minutes=i),
+                order_due=now + timedelta(hours=1),
+                status='pending',
+                created_at=now,
+                updated_at=now,
+            )
+            order_products = []
+            total = Decimal('0.00')
+            for j in range(lines):
+                product = products[(i + j) % len(products)]
+                line = OrderProduct(
+                    order_product_id=i * lines + j + 1,
+                    order=order,
+                    product=product,
+                    quantity=j + 1,
+                    unit_price=product.product_price,
+                )
+                total += line.line_total
+                order_products.append(line)
+            order.total_price = total
+            order._prefetched_objects_cache = {'order_products': order_products}
+            orders.append(order)
+        return orders
@@ -0,0 +1,217 @@
+"""
+Benchmark concurrent reads and order writes on SQLite, stock vs hardened.
+
+For each mode a scratch database is migrated and seeded, then reader and
+writer processes run side by side for a fixed time. Readers fetch order
+list pages; writers create orders with lines and recompute the total, the
+same read-then-write pattern as the order endpoints. With Django's stock
+SQLite settings (rollback journal, deferred transactions) readers stall
+while a writer commits and writers fail with "database is locked"; in the
+hardened mode (WAL, busy_timeout, BEGIN IMMEDIATE writes with retry) reads
+never wait for writes.
+
+Usage:
+    python manage.py bench_sqlite_concurrency --readers 4 --writers 2 --duration 10
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+MODES = {
+    'stock': {'SQLITE_HARDENED': 'false'},
+    'hardened': {'SQLITE_HARDENED': 'true'},
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent read/write latency on SQLite with stock and hardened settings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4, help='Reader processes')
+        parser.add_argument('--writers', type=int, default=2, help='Writer processes')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per mode')
+        parser.add_argument('--orders', type=int, default=2000, help='Orders seeded before the run')
+        parser.add_argument('--modes', default='stock,hardened', help='Comma-separated modes to run')
+        parser.add_argument('--output', help='Write the JSON report here')
+        parser.add_argument('--role', choices=['seed', 'reader', 'writer'], help=argparse.SUPPRESS)
+        parser.add_argument('--start-at', type=float, default=0, help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['role']:
+            return getattr(self, f"run_{options['role']}")(options)
+
+        report = {}
+        for mode in filter(None, options['modes'].split(',')):
+            report[mode] = self.run_mode(mode, options)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        self.stderr.write(f"\n{'mode':<10}{'op':<7}{'ops':>8}{'ops/s':>9}{'p50':>9}{'p99':>9}{'max':>9}{'errors':>8}")
+        for mode, results in report.items():
+            for op in ('reads', 'writes'):
+                stats = results[op]
+                self.stderr.write(
+                    f"{mode:<10}{op:<7}{stats['ops']:>8}{stats['ops_per_s']:>9.1f}"
+                    f"{stats['p50_ms']:>9.1f}{stats['p99_ms']:>9.1f}{stats['max_ms']:>9.1f}{stats['errors']:>8}"
+                )
+
+    def run_mode(self, mode, options):
+        scratch = tempfile.mkdtemp(prefix=f'bench_sqlite_{mode}_')
+        env = dict(
+            os.environ, USE_SQLITE='true', DEBUG='false', BRANCH_DATABASES='',
+            SQLITE_PATH=os.path.join(scratch, 'db.sqlite3'), **MODES[mode],
+        )
+        manage = [sys.executable, str(settings.BASE_DIR / 'manage.py')]
+        try:
+            subprocess.run(manage + ['migrate', '--verbosity', '0'], env=env, check=True)
+            subprocess.run(
+                manage + ['bench_sqlite_concurrency', '--role', 'seed', '--orders', str(options['orders'])],
+                env=env, check=True,
+            )
+            self.stderr.write(f"{mode}: {options['readers']} reader(s), {options['writers']} writer(s) for {options['duration']:.0f}s")
+            start_at = time.time() + 2
+            workers = [
+                subprocess.Popen(
+                    manage + [
+                        'bench_sqlite_concurrency', '--role', role,
+                        '--duration', str(options['duration']), '--start-at', str(start_at),
+                    ],
+                    env=env, stdout=subprocess.PIPE, text=True,
+                )
+                for role in ['reader'] * options['readers'] + ['writer'] * options['writers']
+            ]
+            results = {'reader': [], 'writer': []}
+            for worker in workers:
+                stdout, _ = worker.communicate()
+                result = json.loads(stdout.strip().splitlines()[-1])
+                results[result['role']].append(result)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        return {
+            'reads': self.summarize(results['reader'], options['duration']),
+            'writes': self.summarize(results['writer'], options['duration']),
+        }
+
+    def summarize(self, results, duration):
+        latencies = np.array([latency for result in results for latency in result['latencies']]) * 1000
+        errors = sum(result['errors'] for result in results)
+        if not len(latencies):
+            return {'ops': 0, 'ops_per_s': 0.0, 'errors': errors, 'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0}
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        return {
+            'ops': len(latencies),
+            'ops_per_s': round(len(latencies) / duration, 1),
+            'errors': errors,
+            'p50_ms': round(float(p50), 2),
+            'p95_ms': round(float(p95), 2),
+            'p99_ms': round(float(p99), 2),
+            'max_ms': round(float(latencies.max()), 2),
+        }
+
+    # ---------------------------------------------------------------- workers
+
+    def run_seed(self, options):
+        from django.db import transaction
+        from django.utils import timezone
+
+        from api.models import Branch, Customer, Product, Order, OrderProduct
+
+        branch = Branch.objects.get(code=settings.DEFAULT_BRANCH)
+        now = timezone.now()
+        with transaction.atomic():
+            customers = Customer.objects.bulk_create([
+                Customer(branch=branch, first_name='Bench', last_name=str(i), phone_number=f'07700{i:06d}')
+                for i in range(200)
+            ])
+            products = Product.objects.bulk_create([
+                Product(branch=branch, product_name=f'Product {i}', product_price=Decimal('2.50'), product_type='main')
+                for i in range(20)
+            ])
+            orders = Order.objects.bulk_create([
+                Order(
+                    branch=branch, customer=customers[i % len(customers)], method_of_payment='card',
+                    order_placed=now - timedelta(minutes=i), order_due=now, total_price=Decimal('5.00'),
+                )
+                for i in range(options['orders'])
+            ], batch_size=2000)
+            OrderProduct.objects.bulk_create([
+                OrderProduct(order=order, product=products[i % len(products)], quantity=2, unit_price=Decimal('2.50'),
+                             product_name=products[i % len(products)].product_name, product_type='main')
+                for i, order in enumerate(orders)
+            ], batch_size=2000)
+
+    def _timed_loop(self, options, operation, role):
+        from django.db import OperationalError
+
+        # Start every worker at the same moment
+        time.sleep(max(options['start_at'] - time.time(), 0))
+        deadline = time.monotonic() + options['duration']
+        latencies, errors = [], 0
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                operation()
+            except OperationalError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+        self.stdout.write(json.dumps({'role': role, 'latencies': latencies, 'errors': errors}))
+
+    def run_reader(self, options):
+        from api.models import Order
+
+        def read_page():
+            list(
+                Order.objects.select_related('customer').prefetch_related('order_products')
+                .order_by('-order_placed')[:50]
+            )
+
+        self._timed_loop(options, read_page, 'reader')
+
+    def run_writer(self, options):
+        from django.db import transaction
+
+        from api.db import run_in_write_transaction
+        from api.models import Customer, Product, Order, OrderProduct
+
+        hardened = settings.DATABASES['default']['ENGINE'] == 'core.db_backends.sqlite3'
+        customer_ids = list(Customer.objects.values_list('pk', flat=True))
+        product_ids = list(Product.objects.values_list('pk', flat=True))
+        counter = iter(range(10 ** 9))
+
+        def write_order():
+            n = next(counter)
+            customer = Customer.objects.get(pk=customer_ids[n % len(customer_ids)])
+            order = Order.objects.create(
+                branch_id=customer.branch_id, customer=customer, method_of_payment='card',
+                order_placed=customer.created_at, order_due=customer.created_at,
+            )
+            for product in Product.objects.filter(pk__in=product_ids[n % 10:n % 10 + 3]):
+                OrderProduct.objects.create(order=order, product=product, quantity=1, unit_price=product.product_price)
+            order.calculate_total()
+            order.save()
+
+        if hardened:
+            self._timed_loop(options, lambda: run_in_write_transaction(write_order, using='default'), 'writer')
+        else:
+            def stock_write():
+                with transaction.atomic():
+                    write_order()
+            self._timed_loop(options, stock_write, 'writer')
@@ -0,0 +1,463 @@
+"""
+Mixed-workload load test against a freshly seeded copy of the app.
+
+Creates a throwaway SQLite database (or uses an empty PostgreSQL database
+given with --postgres-db), migrates and seeds it at the requested scale,
+starts the app under gunicorn or uvicorn, and drives it with simulated
+tills: each logs in, then loops over a weighted mix of customer searches,
+order creates, add_product calls, list reads and dashboard reads until the
+test ends. Throughput, p50/p95/p99 latency and error rates per endpoint are
+written as JSON.
+
+Usage:
+    python manage.py load_test --customers 10000 --orders 50000 --users 50 --duration 60
+    python manage.py load_test --server uvicorn --workers 4 --output report.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+USER_PASSWORD = 'load-test-password'
+
+FIRST_NAMES = ['Amelia', 'Oliver', 'Isla', 'George', 'Ava', 'Noah', 'Mia', 'Leo', 'Ivy', 'Arthur', 'Grace', 'Oscar']
+LAST_NAMES = ['Smith', 'Jones', 'Taylor', 'Brown', 'Williams', 'Wilson', 'Johnson', 'Davies', 'Patel', 'Wright']
+PRODUCT_WORDS = ['Chocolate', 'Vanilla', 'Lemon', 'Fudge', 'Carrot', 'Red Velvet', 'Coffee', 'Cheese', 'Raspberry']
+PRODUCT_KINDS = ['Cake', 'Cupcake', 'Brownie', 'Tart', 'Cookie', 'Slice', 'Muffin']
+
+DEFAULT_MIX = {
+    'customers.autocomplete': 25,
+    'customers.search': 10,
+    'products.list': 10,
+    'orders.list': 15,
+    'orders.create': 15,
+    'orders.add_product': 15,
+    'dashboard.stats': 10,
+}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Till(threading.Thread):
+    """One simulated user: logs in, then runs the request mix until the deadline"""
+
+    def __init__(self, harness, index):
+        super().__init__(daemon=True)
+        self.harness = harness
+        self.index = index
+        self.random = random.Random(index)
+        self.connection = http.client.HTTPConnection('127.0.0.1', harness.port, timeout=30)
+        self.token = None
+
+    def request(self, label, method, path, body=None):
+        headers = {'Accept': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Token {self.token}'
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+
+        start = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            payload = response.read()
+            status = response.status
+            if response.getheader('Connection', '').lower() == 'close':
+                self.connection.close()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            payload, status = b'', 0
+        self.harness.record(label, status, time.perf_counter() - start, start)
+        if 200 <= status < 300 and payload:
+            try:
+                return json.loads(payload)
+            except ValueError:
+                return None
+        return None
+
+    def run(self):
+        time.sleep(self.harness.ramp_up * self.index / max(self.harness.users, 1))
+        data = self.request('auth.login', 'POST', '/api/auth/login/', {
+            'username': f'loadtest{self.index % self.harness.seeded["staff"]}',
+            'password': USER_PASSWORD,
+        })
+        if not data:
+            return
+        self.token = data['token']
+
+        labels, weights = zip(*self.harness.mix.items())
+        while time.monotonic() < self.harness.deadline:
+            label = self.random.choices(labels, weights)[0]
+            getattr(self, label.replace('.', '_'))()
+            if self.harness.think_time:
+                time.sleep(self.random.expovariate(1 / self.harness.think_time))
+        self.connection.close()
+
+    def _customer_id(self):
+        seeded = self.harness.seeded
+        return self.random.randint(seeded['first_customer'], seeded['last_customer'])
+
+    def _product_id(self):
+        seeded = self.harness.seeded
+        return self.random.randint(seeded['first_product'], seeded['last_product'])
+
+    def customers_autocomplete(self):
+        prefix = self.random.choice(FIRST_NAMES + LAST_NAMES)[:self.random.randint(2, 4)]
+        self.request('customers.autocomplete', 'GET', f'/api/customers/autocomplete/?q={prefix}')
+
+    def customers_search(self):
+        term = self.random.choice(LAST_NAMES)[:3]
+        self.request('customers.search', 'GET', f'/api/customers/?search={term}')
+
+    def products_list(self):
+        self.request('products.list', 'GET', '/api/products/?active_only=true')
+
+    def orders_list(self):
+        if self.random.random() < 0.5:
+            path = f'/api/orders/?status={self.random.choice(["pending", "confirmed", "completed"])}'
+        else:
+            path = f'/api/orders/?customer={self._customer_id()}'
+        self.request('orders.list', 'GET', path)
+
+    def orders_create(self):
+        now = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        product_ids = {self._product_id() for _ in range(self.random.randint(1, 4))}
+        self.request('orders.create', 'POST', '/api/orders/', {
+            'customer': self._customer_id(),
+            'method_of_payment': 'card',
+            'order_placed': now,
+            'order_due': now,
+            'status': 'pending',
+            'products': [{'product': pid, 'quantity': self.random.randint(1, 3)} for pid in product_ids],
+        })
+
+    def orders_add_product(self):
+        # The create response doesn't include the id, so add to a recent seeded order
+        seeded = self.harness.seeded
+        order_id = self.random.randint(max(seeded['first_order'], seeded['last_order'] - 500), seeded['last_order'])
+        self.request('orders.add_product', 'POST', f'/api/orders/{order_id}/add_product/', {
+            'product_id': self._product_id(),
+            'quantity': 1,
+        })
+
+    def dashboard_stats(self):
+        self.request('dashboard.stats', 'GET', '/api/dashboard/stats/')
+
+
+class Command(BaseCommand):
+    help = 'Seed a scratch database, serve it with gunicorn/uvicorn and run a mixed-workload load test'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=10000)
+        parser.add_argument('--products', type=int, default=200)
+        parser.add_argument('--orders', type=int, default=50000)
+        parser.add_argument('--staff', type=int, default=20, help='Staff accounts the simulated users log in as')
+        parser.add_argument('--users', type=int, default=20, help='Concurrent simulated users')
+        parser.add_argument('--duration', type=float, default=60, help='Seconds to run after ramp-up')
+        parser.add_argument('--ramp-up', type=float, default=5, help='Seconds over which users start')
+        parser.add_argument('--think-time', type=float, default=0, help='Mean pause between a user\'s requests (s)')
+        parser.add_argument('--mix', default='', help='Weights, e.g. "orders.create=30,dashboard.stats=5"')
+        parser.add_argument('--server', choices=['gunicorn', 'uvicorn'], default='gunicorn')
+        parser.add_argument('--workers', type=int, default=4, help='Server worker processes')
+        parser.add_argument('--threads', type=int, default=1, help='Threads per gunicorn worker')
+        parser.add_argument('--postgres-db', help='Use this (empty) PostgreSQL database instead of scratch SQLite')
+        parser.add_argument(
+            '--limits', action='store_true',
+            help='Keep throttling and load shedding on (off by default, so the test measures raw capacity)'
+        )
+        parser.add_argument('--keep-db', action='store_true', help='Keep the scratch SQLite database')
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+        parser.add_argument('--seed-only', action='store_true', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['seed_only']:
+            return self.seed(options)
+
+        self.mix = dict(DEFAULT_MIX)
+        for item in filter(None, options['mix'].split(',')):
+            label, _, weight = item.partition('=')
+            if label.strip() not in DEFAULT_MIX:
+                raise CommandError(f"Unknown mix entry '{label}'. Choose from: {', '.join(DEFAULT_MIX)}")
+            self.mix[label.strip()] = float(weight)
+        self.mix = {label: weight for label, weight in self.mix.items() if weight > 0}
+
+        scratch = None
+        env = dict(os.environ, DEBUG='false', BRANCH_DATABASES='')
+        if not options['limits']:
+            env.update(THROTTLING_ENABLED='false', LOAD_SHED_MAX_IN_FLIGHT='0', LOAD_SHED_MAX_QUEUE_MS='0')
+        if options['postgres_db']:
+            env.update(USE_SQLITE='false', DB_NAME=options['postgres_db'])
+        else:
+            scratch = tempfile.mkdtemp(prefix='load_test_')
+            env.update(USE_SQLITE='true', SQLITE_PATH=os.path.join(scratch, 'db.sqlite3'))
+            env.setdefault('SQLITE_HARDENED', 'true')
+
+        server = None
+        try:
+            manage = [sys.executable, str(settings.BASE_DIR / 'manage.py')]
+            self.stderr.write('Migrating scratch database...')
+            subprocess.run(manage + ['migrate', '--verbosity', '0'], env=env, check=True)
+            self.stderr.write('Seeding...')
+            seed = subprocess.run(
+                manage + ['load_test', '--seed-only'] + self._seed_args(options),
+                env=env, check=True, capture_output=True, text=True,
+            )
+            self.seeded = json.loads(seed.stdout.strip().splitlines()[-1])
+
+            self.port = _free_port()
+            server = self.start_server(options, env)
+            report = self.run_load(options)
+        finally:
+            if server is not None:
+                server.terminate()
+                try:
+                    server.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+            if scratch and not options['keep_db']:
+                shutil.rmtree(scratch, ignore_errors=True)
+            elif scratch:
+                self.stderr.write(f'Scratch database kept in {scratch}')
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        self.write_summary(report)
+
+    def _seed_args(self, options):
+        return [
+            '--customers', str(options['customers']),
+            '--products', str(options['products']),
+            '--orders', str(options['orders']),
+            '--staff', str(options['staff']),
+        ]
+
+    # ---------------------------------------------------------------- seeding
+
+    def seed(self, options):
+        from django.contrib.auth.hashers import make_password
+        from django.db import transaction
+        from django.utils import timezone
+
+        from api import capacity, read_models
+        from api.models import Branch, Staff, Customer, Product, Order, OrderProduct
+
+        rng = random.Random(0)
+        branch = Branch.objects.get(code=settings.DEFAULT_BRANCH)
+        password = make_password(USER_PASSWORD)
+        now = timezone.now()
+
+        with transaction.atomic():
+            Staff.objects.bulk_create([
+                Staff(username=f'loadtest{i}', password=password, is_staff=True)
+                for i in range(options['staff'])
+            ])
+            customers = Customer.objects.bulk_create([
+                Customer(
+                    branch=branch,
+                    first_name=rng.choice(FIRST_NAMES),
+                    last_name=f'{rng.choice(LAST_NAMES)}{i}',
+                    phone_number=f'07700{i:06d}',
+                    phone_normalized=f'+447700{i:06d}',
+                    email=f'customer{i}@example.com',
+                )
+                for i in range(options['customers'])
+            ], batch_size=2000)
+            products = Product.objects.bulk_create([
+                Product(
+                    branch=branch,
+                    product_name=f'{rng.choice(PRODUCT_WORDS)} {rng.choice(PRODUCT_KINDS)} {i}',
+                    product_price=Decimal(rng.randint(150, 2500)) / 100,
+                    product_type='main',
+                )
+                for i in range(options['products'])
+            ], batch_size=2000)
+
+            order_ids = []
+            for start in range(0, options['orders'], 2000):
+                batch = range(start, min(start + 2000, options['orders']))
+                lines_by_order = [rng.sample(products, rng.randint(1, min(4, len(products)))) for _ in batch]
+                orders = Order.objects.bulk_create([
+                    Order(
+                        branch=branch,
+                        customer=rng.choice(customers),
+                        method_of_payment='card',
+                        order_placed=now - timedelta(minutes=i),
+                        order_due=now - timedelta(minutes=i) + timedelta(hours=1),
+                        status=rng.choice(['pending', 'confirmed', 'completed']),
+                        total_price=sum(product.product_price for product in lines),
+                    )
+                    for i, lines in zip(batch, lines_by_order)
+                ])
+                order_ids.extend(order.pk for order in orders)
+                OrderProduct.objects.bulk_create([
+                    OrderProduct(
+                        order=order, product=product, quantity=1, unit_price=product.product_price,
+                        product_name=product.product_name, product_type=product.product_type,
+                        product_suitability=product.product_suitability,
+                    )
+                    for order, lines in zip(orders, lines_by_order)
+                    for product in lines
+                ])
+
+        # bulk_create skips the signals that keep these derived tables current
+        capacity.rebuild()
+        read_models.rebuild()
+
+        self.stdout.write(json.dumps({
+            'staff': options['staff'],
+            'first_customer': customers[0].pk,
+            'last_customer': customers[-1].pk,
+            'first_product': products[0].pk,
+            'last_product': products[-1].pk,
+            'first_order': order_ids[0] if order_ids else 0,
+            'last_order': order_ids[-1] if order_ids else 0,
+        }))
+
+    # ----------------------------------------------------------------- server
+
+    def start_server(self, options, env):
+        bind = f'127.0.0.1:{self.port}'
+        if options['server'] == 'gunicorn':
+            command = [
+                sys.executable, '-m', 'gunicorn', 'core.wsgi:application',
+                '--bind', bind, '--workers', str(options['workers']),
+                '--threads', str(options['threads']), '--log-level', 'warning',
+            ]
+        else:
+            command = [
+                sys.executable, '-m', 'uvicorn', 'core.asgi:application',
+                '--host', '127.0.0.1', '--port', str(self.port),
+                '--workers', str(options['workers']), '--log-level', 'warning',
+            ]
+        self.stderr.write(f"Starting {options['server']} on {bind} with {options['workers']} worker(s)...")
+        server = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env)
+
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f"{options['server']} exited with status {server.returncode}")
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=2)
+                connection.request('GET', '/api/')
+                connection.getresponse().read()
+                connection.close()
+                return server
+            except OSError:
+                time.sleep(0.2)
+        server.kill()
+        raise CommandError('Server did not start within 60 seconds')
+
+    # ------------------------------------------------------------------- load
+
+    def run_load(self, options):
+        self.users = options['users']
+        self.ramp_up = options['ramp_up']
+        self.think_time = options['think_time']
+        self.samples = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.lock = threading.Lock()
+
+        started = time.monotonic()
+        # Requests that start during ramp-up aren't reported
+        self.measure_from = time.perf_counter() + self.ramp_up
+        self.deadline = started + self.ramp_up + options['duration']
+        self.stderr.write(f"Running {self.users} user(s) for {options['duration']:.0f}s...")
+
+        tills = [Till(self, i) for i in range(self.users)]
+        for till in tills:
+            till.start()
+        for till in tills:
+            till.join()
+        measured = time.perf_counter() - self.measure_from
+
+        return self.build_report(options, measured)
+
+    def record(self, label, status, elapsed, started):
+        with self.lock:
+            self.statuses[label][status] += 1
+            # Logins all happen during ramp-up, so they're always reported
+            if started >= self.measure_from or label == 'auth.login':
+                self.samples[label].append((elapsed, status))
+
+    def build_report(self, options, measured):
+        def summarize(samples):
+            latencies = np.array([elapsed for elapsed, _ in samples]) * 1000
+            errors = sum(1 for _, status in samples if not 200 <= status < 400)
+            if not len(latencies):
+                return {'requests': 0, 'errors': 0}
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            return {
+                'requests': len(samples),
+                'errors': errors,
+                'error_rate': round(errors / len(samples), 4),
+                'throughput_rps': round(len(samples) / measured, 2),
+                'latency_ms': {
+                    'mean': round(float(latencies.mean()), 2),
+                    'p50': round(float(p50), 2),
+                    'p95': round(float(p95), 2),
+                    'p99': round(float(p99), 2),
+                    'max': round(float(latencies.max()), 2),
+                },
+            }
+
+        endpoints = {}
+        for label in sorted(self.samples):
+            endpoints[label] = summarize(self.samples[label])
+            endpoints[label]['status_codes'] = {
+                str(status): count for status, count in sorted(self.statuses[label].items())
+            }
+        everything = [sample for samples in self.samples.values() for sample in samples]
+
+        return {
+            'config': {
+                'server': options['server'],
+                'workers': options['workers'],
+                'threads': options['threads'],
+                'database': 'postgresql' if options['postgres_db'] else 'sqlite',
+                'users': options['users'],
+                'duration_s': options['duration'],
+                'think_time_s': options['think_time'],
+                'scale': {key: options[key] for key in ('customers', 'products', 'orders')},
+                'mix': self.mix,
+            },
+            'measured_s': round(measured, 2),
+            'total': summarize(everything),
+            'endpoints': endpoints,
+        }
+
+    def write_summary(self, report):
+        self.stderr.write(f"\n{'endpoint':<24}{'req':>8}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'err%':>8}")
+        rows = list(report['endpoints'].items()) + [('TOTAL', report['total'])]
+        for label, stats in rows:
+            if not stats['requests']:
+                continue
+            latency = stats['latency_ms']
+            self.stderr.write(
+                f"{label:<24}{stats['requests']:>8}{stats['throughput_rps']:>9.1f}"
+                f"{latency['p50']:>9.1f}{latency['p95']:>9.1f}{latency['p99']:>9.1f}"
+                f"{stats['error_rate'] * 100:>7.1f}%"
+            )
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from api.models import AllergenInfo
+
+
+class Command(BaseCommand):
+    help = "Migrate each branch database and copy allergen reference data into it"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'databases', nargs='*',
+            help="Database aliases to migrate (default: all of BRANCH_DATABASES)",
+        )
+
+    def handle(self, *args, **options):
+        aliases = options['databases'] or list(settings.BRANCH_DATABASES)
+        if not aliases:
+            self.stdout.write("No branch databases configured (BRANCH_DATABASES is empty).")
+            return
+
+        allergens = list(AllergenInfo.objects.using('default').all())
+        for alias in aliases:
+            self.stdout.write(f"Migrating '{alias}'...")
+            call_command('migrate', database=alias, interactive=False, verbosity=options['verbosity'])
+            for allergen in allergens:
+                AllergenInfo.objects.using(alias).update_or_create(
+                    allergen_id=allergen.allergen_id,
+                    defaults={
+                        'allergen_name': allergen.allergen_name,
+                        'description': allergen.description,
+                    },
+                )
+            self.stdout.write(self.style.SUCCESS(
+                f"'{alias}' is up to date ({len(allergens)} allergens synced)."
+            ))
@@ -0,0 +1,56 @@
+"""
+Delete expired sessions and auth tokens nobody can use any more.
+
+Sessions past their expiry date and the tokens of deactivated staff are
+removed in batches, so the delete never holds a long lock on
+django_session or authtoken_token. With --token-idle-days, tokens of staff
+who haven't logged in for that many days are removed as well (they'll have
+to log in again).
+
+Usage:
+    python manage.py purge_auth
+    python manage.py purge_auth --token-idle-days 90 --batch-size 1000
+"""
+from datetime import timedelta
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from api.deletion import CHUNK_SIZE
+
+
+def _purge(queryset, key, batch_size):
+    purged = 0
+    while True:
+        batch = list(queryset.values_list(key, flat=True)[:batch_size])
+        if not batch:
+            return purged
+        purged += queryset.model.objects.filter(**{f'{key}__in': batch}).delete()[0]
+
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions and tokens of inactive or long-idle staff'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--token-idle-days', type=int, default=None,
+            help="Also delete tokens of staff who haven't logged in for this many days",
+        )
+        parser.add_argument('--batch-size', type=int, default=CHUNK_SIZE, help='Rows deleted per statement')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        now = timezone.now()
+
+        sessions = _purge(Session.objects.filter(expire_date__lt=now), 'session_key', batch_size)
+
+        stale = Q(user__is_active=False)
+        if options['token_idle_days'] is not None:
+            cutoff = now - timedelta(days=options['token_idle_days'])
+            stale |= Q(user__last_login__lt=cutoff) | Q(user__last_login__isnull=True, created__lt=cutoff)
+        tokens = _purge(Token.objects.filter(stale), 'key', batch_size)
+
+        self.stdout.write(self.style.SUCCESS(f"Purged {sessions} session(s) and {tokens} token(s)"))
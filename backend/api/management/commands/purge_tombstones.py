@@ -0,0 +1,45 @@
+"""
+Delete sync tombstones older than the retention period.
+
+Usage:
+    python manage.py purge_tombstones
+    python manage.py purge_tombstones --days 14 --batch-size 10000
+    python manage.py purge_tombstones --branch north
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.branches import current_database, use_branch
+from api.models import Tombstone
+
+
+class Command(BaseCommand):
+    help = 'Delete delta sync tombstones older than SYNC_TOMBSTONE_RETENTION_DAYS'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            default=getattr(settings, 'SYNC_TOMBSTONE_RETENTION_DAYS', 30),
+            help='Keep tombstones newer than this many days',
+        )
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows deleted per statement')
+        parser.add_argument('--branch', help="Branch code whose database to purge (default: the default database)")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        with use_branch(options['branch']):
+            using = current_database()
+        tombstones = Tombstone.objects.using(using)
+        purged = 0
+        while True:
+            batch = list(
+                tombstones.filter(deleted_at__lt=cutoff)
+                .values_list('tombstone_id', flat=True)[:options['batch_size']]
+            )
+            if not batch:
+                break
+            purged += tombstones.filter(tombstone_id__in=batch).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} tombstone(s) on '{using}'."))
@@ -0,0 +1,28 @@
+"""
+Recompute the kitchen capacity calendar from the orders.
+
+The calendar is kept up to date as orders change; run this after loading
+orders outside the app (bulk imports, SQL fixes) or changing
+KITCHEN_SLOT_MINUTES.
+
+Usage:
+    python manage.py rebuild_capacity
+    python manage.py rebuild_capacity --branch north
+"""
+from django.core.management.base import BaseCommand
+
+from api.branches import current_database, use_branch
+from api.capacity import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the kitchen capacity calendar from order lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--branch', help="Branch code whose database to rebuild (default: the default database)")
+
+    def handle(self, *args, **options):
+        with use_branch(options['branch']):
+            using = current_database()
+            slots = rebuild(using=using)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {slots} capacity slot(s) on '{using}'."))
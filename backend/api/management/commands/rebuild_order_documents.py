@@ -0,0 +1,38 @@
+"""
+Regenerate the stored API documents of every order.
+
+Documents are kept up to date as orders change; run this after upgrading,
+after loading orders outside the app, or after changing `OrderSerializer`.
+
+Usage:
+    python manage.py rebuild_order_documents
+    python manage.py rebuild_order_documents --branch north
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.branches import current_database, use_branch
+from api.read_models import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Regenerate the pre-serialized order documents served by the order endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--branch', help="Branch code whose database to rebuild (default: the default database)")
+        parser.add_argument('--batch-size', type=int, default=500, help='Orders rendered per batch')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+
+        def progress(done, total):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  {done}/{total}")
+
+        with use_branch(options['branch']):
+            using = current_database()
+            count = rebuild(using=using, batch_size=options['batch_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {count} order document(s) on '{using}' in {time.perf_counter() - started:.1f}s."
+        ))
@@ -0,0 +1,46 @@
+"""
+Report or repair orders whose total_price doesn't match their line items.
+
+Usage:
+    python manage.py reconcile_order_totals              # report only
+    python manage.py reconcile_order_totals --fix        # repair mismatches
+    python manage.py reconcile_order_totals --batch-size 5000
+"""
+from django.core.management.base import BaseCommand
+
+from api.reconciliation import reconcile_order_totals
+
+
+class Command(BaseCommand):
+    help = 'Recompute order totals as SUM(unit_price * quantity) and report or repair mismatches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Repair mismatched totals')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Orders per batch')
+        parser.add_argument('--max-reported', type=int, default=100, help='Mismatches to list individually')
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+
+        def progress(checked, mismatched, upper_bound):
+            if verbosity > 1:
+                self.stdout.write(f"  up to order #{upper_bound - 1}: {checked} checked, {mismatched} mismatched")
+
+        summary = reconcile_order_totals(
+            batch_size=options['batch_size'],
+            fix=options['fix'],
+            max_reported=options['max_reported'],
+            progress=progress,
+        )
+
+        for mismatch in summary['mismatches']:
+            self.stdout.write(
+                f"Order #{mismatch['order_id']}: stored £{mismatch['stored_total']}, "
+                f"computed £{mismatch['computed_total']}"
+            )
+
+        message = f"Checked {summary['checked']} orders, {summary['mismatched']} mismatched"
+        if options['fix']:
+            message += f", {summary['fixed']} repaired"
+        style = self.style.SUCCESS if not summary['mismatched'] or options['fix'] else self.style.WARNING
+        self.stdout.write(style(message))
@@ -0,0 +1,71 @@
+"""
+Run background jobs from the job table in a pool of worker processes.
+
+Usage:
+    python manage.py run_worker                  # JOB_WORKER_PROCESSES processes
+    python manage.py run_worker --processes 4 --poll-interval 0.5
+    python manage.py run_worker --processes 1 --burst   # drain the queue and exit
+"""
+import multiprocessing
+import signal
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+def _worker_main(stop_event, poll_interval, burst):
+    # Let the parent handle Ctrl+C; children stop via stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # No-op when forked; needed where processes are spawned (Windows, macOS)
+    django.setup()
+    from api.jobs import work
+    work(stop_event, poll_interval=poll_interval, burst=burst)
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs (no external broker required)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int,
+            default=getattr(settings, 'JOB_WORKER_PROCESSES', 2),
+            help='Number of worker processes',
+        )
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between polls when idle')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        from api.jobs import requeue_stale_jobs
+
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(self.style.WARNING(f"Requeued {requeued} stale job(s)"))
+
+        # Child processes must open their own database connections
+        connections.close_all()
+
+        stop_event = multiprocessing.Event()
+        workers = [
+            multiprocessing.Process(
+                target=_worker_main,
+                args=(stop_event, options['poll_interval'], options['burst']),
+                daemon=True,
+            )
+            for _ in range(max(options['processes'], 1))
+        ]
+
+        def shutdown(signum, frame):
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        for worker in workers:
+            worker.start()
+        self.stdout.write(self.style.SUCCESS(f"Started {len(workers)} worker process(es)"))
+
+        for worker in workers:
+            worker.join()
+        self.stdout.write("Workers stopped")
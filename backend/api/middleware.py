@@ -0,0 +1,321 @@
+"""
+Custom middleware for the API.
+"""
+import cProfile
+import io
+import os
+import pstats
+import re
+import secrets
+import threading
+import time
+import traceback
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.db import connections
+from django.http import JsonResponse
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - gzip only
+    brotli = None
+
+
+re_accepts_brotli = re.compile(r'\bbr\b')
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compress responses with brotli or gzip once they pass a size threshold.
+
+    Brotli is preferred when the client accepts it and the `brotli` package
+    is installed; otherwise Django's gzip handling is used. Responses smaller
+    than `RESPONSE_COMPRESSION_MIN_SIZE` are sent as-is, since compressing
+    them costs more CPU than it saves on the wire.
+
+    Like Django's gzip path, which writes a random-length file name into the
+    gzip header, brotli output is padded against BREACH: a metadata block of
+    1 to `max_random_bytes` random bytes, which decoders skip, goes before
+    the compressed content so its length no longer tracks what matched.
+    """
+
+    def brotli_compress(self, content):
+        quality = getattr(settings, 'RESPONSE_COMPRESSION_BROTLI_QUALITY', 4)
+        compressor = brotli.Compressor(quality=quality)
+        # Flushing the empty start leaves the stream byte-aligned for the padding
+        head = compressor.process(b'') + compressor.flush()
+        size = secrets.randbelow(self.max_random_bytes) + 1
+        # Metadata meta-block (RFC 7932 9.2): ISLAST=0, MNIBBLES=0, MSKIPBYTES=1, MSKIPLEN=size
+        padding = ((3 << 1) | (1 << 4) | ((size - 1) << 6)).to_bytes(2, 'little') + os.urandom(size)
+        return head + padding + compressor.process(content) + compressor.finish()
+
+    def process_response(self, request, response):
+        min_size = getattr(settings, 'RESPONSE_COMPRESSION_MIN_SIZE', 1024)
+        if not response.streaming and len(response.content) < min_size:
+            return response
+
+        ae = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if (
+            brotli is None
+            or response.streaming
+            or response.has_header('Content-Encoding')
+            or not re_accepts_brotli.search(ae)
+        ):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        compressed_content = self.brotli_compress(response.content)
+        if len(compressed_content) >= len(response.content):
+            return response
+        response.content = compressed_content
+        response.headers['Content-Length'] = str(len(response.content))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+
+        return response
+
+
+class APISessionMiddleware(SessionMiddleware):
+    """
+    Django's session middleware, skipped for stateless API requests.
+
+    With `API_STATELESS` on, requests under `API_STATELESS_PATHS` that
+    authenticate with `Authorization: Token` get an empty session that is
+    never loaded or saved: the session cookie is ignored, no django_session
+    row is read or written and no cookie is set. Requests without a token
+    (the browsable API) and other paths (the admin) keep normal sessions.
+    """
+    
+    def _is_stateless(self, request):
+        if not getattr(settings, 'API_STATELESS', False):
+            return False
+        keyword = request.META.get('HTTP_AUTHORIZATION', '').split(' ', 1)[0]
+        if keyword.lower() != 'token':
+            return False
+        return any(request.path.startswith(prefix) for prefix in getattr(settings, 'API_STATELESS_PATHS', ()))
+    
+    def process_request(self, request):
+        if self._is_stateless(request):
+            request.session = self.SessionStore()
+            request.stateless_session = True
+        else:
+            super().process_request(request)
+    
+    def process_response(self, request, response):
+        if getattr(request, 'stateless_session', False):
+            return response
+        return super().process_response(request, response)
+
+
+class QueryRecorder:
+    """Database execute wrapper that times each statement and notes its call site"""
+    
+    def __init__(self, alias, queries):
+        self.alias = alias
+        self.queries = queries
+    
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'db': self.alias,
+                'sql': sql,
+                'many': many,
+                'duration_ms': round((time.perf_counter() - start) * 1000, 3),
+                'stack': _project_stack(),
+            })
+
+
+def _project_stack(limit=6):
+    """The innermost frames from our own code (not Django or other packages)"""
+    base_dir = str(settings.BASE_DIR) + os.sep
+    frames = [
+        f"{os.path.relpath(frame.filename, base_dir)}:{frame.lineno} in {frame.name}"
+        for frame in traceback.extract_stack()[:-2]
+        if frame.filename.startswith(base_dir)
+        and 'site-packages' not in frame.filename
+        and frame.filename != __file__
+    ]
+    return frames[-limit:]
+
+
+class ProfilingMiddleware:
+    """
+    Profile a single request on demand.
+    
+    Staff send `X-Profile: 1` (or `?profile=1`) to run the request under
+    cProfile with every SQL statement timed and attributed to the code that
+    issued it. The result is stored as a `RequestProfile` (listed in the
+    admin) and its id is returned in the `X-Profile-Id` header along with a
+    `Server-Timing` summary. Requests without the flag, or with any value
+    other than `1`, `true`, `yes` or `on`, pass straight through.
+    """
+    
+    flag_values = frozenset(('1', 'true', 'yes', 'on'))
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def _requested(self, request):
+        flags = (request.META.get('HTTP_X_PROFILE', ''), request.GET.get('profile', ''))
+        return any(flag.strip().lower() in self.flag_values for flag in flags)
+    
+    def __call__(self, request):
+        if not self._requested(request):
+            return self.get_response(request)
+        
+        user = self._staff_user(request)
+        if user is None:
+            return self.get_response(request)
+        
+        queries = []
+        profiler = cProfile.Profile()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(QueryRecorder(connection.alias, queries)))
+            start = time.perf_counter()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is already active on this thread
+                return self.get_response(request)
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            duration_ms = (time.perf_counter() - start) * 1000
+        
+        profile = self._save(request, response, user, profiler, queries, duration_ms)
+        sql_time_ms = profile.sql_time_ms
+        response['X-Profile-Id'] = str(profile.pk)
+        response['Server-Timing'] = (
+            f'total;dur={duration_ms:.1f}, sql;dur={sql_time_ms:.1f};desc="{len(queries)} queries"'
+        )
+        return response
+    
+    def _staff_user(self, request):
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            try:
+                authenticated = TokenAuthentication().authenticate(request)
+            except AuthenticationFailed:
+                return None
+            user = authenticated[0] if authenticated else None
+        if user is not None and user.is_authenticated and user.is_staff:
+            return user
+        return None
+    
+    def _save(self, request, response, user, profiler, queries, duration_ms):
+        from .models import RequestProfile
+        
+        report = io.StringIO()
+        stats = pstats.Stats(profiler, stream=report)
+        stats.sort_stats('cumulative').print_stats(getattr(settings, 'REQUEST_PROFILE_TOP_FUNCTIONS', 60))
+        
+        profile = RequestProfile.objects.create(
+            method=request.method,
+            path=request.path[:500],
+            query_string=request.META.get('QUERY_STRING', ''),
+            status_code=response.status_code,
+            duration_ms=round(duration_ms, 3),
+            sql_count=len(queries),
+            sql_time_ms=round(sum(query['duration_ms'] for query in queries), 3),
+            queries=queries,
+            stats=report.getvalue(),
+            user=user,
+        )
+        
+        keep = getattr(settings, 'REQUEST_PROFILE_KEEP', 200)
+        cutoff = list(
+            RequestProfile.objects.order_by('-pk').values_list('pk', flat=True)[keep:keep + 1]
+        )
+        if cutoff:
+            RequestProfile.objects.filter(pk__lte=cutoff[0]).delete()
+        return profile
+
+
+class LoadSheddingMiddleware:
+    """
+    Turn away low-priority reads with 503 when this worker is overloaded.
+
+    A worker counts as overloaded when the request waited in the proxy
+    queue longer than `LOAD_SHED_MAX_QUEUE_MS` (from the `X-Request-Start`
+    header, as set by nginx or Heroku), or when more than
+    `LOAD_SHED_MAX_IN_FLIGHT` requests are running in it. The in-flight
+    count is per process: a sync gunicorn worker only ever has one request,
+    so that check needs threaded or ASGI workers. Only GET/HEAD requests outside
+    `LOAD_SHED_PROTECTED_PATHS` are shed; order writes and logins always go
+    through, so tills stay responsive while dashboards and polling back off
+    for `Retry-After` seconds.
+    """
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._lock = threading.Lock()
+        self.in_flight = 0
+    
+    def __call__(self, request):
+        with self._lock:
+            self.in_flight += 1
+            in_flight = self.in_flight
+        try:
+            if self._is_low_priority(request) and self._overloaded(request, in_flight):
+                return self._shed()
+            return self.get_response(request)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+    
+    def _is_low_priority(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        protected = getattr(settings, 'LOAD_SHED_PROTECTED_PATHS', ())
+        return not any(request.path.startswith(prefix) for prefix in protected)
+    
+    def _overloaded(self, request, in_flight):
+        max_in_flight = getattr(settings, 'LOAD_SHED_MAX_IN_FLIGHT', 0)
+        if max_in_flight and in_flight > max_in_flight:
+            return True
+        max_queue_ms = getattr(settings, 'LOAD_SHED_MAX_QUEUE_MS', 0)
+        if max_queue_ms:
+            queue_ms = request_queue_ms(request)
+            return queue_ms is not None and queue_ms > max_queue_ms
+        return False
+    
+    def _shed(self):
+        response = JsonResponse({
+            'success': False,
+            'message': 'Server is busy, please retry shortly'
+        }, status=503)
+        response['Retry-After'] = str(getattr(settings, 'LOAD_SHED_RETRY_AFTER', 2))
+        return response
+
+
+def request_queue_ms(request, now=None):
+    """
+    Milliseconds since the proxy received the request, from X-Request-Start.
+
+    Accepts `t=<timestamp>` or a bare timestamp in seconds, milliseconds or
+    microseconds; returns None when the header is missing or unreadable.
+    """
+    header = request.META.get('HTTP_X_REQUEST_START', '')
+    try:
+        started = float(header.strip().removeprefix('t='))
+    except ValueError:
+        return None
+    # Scale by magnitude: seconds ~1e9, milliseconds ~1e12, microseconds ~1e15
+    while started > 1e11:
+        started /= 1000
+    return max(((time.time() if now is None else now) - started) * 1000, 0.0)
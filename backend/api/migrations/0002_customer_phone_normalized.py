@@ -0,0 +1,47 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:17
+
+from django.db import migrations, models
+
+from api.utils import normalize_phone
+
+
+def populate_phone_normalized(apps, schema_editor):
+    Customer = apps.get_model('api', 'Customer')
+    batch_size = 2000
+    last_pk = 0
+    while True:
+        batch = list(
+            Customer.objects.filter(customer_id__gt=last_pk)
+            .order_by('customer_id')
+            .only('customer_id', 'phone_number')[:batch_size]
+        )
+        if not batch:
+            break
+        for customer in batch:
+            customer.phone_normalized = normalize_phone(customer.phone_number)
+        Customer.objects.bulk_update(batch, ['phone_normalized'])
+        last_pk = batch[-1].customer_id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='phone_normalized',
+            field=models.CharField(blank=True, editable=False, help_text='phone_number in E.164 form, used for exact lookups', max_length=24),
+        ),
+        migrations.RunPython(populate_phone_normalized, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['phone_normalized'], name='customer_phone_norm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', '-order_placed'], name='order_customer_placed_idx'),
+        ),
+    ]
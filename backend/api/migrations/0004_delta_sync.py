@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:20
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('tombstone_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('model_name', models.CharField(help_text='Model label, e.g. api.order', max_length=100)),
+                ('object_id', models.IntegerField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Tombstone',
+                'verbose_name_plural': 'Tombstones',
+                'db_table': 'tbl_tombstones',
+                'ordering': ['deleted_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['updated_at', 'customer_id'], name='customer_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['updated_at', 'order_id'], name='order_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['updated_at', 'product_id'], name='product_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['model_name', 'deleted_at'], name='tombstone_model_deleted_idx'),
+        ),
+    ]
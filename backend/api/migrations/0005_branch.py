@@ -0,0 +1,69 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_main_branch(apps, schema_editor):
+    """Put all existing data in a 'main' branch on the default database"""
+    db_alias = schema_editor.connection.alias
+    Branch = apps.get_model('api', 'Branch')
+    main, _ = Branch.objects.using(db_alias).get_or_create(
+        code='main', defaults={'name': 'Main', 'database': 'default'}
+    )
+    for model_name in ('Customer', 'Product', 'Order'):
+        model = apps.get_model('api', model_name)
+        model.objects.using(db_alias).filter(branch__isnull=True).update(branch_id=main.pk)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_delta_sync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Branch',
+            fields=[
+                ('branch_id', models.AutoField(primary_key=True, serialize=False)),
+                ('code', models.SlugField(help_text='Short code sent in the X-Branch header', unique=True)),
+                ('name', models.CharField(max_length=200)),
+                ('database', models.CharField(default='default', help_text="Database alias (settings.DATABASES) holding this branch's data", max_length=100)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Branch',
+                'verbose_name_plural': 'Branches',
+                'db_table': 'tbl_branches',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='branch',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='customers', to='api.branch'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='branch',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='orders', to='api.branch'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='branch',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='products', to='api.branch'),
+        ),
+        migrations.AddField(
+            model_name='staff',
+            name='branches',
+            field=models.ManyToManyField(blank=True, related_name='staff', to='api.branch'),
+        ),
+        migrations.RunPython(
+            create_main_branch,
+            migrations.RunPython.noop,
+            hints={'model_name': 'branch'},
+        ),
+    ]
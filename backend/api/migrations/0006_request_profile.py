@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_branch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('profile_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=500)),
+                ('query_string', models.TextField(blank=True)),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('duration_ms', models.FloatField()),
+                ('sql_count', models.PositiveIntegerField(default=0)),
+                ('sql_time_ms', models.FloatField(default=0.0)),
+                ('queries', models.JSONField(blank=True, default=list, help_text='SQL statements with timings and call sites')),
+                ('stats', models.TextField(blank=True, help_text='cProfile report, by cumulative time')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='request_profiles', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Request profile',
+                'verbose_name_plural': 'Request profiles',
+                'db_table': 'tbl_request_profiles',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:30
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+
+def snapshot_products(apps, schema_editor):
+    """Copy product details onto existing lines with one UPDATE per pk range"""
+    db_alias = schema_editor.connection.alias
+    OrderProduct = apps.get_model('api', 'OrderProduct')
+    Product = apps.get_model('api', 'Product')
+    product = Product.objects.using(db_alias).filter(pk=OuterRef('product_id'))
+    batch_size = 10000
+    last_pk = OrderProduct.objects.using(db_alias).aggregate(last=Max('pk'))['last'] or 0
+    for start in range(0, last_pk, batch_size):
+        OrderProduct.objects.using(db_alias).filter(pk__gt=start, pk__lte=start + batch_size).update(
+            product_name=Subquery(product.values('product_name')[:1]),
+            product_type=Subquery(product.values('product_type')[:1]),
+            product_suitability=Subquery(product.values('product_suitability')[:1]),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_request_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderproduct',
+            name='product_name',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='orderproduct',
+            name='product_suitability',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='orderproduct',
+            name='product_type',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.RunPython(
+            snapshot_products,
+            migrations.RunPython.noop,
+            hints={'model_name': 'orderproduct'},
+        ),
+    ]
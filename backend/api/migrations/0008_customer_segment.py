@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_order_product_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerSegment',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='segment', serialize=False, to='api.customer')),
+                ('recency_days', models.FloatField(help_text='Days since the last order')),
+                ('frequency', models.PositiveIntegerField(help_text='Number of orders')),
+                ('monetary', models.DecimalField(decimal_places=2, help_text='Total spent', max_digits=12)),
+                ('r_score', models.PositiveSmallIntegerField()),
+                ('f_score', models.PositiveSmallIntegerField()),
+                ('m_score', models.PositiveSmallIntegerField()),
+                ('rfm_score', models.CharField(help_text="R, F and M scores (1-5) as digits, e.g. '545'", max_length=3)),
+                ('segment', models.CharField(choices=[('champions', 'Champions'), ('loyal', 'Loyal'), ('potential_loyalist', 'Potential Loyalist'), ('new', 'New'), ('need_attention', 'Need Attention'), ('at_risk', 'At Risk'), ('hibernating', 'Hibernating')], max_length=30)),
+                ('computed_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Customer segment',
+                'verbose_name_plural': 'Customer segments',
+                'db_table': 'tbl_customer_segments',
+                'indexes': [models.Index(fields=['segment'], name='customer_segment_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:48
+
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_capacity(apps, schema_editor):
+    """Count the lines of existing non-cancelled orders into their due slots"""
+    db_alias = schema_editor.connection.alias
+    OrderProduct = apps.get_model('api', 'OrderProduct')
+    CapacitySlot = apps.get_model('api', 'CapacitySlot')
+    seconds = getattr(settings, 'KITCHEN_SLOT_MINUTES', 15) * 60
+    totals = defaultdict(int)
+    rows = (
+        OrderProduct.objects.using(db_alias)
+        .exclude(order__status='cancelled')
+        .values_list('order__branch_id', 'order__order_due', 'product_type', 'quantity')
+    )
+    for branch_id, order_due, product_type, quantity in rows.iterator(chunk_size=5000):
+        timestamp = int(order_due.timestamp())
+        start = datetime.fromtimestamp(timestamp - timestamp % seconds, tz=timezone.utc)
+        totals[(branch_id, start, product_type)] += quantity
+    CapacitySlot.objects.using(db_alias).bulk_create([
+        CapacitySlot(branch_id=branch_id, slot_start=start, product_type=product_type, quantity=quantity)
+        for (branch_id, start, product_type), quantity in totals.items()
+    ], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_customer_segment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CapacitySlot',
+            fields=[
+                ('slot_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('slot_start', models.DateTimeField()),
+                ('product_type', models.CharField(blank=True, max_length=50)),
+                ('quantity', models.IntegerField(default=0)),
+                ('branch', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='capacity_slots', to='api.branch')),
+            ],
+            options={
+                'verbose_name': 'Capacity slot',
+                'verbose_name_plural': 'Capacity slots',
+                'db_table': 'tbl_capacity_slots',
+                'indexes': [models.Index(fields=['branch', 'slot_start'], name='capacity_slot_idx')],
+                'unique_together': {('branch', 'slot_start', 'product_type')},
+            },
+        ),
+        migrations.RunPython(
+            build_capacity,
+            migrations.RunPython.noop,
+            hints={'model_name': 'capacityslot'},
+        ),
+    ]
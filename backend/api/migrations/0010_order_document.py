@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_capacity_slot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderDocument',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='document', serialize=False, to='api.order')),
+                ('document', models.TextField(help_text="The order's API representation as JSON")),
+                ('built_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Order document',
+                'verbose_name_plural': 'Order documents',
+                'db_table': 'tbl_order_documents',
+            },
+        ),
+    ]
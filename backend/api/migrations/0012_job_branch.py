@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_order_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='branch',
+            field=models.ForeignKey(blank=True, help_text='Branch the job was queued from', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to='api.branch'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_job_branch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tombstone',
+            name='branch',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='api.branch'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:18
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_branchless_duplicates(apps, schema_editor):
+    """Fold slots without a branch that the old unique_together let through into one row"""
+    CapacitySlot = apps.get_model('api', 'CapacitySlot')
+    slots = CapacitySlot.objects.using(schema_editor.connection.alias).filter(branch__isnull=True)
+    duplicates = (
+        slots.order_by().values('slot_start', 'product_type')
+        .annotate(rows=Count('pk'), keep=Min('pk'), total=Sum('quantity'))
+        .filter(rows__gt=1)
+    )
+    for duplicate in list(duplicates):
+        same = slots.filter(slot_start=duplicate['slot_start'], product_type=duplicate['product_type'])
+        same.exclude(pk=duplicate['keep']).delete()
+        same.filter(pk=duplicate['keep']).update(quantity=duplicate['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_tombstone_branch'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='capacityslot',
+            unique_together=set(),
+        ),
+        migrations.RunPython(
+            merge_branchless_duplicates,
+            migrations.RunPython.noop,
+            hints={'model_name': 'capacityslot'},
+        ),
+        migrations.AddConstraint(
+            model_name='capacityslot',
+            constraint=models.UniqueConstraint(condition=models.Q(('branch__isnull', False)), fields=('branch', 'slot_start', 'product_type'), name='capacity_slot_branch_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='capacityslot',
+            constraint=models.UniqueConstraint(condition=models.Q(('branch__isnull', True)), fields=('slot_start', 'product_type'), name='capacity_slot_no_branch_uniq'),
+        ),
+    ]
@@ -1,13 +1,50 @@
 from django.db import models
+from django.db.models import F, Sum, OuterRef, Subquery, ExpressionWrapper
+from django.db.models.functions import Coalesce, Round
 from django.contrib.auth.models import AbstractUser
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 from decimal import Decimal
 
+from .utils import normalize_phone
+
+
+class Branch(models.Model):
+    """Branch model - a shop branch whose customers, products and orders are kept together"""
+    branch_id = models.AutoField(primary_key=True)
+    code = models.SlugField(max_length=50, unique=True, help_text="Short code sent in the X-Branch header")
+    name = models.CharField(max_length=200)
+    database = models.CharField(
+        max_length=100,
+        default='default',
+        help_text="Database alias (settings.DATABASES) holding this branch's data"
+    )
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'tbl_branches'
+        ordering = ['name']
+        verbose_name = 'Branch'
+        verbose_name_plural = 'Branches'
+    
+    def clean(self):
+        from django.conf import settings
+        from django.core.exceptions import ValidationError
+        if self.database not in settings.DATABASES:
+            raise ValidationError({'database': f"Unknown database alias '{self.database}'."})
+    
+    def __str__(self):
+        return self.name
+
 
 class Staff(AbstractUser):
     """Staff model for authentication - extends Django's AbstractUser"""
     staff_user = models.CharField(max_length=100, unique=True, blank=True, null=True)
     staff_pass = models.CharField(max_length=100, blank=True, null=True)
+    branches = models.ManyToManyField(Branch, related_name='staff', blank=True)
     
     class Meta:
         db_table = 'tbl_staffs'
@@ -21,10 +58,26 @@ class Staff(AbstractUser):
 class Customer(models.Model):
     """Customer model - stores customer information"""
     customer_id = models.AutoField(primary_key=True)
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.DO_NOTHING,
+        related_name='customers',
+        blank=True,
+        null=True,
+        # Branch rows live centrally while this table may be in a branch database
+        db_constraint=False
+    )
     prefix = models.CharField(max_length=20, blank=True, null=True, help_text="e.g., Mr., Mrs., Dr.")
     first_name = models.CharField(max_length=100)
     last_name = models.CharField(max_length=100)
     phone_number = models.CharField(max_length=20)
+    phone_normalized = models.CharField(
+        # A 20-character phone_number gains up to a '+' and a country code
+        max_length=24,
+        blank=True,
+        editable=False,
+        help_text="phone_number in E.164 form, used for exact lookups"
+    )
     email = models.EmailField(max_length=255, blank=True, null=True)
     subfix = models.CharField(max_length=20, blank=True, null=True, help_text="e.g., Jr., Sr., III")
     full_name = models.CharField(max_length=250, blank=True, editable=False)
@@ -34,13 +87,25 @@ class Customer(models.Model):
     class Meta:
         db_table = 'tbl_customers'
         ordering = ['last_name', 'first_name']
+        indexes = [
+            models.Index(fields=['phone_normalized'], name='customer_phone_norm_idx'),
+            models.Index(fields=['updated_at', 'customer_id'], name='customer_updated_idx'),
+        ]
         verbose_name = 'Customer'
         verbose_name_plural = 'Customers'
     
     def save(self, *args, **kwargs):
         self.full_name = f"{self.first_name} {self.last_name}"
+        self.phone_normalized = normalize_phone(self.phone_number)
         super().save(*args, **kwargs)
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Orders embed the customer's name, so a rename refreshes their documents
+        instance._loaded_full_name = instance.__dict__.get('full_name')
+        return instance
+    
     def __str__(self):
         return self.full_name
 
@@ -68,6 +133,15 @@ class Product(models.Model):
     ]
     
     product_id = models.AutoField(primary_key=True)
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.DO_NOTHING,
+        related_name='products',
+        blank=True,
+        null=True,
+        # Branch rows live centrally while this table may be in a branch database
+        db_constraint=False
+    )
     product_name = models.CharField(max_length=200)
     product_price = models.DecimalField(
         max_digits=10, 
@@ -88,6 +162,9 @@ class Product(models.Model):
     class Meta:
         db_table = 'tbl_products'
         ordering = ['product_name']
+        indexes = [
+            models.Index(fields=['updated_at', 'product_id'], name='product_updated_idx'),
+        ]
         verbose_name = 'Product'
         verbose_name_plural = 'Products'
     
@@ -95,6 +172,92 @@ class Product(models.Model):
         return f"{self.product_name} - £{self.product_price}"
 
 
+class OrderQuerySet(models.QuerySet):
+    """QuerySet with set-based helpers for order totals and status changes"""
+
+    @staticmethod
+    def computed_total():
+        """SQL expression for an order's total: SUM(unit_price * quantity) of its lines"""
+        line_totals = (
+            OrderProduct.objects
+            .filter(order=OuterRef('pk'))
+            .values('order')
+            .annotate(total=Round(
+                Sum(ExpressionWrapper(
+                    F('unit_price') * F('quantity'),
+                    output_field=models.DecimalField(max_digits=10, decimal_places=2)
+                )),
+                2
+            ))
+            .values('total')
+        )
+        return Coalesce(
+            Subquery(line_totals, output_field=models.DecimalField(max_digits=10, decimal_places=2)),
+            Decimal('0.00'),
+            output_field=models.DecimalField(max_digits=10, decimal_places=2)
+        )
+
+    def with_computed_total(self):
+        return self.annotate(computed_total=self.computed_total())
+
+    def mismatched_totals(self):
+        """Orders whose stored total_price differs from the sum of their lines"""
+        return self.with_computed_total().exclude(total_price=F('computed_total'))
+
+    def recalculate_totals(self):
+        """Recompute total_price for every order in the queryset in one UPDATE"""
+        from .read_models import schedule_refresh
+        order_ids = list(self.values_list('pk', flat=True))
+        updated = self.update(total_price=self.computed_total(), updated_at=timezone.now())
+        schedule_refresh(order_ids, self.db)
+        return updated
+
+    def reprice(self, product, price=None):
+        """
+        Set `product`'s lines on these orders to `price` (default: its current
+        price) and recompute the orders' totals, in two UPDATEs. Returns the
+        number of lines changed.
+        """
+        price = product.product_price if price is None else price
+        repriced = (
+            OrderProduct.objects.using(self.db)
+            .filter(order__in=self.values('pk'), product=product)
+            .exclude(unit_price=price)
+            .update(unit_price=price)
+        )
+        self.recalculate_totals()
+        return repriced
+
+    def transition(self, status):
+        """
+        Move orders to `status` in one UPDATE. Only orders currently in a
+        status that may move to it are changed; returns the number changed.
+        Cancelled orders release their kitchen capacity.
+        """
+        from .capacity import release_orders
+        from .read_models import schedule_refresh
+        from .working_set import orders_updated
+        orders = self.filter(status__in=Order.predecessors(status))
+        if status == 'cancelled':
+            release_orders(orders)
+        order_ids = list(orders.values_list('pk', flat=True))
+        updated = orders.update(status=status, updated_at=timezone.now())
+        schedule_refresh(order_ids, self.db)
+        orders_updated(order_ids, self.db)
+        return updated
+
+    def reassign(self, customer):
+        """Move these orders to `customer` in one UPDATE; returns the number moved"""
+        from .read_models import schedule_refresh
+        from .working_set import orders_updated
+        orders = self.exclude(customer=customer)
+        order_ids = list(orders.values_list('pk', flat=True))
+        updated = orders.update(customer=customer, updated_at=timezone.now())
+        schedule_refresh(order_ids, self.db)
+        orders_updated(order_ids, self.db)
+        return updated
+
+
 class Order(models.Model):
     """Order model - stores order information"""
     PAYMENT_METHODS = [
@@ -112,7 +275,25 @@ class Order(models.Model):
         ('cancelled', 'Cancelled'),
     ]
     
+    # Legal status changes: current status -> statuses it may move to
+    STATUS_TRANSITIONS = {
+        'pending': ['confirmed', 'in_progress', 'completed', 'cancelled'],
+        'confirmed': ['in_progress', 'completed', 'cancelled'],
+        'in_progress': ['completed', 'cancelled'],
+        'completed': [],
+        'cancelled': [],
+    }
+    
     order_id = models.AutoField(primary_key=True)
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.DO_NOTHING,
+        related_name='orders',
+        blank=True,
+        null=True,
+        # Branch rows live centrally while this table may be in a branch database
+        db_constraint=False
+    )
     customer = models.ForeignKey(
         Customer, 
         on_delete=models.CASCADE, 
@@ -136,20 +317,44 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = OrderQuerySet.as_manager()
+    
     class Meta:
         db_table = 'tbl_orders'
         ordering = ['-order_placed']
+        indexes = [
+            models.Index(fields=['customer', '-order_placed'], name='order_customer_placed_idx'),
+            models.Index(fields=['updated_at', 'order_id'], name='order_updated_idx'),
+        ]
         verbose_name = 'Order'
         verbose_name_plural = 'Orders'
     
+    @classmethod
+    def predecessors(cls, status):
+        """Statuses an order may move to `status` from"""
+        return [current for current, targets in cls.STATUS_TRANSITIONS.items() if status in targets]
+    
     def calculate_total(self):
-        """Calculate total price from order products"""
-        total = sum(
-            op.product.product_price * op.quantity 
-            for op in self.order_products.all()
-        )
-        self.total_price = total
-        return total
+        """Calculate total price from the stored unit prices of order products"""
+        total = Order.objects.filter(pk=self.pk).with_computed_total().values_list(
+            'computed_total', flat=True
+        ).first()
+        self.total_price = Decimal(total or 0).quantize(Decimal('0.01'))
+        return self.total_price
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember where the order's lines are counted in the capacity calendar
+        instance._saved_capacity_key = instance.capacity_key()
+        return instance
+    
+    def capacity_key(self):
+        """(branch id, due time) the order's lines are counted under, or None if it doesn't count"""
+        order_due = self.__dict__.get('order_due')
+        if order_due is None or self.__dict__.get('status') == 'cancelled':
+            return None
+        return (self.__dict__.get('branch_id'), order_due)
     
     def __str__(self):
         return f"Order #{self.order_id} - {self.customer.full_name}"
@@ -174,6 +379,10 @@ class OrderProduct(models.Model):
         decimal_places=2,
         validators=[MinValueValidator(Decimal('0.00'))]
     )
+    # Product details as sold, so orders read without joining tbl_products
+    product_name = models.CharField(max_length=200, blank=True)
+    product_type = models.CharField(max_length=50, blank=True)
+    product_suitability = models.CharField(max_length=50, blank=True)
     
     class Meta:
         db_table = 'order_products'
@@ -184,14 +393,32 @@ class OrderProduct(models.Model):
     def save(self, *args, **kwargs):
         if not self.unit_price:
             self.unit_price = self.product.product_price
+        if not self.product_name or self.product_id != getattr(self, '_loaded_product_id', self.product_id):
+            self.snapshot_product()
         super().save(*args, **kwargs)
+        self._loaded_product_id = self.product_id
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded product so a changed product is re-snapshotted,
+        # and the loaded type and quantity for capacity adjustments
+        instance._loaded_product_id = instance.__dict__.get('product_id')
+        instance._loaded_capacity = (instance.__dict__.get('product_type'), instance.__dict__.get('quantity'))
+        return instance
+    
+    def snapshot_product(self):
+        """Copy the product's current name, type and suitability onto the line"""
+        self.product_name = self.product.product_name
+        self.product_type = self.product.product_type
+        self.product_suitability = self.product.product_suitability
     
     @property
     def line_total(self):
         return self.unit_price * self.quantity
     
     def __str__(self):
-        return f"{self.order} - {self.product.product_name} x{self.quantity}"
+        return f"{self.order} - {self.product_name} x{self.quantity}"
 
 
 class AllergenInfo(models.Model):
@@ -226,3 +453,218 @@ class AllergenInfo(models.Model):
     
     def __str__(self):
         return self.get_allergen_name_display()
+
+
+class Tombstone(models.Model):
+    """Record of a deleted row, so sync clients can drop it from their mirror"""
+    tombstone_id = models.BigAutoField(primary_key=True)
+    model_name = models.CharField(max_length=100, help_text="Model label, e.g. api.order")
+    object_id = models.IntegerField()
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.DO_NOTHING,
+        related_name='+',
+        blank=True,
+        null=True,
+        # Branch rows live centrally while this table may be in a branch database
+        db_constraint=False
+    )
+    deleted_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        db_table = 'tbl_tombstones'
+        ordering = ['deleted_at']
+        indexes = [
+            models.Index(fields=['model_name', 'deleted_at'], name='tombstone_model_deleted_idx'),
+        ]
+        verbose_name = 'Tombstone'
+        verbose_name_plural = 'Tombstones'
+    
+    def __str__(self):
+        return f"{self.model_name} #{self.object_id} deleted {self.deleted_at}"
+
+
+class Job(models.Model):
+    """Background job - a unit of work run by `manage.py run_worker`"""
+    JOB_STATUS = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+    ]
+    
+    job_id = models.AutoField(primary_key=True)
+    name = models.CharField(max_length=100, help_text="Registered task name")
+    kwargs = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=20, choices=JOB_STATUS, default='queued')
+    progress = models.FloatField(default=0.0, help_text="Fraction complete, 0 to 1")
+    progress_message = models.CharField(max_length=255, blank=True)
+    result = models.JSONField(blank=True, null=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    worker = models.CharField(max_length=100, blank=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    created_by = models.ForeignKey(
+        Staff,
+        on_delete=models.SET_NULL,
+        related_name='jobs',
+        blank=True,
+        null=True
+    )
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.SET_NULL,
+        related_name='jobs',
+        blank=True,
+        null=True,
+        help_text="Branch the job was queued from"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        db_table = 'tbl_jobs'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
+        verbose_name = 'Job'
+        verbose_name_plural = 'Jobs'
+    
+    def __str__(self):
+        return f"Job #{self.job_id} - {self.name} ({self.status})"
+
+
+class RequestProfile(models.Model):
+    """Profile of a single request captured on demand by a staff member"""
+    profile_id = models.BigAutoField(primary_key=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    query_string = models.TextField(blank=True)
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+    duration_ms = models.FloatField()
+    sql_count = models.PositiveIntegerField(default=0)
+    sql_time_ms = models.FloatField(default=0.0)
+    queries = models.JSONField(default=list, blank=True, help_text="SQL statements with timings and call sites")
+    stats = models.TextField(blank=True, help_text="cProfile report, by cumulative time")
+    user = models.ForeignKey(
+        Staff,
+        on_delete=models.SET_NULL,
+        related_name='request_profiles',
+        blank=True,
+        null=True
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'tbl_request_profiles'
+        ordering = ['-created_at']
+        verbose_name = 'Request profile'
+        verbose_name_plural = 'Request profiles'
+    
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
+
+
+class CustomerSegment(models.Model):
+    """Recency/frequency/monetary scores for a customer (see `api.analytics`)"""
+    SEGMENTS = [
+        ('champions', 'Champions'),
+        ('loyal', 'Loyal'),
+        ('potential_loyalist', 'Potential Loyalist'),
+        ('new', 'New'),
+        ('need_attention', 'Need Attention'),
+        ('at_risk', 'At Risk'),
+        ('hibernating', 'Hibernating'),
+    ]
+    
+    customer = models.OneToOneField(
+        Customer,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='segment'
+    )
+    recency_days = models.FloatField(help_text="Days since the last order")
+    frequency = models.PositiveIntegerField(help_text="Number of orders")
+    monetary = models.DecimalField(max_digits=12, decimal_places=2, help_text="Total spent")
+    r_score = models.PositiveSmallIntegerField()
+    f_score = models.PositiveSmallIntegerField()
+    m_score = models.PositiveSmallIntegerField()
+    rfm_score = models.CharField(max_length=3, help_text="R, F and M scores (1-5) as digits, e.g. '545'")
+    segment = models.CharField(max_length=30, choices=SEGMENTS)
+    computed_at = models.DateTimeField()
+    
+    class Meta:
+        db_table = 'tbl_customer_segments'
+        indexes = [
+            models.Index(fields=['segment'], name='customer_segment_idx'),
+        ]
+        verbose_name = 'Customer segment'
+        verbose_name_plural = 'Customer segments'
+    
+    def __str__(self):
+        return f"{self.customer_id}: {self.get_segment_display()} ({self.rfm_score})"
+
+
+class CapacitySlot(models.Model):
+    """Quantity of order lines due in one kitchen slot, per product type (see `api.capacity`)"""
+    slot_id = models.BigAutoField(primary_key=True)
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.DO_NOTHING,
+        related_name='capacity_slots',
+        blank=True,
+        null=True,
+        db_constraint=False
+    )
+    slot_start = models.DateTimeField()
+    product_type = models.CharField(max_length=50, blank=True)
+    quantity = models.IntegerField(default=0)
+    
+    class Meta:
+        db_table = 'tbl_capacity_slots'
+        # NULLs are distinct in a unique index, so slots without a branch need their own
+        constraints = [
+            models.UniqueConstraint(
+                fields=['branch', 'slot_start', 'product_type'],
+                condition=models.Q(branch__isnull=False),
+                name='capacity_slot_branch_uniq',
+            ),
+            models.UniqueConstraint(
+                fields=['slot_start', 'product_type'],
+                condition=models.Q(branch__isnull=True),
+                name='capacity_slot_no_branch_uniq',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['branch', 'slot_start'], name='capacity_slot_idx'),
+        ]
+        verbose_name = 'Capacity slot'
+        verbose_name_plural = 'Capacity slots'
+    
+    def __str__(self):
+        return f"{self.slot_start:%Y-%m-%d %H:%M} {self.product_type or '-'}: {self.quantity}"
+
+
+class OrderDocument(models.Model):
+    """An order as the API renders it, stored pre-serialized (see `api.read_models`)"""
+    order = models.OneToOneField(
+        Order,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='document'
+    )
+    document = models.TextField(help_text="The order's API representation as JSON")
+    built_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'tbl_order_documents'
+        verbose_name = 'Order document'
+        verbose_name_plural = 'Order documents'
+    
+    def __str__(self):
+        return f"Document for order #{self.order_id}"
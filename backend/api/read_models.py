@@ -0,0 +1,115 @@
+"""
+Pre-serialized order documents.
+
+An order is written a few times and read hundreds of times (tills, kitchen
+screens, the dashboard), so its API representation - the `OrderSerializer`
+output with customer name and lines - is rendered once when it changes and
+stored as JSON in `OrderDocument`. Order list and detail reads then fetch
+documents by primary key instead of joining customers and lines and running
+the serializer.
+
+Documents are regenerated in the same transaction as the change: signal
+handlers catch saves of orders, lines and customer names, and the
+set-based order updates in `OrderQuerySet` schedule their orders
+explicitly. Inside a `write_transaction` block the orders touched are
+collected and rendered once at the end of the block; elsewhere straight
+away. Orders without a document (e.g. loaded with bulk_create) are rendered
+on the fly; `manage.py rebuild_order_documents` fills them in.
+"""
+import json
+
+from django.utils import timezone
+
+from .db import commit_batch
+from .models import Order, OrderDocument
+from .renderers import ORJSONRenderer
+from .serializers import OrderSerializer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+_renderer = ORJSONRenderer()
+
+# Orders rendered per query batch
+BATCH_SIZE = 500
+
+
+def _orders(order_ids, using):
+    return (
+        Order.objects.using(using)
+        .filter(pk__in=order_ids)
+        .select_related('customer')
+        .prefetch_related('order_products')
+    )
+
+
+def render(orders):
+    """{order id: JSON document} for order instances with customer and lines loaded"""
+    return {
+        data['order_id']: _renderer.render(data).decode()
+        for data in OrderSerializer(orders, many=True).data
+    }
+
+
+def decode(document):
+    return orjson.loads(document) if orjson is not None else json.loads(document)
+
+
+def refresh(order_ids, using='default'):
+    """Regenerate the documents of these orders, dropping those of deleted orders"""
+    order_ids = list(order_ids)
+    for start in range(0, len(order_ids), BATCH_SIZE):
+        chunk = order_ids[start:start + BATCH_SIZE]
+        documents = render(_orders(chunk, using))
+        now = timezone.now()
+        OrderDocument.objects.using(using).bulk_create(
+            [
+                OrderDocument(order_id=order_id, document=document, built_at=now)
+                for order_id, document in documents.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['order'],
+            update_fields=['document', 'built_at'],
+        )
+        missing = set(chunk) - set(documents)
+        if missing:
+            OrderDocument.objects.using(using).filter(order_id__in=missing).delete()
+
+
+def schedule_refresh(order_ids, using='default'):
+    """Regenerate these orders' documents at the end of the write block (now, outside one)"""
+    order_ids = [order_id for order_id in order_ids if order_id is not None]
+    if not order_ids:
+        return
+    pending = commit_batch(('order_documents', using), lambda ids: refresh(sorted(ids), using))
+    if pending is None:
+        refresh(order_ids, using)
+    else:
+        pending.update(order_ids)
+
+
+def documents_for(order_ids, using='default'):
+    """Decoded documents for these orders in the given order, rendering any that are missing"""
+    order_ids = list(order_ids)
+    stored = dict(
+        OrderDocument.objects.using(using)
+        .filter(order_id__in=order_ids)
+        .values_list('order_id', 'document')
+    )
+    missing = [order_id for order_id in order_ids if order_id not in stored]
+    if missing:
+        stored.update(render(_orders(missing, using)))
+    return [decode(stored[order_id]) for order_id in order_ids if order_id in stored]
+
+
+def rebuild(using='default', batch_size=BATCH_SIZE, progress=None):
+    """Regenerate every order document; returns the number written"""
+    order_ids = list(Order.objects.using(using).order_by('pk').values_list('pk', flat=True))
+    OrderDocument.objects.using(using).exclude(order_id__in=Order.objects.using(using).values('pk')).delete()
+    for start in range(0, len(order_ids), batch_size):
+        refresh(order_ids[start:start + batch_size], using)
+        if progress:
+            progress(min(start + batch_size, len(order_ids)), len(order_ids))
+    return len(order_ids)
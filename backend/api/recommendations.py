@@ -0,0 +1,207 @@
+"""
+"Customers who ordered X also ordered Y" recommendations.
+
+The index is a sparse product x product co-occurrence matrix built from a
+single `values_list` dump of `OrderProduct` with NumPy/SciPy: the order x
+product incidence matrix X is assembled in CSR form and the co-occurrence
+counts are X.T @ X with the diagonal cleared.
+
+New orders are folded in incrementally: writes record their pair deltas in
+a small in-memory overlay, which is merged into the matrix once it grows
+past `COPURCHASE_DELTA_LIMIT` entries. Each worker process keeps its own
+index. It is built on first use; after `COPURCHASE_MAX_AGE` seconds one
+background thread rebuilds it while requests keep reading the old matrix,
+which also picks up changes made by other workers and order deletions. Branches kept in
+separate databases get separate indexes (see `copurchase_index_for`).
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+from scipy import sparse
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from .models import OrderProduct
+
+logger = logging.getLogger(__name__)
+
+
+def _pairs(product_ids):
+    """All ordered (a, b) pairs of distinct products in one order"""
+    unique_ids = set(product_ids)
+    return [(a, b) for a in unique_ids for b in unique_ids if a != b]
+
+
+class CoPurchaseIndex:
+    """In-memory sparse co-occurrence matrix over order line items"""
+
+    def __init__(self, using='default'):
+        self.using = using
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._matrix = None
+        self._product_ids = np.empty(0, dtype=np.int64)
+        self._positions = {}
+        self._delta = defaultdict(Counter)
+        self._delta_size = 0
+        self._built_at = None
+        self._refreshing = False
+
+    @property
+    def max_age(self):
+        return getattr(settings, 'COPURCHASE_MAX_AGE', 3600)
+
+    @property
+    def delta_limit(self):
+        return getattr(settings, 'COPURCHASE_DELTA_LIMIT', 10000)
+
+    def is_stale(self):
+        return self._built_at is None or time.monotonic() - self._built_at > self.max_age
+
+    def build(self):
+        """Rebuild the matrix from every order line in one pass"""
+        rows = OrderProduct.objects.using(self.using).values_list('order_id', 'product_id').order_by().iterator(chunk_size=10000)
+        pairs = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64).reshape(-1, 2)
+
+        order_ids, order_codes = np.unique(pairs[:, 0], return_inverse=True)
+        product_ids, product_codes = np.unique(pairs[:, 1], return_inverse=True)
+        incidence = sparse.csr_matrix(
+            (np.ones(len(pairs), dtype=np.int32), (order_codes, product_codes)),
+            shape=(len(order_ids), len(product_ids)),
+        )
+        incidence.data[:] = 1
+
+        matrix = (incidence.T @ incidence).tocsr()
+        matrix.setdiag(0)
+        matrix.eliminate_zeros()
+
+        with self._lock:
+            self._matrix = matrix
+            self._product_ids = product_ids
+            self._positions = {int(pid): i for i, pid in enumerate(product_ids)}
+            self._delta = defaultdict(Counter)
+            self._delta_size = 0
+            self._built_at = time.monotonic()
+
+    def ensure_built(self):
+        if self._built_at is None:
+            # Concurrent first requests wait for one build
+            with self._build_lock:
+                if self._built_at is None:
+                    self.build()
+        elif self.is_stale():
+            self.refresh_in_background()
+
+    def refresh_in_background(self):
+        """Rebuild in a background thread; lookups use the current matrix meanwhile"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name=f'copurchase-{self.using}', daemon=True).start()
+
+    def _refresh(self):
+        try:
+            self.build()
+        except DatabaseError:
+            logger.warning("Couldn't rebuild the co-purchase index on '%s'", self.using, exc_info=True)
+        finally:
+            self._refreshing = False
+            # The thread's own connection
+            connections[self.using].close()
+
+    def replace_order(self, old_product_ids, new_product_ids):
+        """Apply the pair changes of an order whose lines went from old to new"""
+        if self._built_at is None:
+            # Nothing to update yet; the first build will read the new lines
+            return
+        changes = Counter(_pairs(new_product_ids))
+        changes.subtract(Counter(_pairs(old_product_ids)))
+
+        with self._lock:
+            for (a, b), count in changes.items():
+                if count:
+                    self._delta[a][b] += count
+                    self._delta_size += 1
+            if self._delta_size > self.delta_limit:
+                self._fold_delta()
+
+    def record_order(self, product_ids):
+        self.replace_order([], product_ids)
+
+    def _fold_delta(self):
+        """Merge the overlay into the sparse matrix (caller holds the lock)"""
+        matrix = self._matrix
+        touched = set(self._delta) | {b for row in self._delta.values() for b in row}
+        new_ids = sorted(touched - self._positions.keys())
+        if new_ids:
+            start = len(self._product_ids)
+            self._product_ids = np.concatenate([self._product_ids, np.array(new_ids, dtype=np.int64)])
+            for offset, pid in enumerate(new_ids):
+                self._positions[pid] = start + offset
+            # Resize a copy; readers may still hold the current matrix
+            size = len(self._product_ids)
+            matrix = matrix.copy()
+            matrix.resize((size, size))
+
+        entries = [
+            (self._positions[a], self._positions[b], count)
+            for a, row in self._delta.items()
+            for b, count in row.items()
+        ]
+        if entries:
+            rows, cols, counts = (np.array(column) for column in zip(*entries))
+            update = sparse.csr_matrix((counts, (rows, cols)), shape=matrix.shape)
+            matrix = (matrix + update).tocsr()
+            matrix.data[matrix.data < 0] = 0
+            matrix.eliminate_zeros()
+
+        self._matrix = matrix
+        self._delta = defaultdict(Counter)
+        self._delta_size = 0
+
+    def related(self, product_id, k=10):
+        """Top-k (product_id, count) pairs most often ordered with product_id"""
+        self.ensure_built()
+        with self._lock:
+            matrix, product_ids = self._matrix, self._product_ids
+            position = self._positions.get(product_id)
+            delta = dict(self._delta.get(product_id, {}))
+        scores = {}
+
+        if position is not None:
+            start, end = matrix.indptr[position], matrix.indptr[position + 1]
+            columns, counts = matrix.indices[start:end], matrix.data[start:end]
+            if not delta:
+                if len(counts) > k:
+                    top = np.argpartition(-counts, k)[:k]
+                    columns, counts = columns[top], counts[top]
+                order = np.lexsort((product_ids[columns], -counts))
+                return [(int(product_ids[columns[i]]), int(counts[i])) for i in order]
+            scores = dict(zip(product_ids[columns].tolist(), counts.tolist()))
+
+        for other_id, count in delta.items():
+            scores[other_id] = scores.get(other_id, 0) + count
+
+        ranked = sorted(
+            ((pid, count) for pid, count in scores.items() if count > 0),
+            key=lambda item: (-item[1], item[0]),
+        )
+        return ranked[:k]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def copurchase_index_for(using='default'):
+    """The co-purchase index for a database alias"""
+    index = _indexes.get(using)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.setdefault(using, CoPurchaseIndex(using))
+    return index
@@ -0,0 +1,67 @@
+"""
+Order total reconciliation.
+
+Recomputes `Order.total_price` as SUM(unit_price * quantity) over the
+stored order lines, entirely in SQL. Orders are walked in primary-key
+ranges so memory use stays flat however large the tables are; only the
+ids and totals of mismatched orders are ever pulled into Python.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Max, Min
+
+from .branches import current_database
+from .models import Order
+
+
+def reconcile_order_totals(batch_size=1000, fix=False, max_reported=100, progress=None):
+    """
+    Check (and optionally repair) stored order totals in batches.
+
+    Returns a summary dict with the number of orders checked, the number of
+    mismatches found and up to `max_reported` example mismatches.
+    `progress`, if given, is called as progress(checked, mismatched, upper_bound)
+    after each batch.
+    """
+    bounds = Order.objects.aggregate(low=Min('order_id'), high=Max('order_id'))
+    summary = {
+        'checked': 0,
+        'mismatched': 0,
+        'fixed': 0,
+        'mismatches': [],
+    }
+    if bounds['low'] is None:
+        return summary
+
+    start = bounds['low']
+    while start <= bounds['high']:
+        end = start + batch_size
+        batch = Order.objects.filter(order_id__gte=start, order_id__lt=end)
+
+        with transaction.atomic(using=current_database()):
+            mismatches = list(
+                batch.mismatched_totals()
+                .values_list('order_id', 'total_price', 'computed_total')
+            )
+            if fix and mismatches:
+                summary['fixed'] += Order.objects.filter(
+                    order_id__in=[order_id for order_id, _, _ in mismatches]
+                ).recalculate_totals()
+
+        summary['checked'] += batch.count()
+        summary['mismatched'] += len(mismatches)
+        for order_id, stored, computed in mismatches:
+            if len(summary['mismatches']) >= max_reported:
+                break
+            summary['mismatches'].append({
+                'order_id': order_id,
+                'stored_total': stored,
+                'computed_total': Decimal(computed).quantize(Decimal('0.01')),
+            })
+
+        if progress is not None:
+            progress(summary['checked'], summary['mismatched'], end)
+        start = end
+
+    return summary
@@ -0,0 +1,86 @@
+"""
+Database router for per-branch data placement.
+
+Branch-scoped tables (customers, products, orders, their lines and
+documents, customer segments and the capacity calendar) go to the database of the active branch (see
+`api.branches`). Everything else (staff, branches, tokens, sessions, jobs)
+stays on 'default'.
+
+Allergens are shared reference data: they're written centrally to
+'default' and mirrored into each branch database (see `api.signals`), so
+reads are served from the branch database where they can be joined with
+that branch's products.
+"""
+from .branches import current_branch
+
+
+BRANCH_MODELS = {
+    'api.customer',
+    'api.product',
+    'api.order',
+    'api.orderproduct',
+    'api.orderdocument',
+    'api.tombstone',
+    'api.customersegment',
+    'api.capacityslot',
+    'api.allergeninfo_products',
+}
+
+REFERENCE_MODELS = {
+    'api.allergeninfo',
+}
+
+
+class BranchRouter:
+
+    def _branch_db(self):
+        branch = current_branch()
+        return branch.database if branch is not None else None
+
+    def db_for_read(self, model, **hints):
+        label = model._meta.label_lower
+        if label in BRANCH_MODELS or label in REFERENCE_MODELS:
+            db = self._branch_db()
+            if db is not None:
+                return db
+            instance = hints.get('instance')
+            if instance is not None and instance._state.db:
+                return instance._state.db
+            return None
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        label = model._meta.label_lower
+        if label in REFERENCE_MODELS:
+            return 'default'
+        if label in BRANCH_MODELS:
+            db = self._branch_db()
+            if db is not None:
+                return db
+            instance = hints.get('instance')
+            if instance is not None and instance._state.db:
+                return instance._state.db
+            return None
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        labels = {obj1._meta.label_lower, obj2._meta.label_lower}
+        if labels & REFERENCE_MODELS:
+            return True
+        if 'api.branch' in labels:
+            # Branch links are plain ids (no cross-database constraint)
+            return True
+        if obj1._state.db == obj2._state.db:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == 'default':
+            return True
+        if app_label != 'api':
+            return False
+        if model_name is None:
+            # Data migrations without hints touch branch tables only
+            return True
+        label = f'api.{model_name}'
+        return label in BRANCH_MODELS or label in REFERENCE_MODELS
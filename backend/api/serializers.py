@@ -1,13 +1,29 @@
 from rest_framework import serializers
 from django.contrib.auth import authenticate
-from .models import Staff, Customer, Product, Order, OrderProduct, AllergenInfo
+from django.db import transaction
+from .models import Branch, Staff, Customer, Product, Order, OrderProduct, AllergenInfo, Job
+from .branches import current_branch, current_database
+from .capacity import shortfall
+from .recommendations import copurchase_index_for
+
+
+class BranchSerializer(serializers.ModelSerializer):
+    """Serializer for Branch model"""
+    id = serializers.IntegerField(source='branch_id', read_only=True)
+    
+    class Meta:
+        model = Branch
+        fields = ['id', 'branch_id', 'code', 'name', 'is_active']
+        read_only_fields = fields
 
 
 class StaffSerializer(serializers.ModelSerializer):
     """Serializer for Staff model"""
+    branches = serializers.SlugRelatedField(slug_field='code', many=True, read_only=True)
+    
     class Meta:
         model = Staff
-        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'is_active']
+        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'is_active', 'branches']
         read_only_fields = ['id']
 
 
@@ -63,15 +79,17 @@ class StaffRegistrationSerializer(serializers.ModelSerializer):
 class CustomerSerializer(serializers.ModelSerializer):
     """Serializer for Customer model"""
     id = serializers.IntegerField(source='customer_id', read_only=True)
+    segment = serializers.CharField(source='segment.segment', read_only=True, allow_null=True)
+    rfm_score = serializers.CharField(source='segment.rfm_score', read_only=True, allow_null=True)
     
     class Meta:
         model = Customer
         fields = [
             'id', 'customer_id', 'prefix', 'first_name', 'last_name', 
-            'phone_number', 'email', 'subfix', 'full_name',
-            'created_at', 'updated_at'
+            'phone_number', 'phone_normalized', 'email', 'subfix', 'full_name',
+            'segment', 'rfm_score', 'branch', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'customer_id', 'full_name', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'customer_id', 'phone_normalized', 'full_name', 'branch', 'created_at', 'updated_at']
 
 
 class CustomerListSerializer(serializers.ModelSerializer):
@@ -84,6 +102,13 @@ class CustomerListSerializer(serializers.ModelSerializer):
         fields = ['id', 'customer_id', 'name', 'full_name']
 
 
+class CustomerAutocompleteSerializer(CustomerListSerializer):
+    """Customer dropdown entry with the details needed to tell matches apart"""
+    
+    class Meta(CustomerListSerializer.Meta):
+        fields = CustomerListSerializer.Meta.fields + ['phone_number', 'email']
+
+
 class ProductSerializer(serializers.ModelSerializer):
     """Serializer for Product model"""
     id = serializers.IntegerField(source='product_id', read_only=True)
@@ -96,9 +121,9 @@ class ProductSerializer(serializers.ModelSerializer):
             'id', 'product_id', 'product_name', 'product_price', 
             'product_type', 'product_type_display',
             'product_suitability', 'product_suitability_display',
-            'is_active', 'created_at', 'updated_at'
+            'is_active', 'branch', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'product_id', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'product_id', 'branch', 'created_at', 'updated_at']
 
 
 class ProductListSerializer(serializers.ModelSerializer):
@@ -113,15 +138,14 @@ class ProductListSerializer(serializers.ModelSerializer):
 
 class OrderProductSerializer(serializers.ModelSerializer):
     """Serializer for OrderProduct (junction table)"""
-    product_name = serializers.CharField(source='product.product_name', read_only=True)
+    # Details are snapshotted on the line when it's written, so these render
+    # the product as it was sold without a join to tbl_products
     product_price = serializers.DecimalField(
-        source='product.product_price', 
+        source='unit_price', 
         max_digits=10, 
         decimal_places=2, 
         read_only=True
     )
-    product_type = serializers.CharField(source='product.product_type', read_only=True)
-    product_suitability = serializers.CharField(source='product.product_suitability', read_only=True)
     line_total = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     
     class Meta:
@@ -131,7 +155,9 @@ class OrderProductSerializer(serializers.ModelSerializer):
             'product_price', 'product_type', 'product_suitability',
             'quantity', 'unit_price', 'line_total'
         ]
-        read_only_fields = ['order_product_id', 'line_total']
+        read_only_fields = [
+            'order_product_id', 'product_name', 'product_type', 'product_suitability', 'line_total'
+        ]
 
 
 class OrderProductCreateSerializer(serializers.ModelSerializer):
@@ -156,24 +182,119 @@ class OrderSerializer(serializers.ModelSerializer):
             'method_of_payment', 'method_of_payment_display',
             'order_placed', 'order_due', 'comments',
             'status', 'status_display', 'order_products',
-            'created_at', 'updated_at'
+            'branch', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'order_id', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'order_id', 'branch', 'created_at', 'updated_at']
+
+
+class OrderSummarySerializer(serializers.ModelSerializer):
+    """Order header without line items, for compact listings"""
+    id = serializers.IntegerField(source='order_id', read_only=True)
+    method_of_payment_display = serializers.CharField(source='get_method_of_payment_display', read_only=True)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    
+    class Meta:
+        model = Order
+        fields = [
+            'id', 'order_id', 'total_price',
+            'method_of_payment', 'method_of_payment_display',
+            'order_placed', 'order_due', 'comments',
+            'status', 'status_display'
+        ]
+        read_only_fields = fields
+
+
+class BulkOrderStatusSerializer(serializers.Serializer):
+    """Serializer for moving many orders to one status"""
+    order_ids = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=1000
+    )
+    status = serializers.ChoiceField(choices=Order.ORDER_STATUS)
+
+
+class MergeCustomersSerializer(serializers.Serializer):
+    """Serializer for merging duplicate customers into one"""
+    duplicate_ids = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=100
+    )
+
+
+class FindDuplicatesSerializer(serializers.Serializer):
+    """Serializer for scoping a duplicate customer search"""
+    min_score = serializers.FloatField(required=False, min_value=0, max_value=1)
+
+
+class RepriceOrdersSerializer(serializers.Serializer):
+    """Serializer for scoping a product repricing to open orders"""
+    statuses = serializers.ListField(
+        child=serializers.ChoiceField(choices=[
+            status for status, _ in Order.ORDER_STATUS if Order.STATUS_TRANSITIONS[status]
+        ]),
+        allow_empty=False,
+        default=['pending', 'confirmed']
+    )
+    due_from = serializers.DateTimeField(required=False)
+    due_to = serializers.DateTimeField(required=False)
+    dry_run = serializers.BooleanField(default=False)
 
 
 class OrderCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating/updating Orders with products"""
     products = OrderProductCreateSerializer(many=True, write_only=True)
+    check_capacity = serializers.BooleanField(default=False, write_only=True)
     
     class Meta:
         model = Order
         fields = [
             'customer', 'method_of_payment', 'order_placed', 
-            'order_due', 'comments', 'status', 'products'
+            'order_due', 'comments', 'status', 'products', 'check_capacity'
         ]
     
+    def validate(self, data):
+        branch = current_branch()
+        if branch is not None:
+            customer = data.get('customer')
+            if customer is not None and customer.branch_id not in (None, branch.pk):
+                raise serializers.ValidationError({'customer': "Customer belongs to another branch."})
+            for product_data in data.get('products') or []:
+                if product_data['product'].branch_id not in (None, branch.pk):
+                    raise serializers.ValidationError({'products': "Products must belong to the order's branch."})
+        if data.get('check_capacity'):
+            self.validate_capacity(data, branch)
+        return data
+    
+    def validate_capacity(self, data, branch):
+        """Reject the order if its lines don't fit in the kitchen slot at its due time"""
+        instance = self.instance
+        order_due = data.get('order_due') or (instance.order_due if instance else None)
+        status = data.get('status') or (instance.status if instance else 'pending')
+        if order_due is None or status == 'cancelled':
+            return
+        
+        requested = {}
+        if 'products' in data:
+            for product_data in data['products']:
+                product_type = product_data['product'].product_type
+                requested[product_type] = requested.get(product_type, 0) + product_data.get('quantity', 1)
+        elif instance is not None:
+            for product_type, quantity in instance.order_products.values_list('product_type', 'quantity'):
+                requested[product_type] = requested.get(product_type, 0) + quantity
+        
+        if branch is not None:
+            branch_id = branch.pk
+        else:
+            branch_id = instance.branch_id if instance else None
+        short = shortfall(order_due, requested, branch_id=branch_id, order=instance, using=current_database())
+        if short:
+            details = ', '.join(
+                f"{product_type} ({wanted} requested, {free} free)"
+                for product_type, (wanted, free) in sorted(short.items())
+            )
+            raise serializers.ValidationError({'order_due': f"Not enough kitchen capacity in this slot: {details}."})
+    
     def create(self, validated_data):
         products_data = validated_data.pop('products')
+        validated_data.pop('check_capacity', None)
         order = Order.objects.create(**validated_data)
         
         total = 0
@@ -192,18 +313,34 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         order.total_price = total
         order.save()
         
+        product_ids = [product_data['product'].pk for product_data in products_data]
+        index = copurchase_index_for(current_database())
+        transaction.on_commit(lambda: index.record_order(product_ids), using=current_database())
+        
         return order
     
     def update(self, instance, validated_data):
+        # deletion -> read_models imports this module
+        from .deletion import delete_order_lines
+        
         products_data = validated_data.pop('products', None)
+        validated_data.pop('check_capacity', None)
         
         # Update order fields
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
         
         if products_data is not None:
+            old_product_ids = list(instance.order_products.values_list('product_id', flat=True))
+            new_product_ids = [product_data['product'].pk for product_data in products_data]
+            index = copurchase_index_for(current_database())
+            transaction.on_commit(
+                lambda: index.replace_order(old_product_ids, new_product_ids),
+                using=current_database()
+            )
+            
             # Remove existing order products
-            instance.order_products.all().delete()
+            delete_order_lines([instance.pk])
             
             # Add new products
             total = 0
@@ -244,3 +381,63 @@ class AllergenInfoSerializer(serializers.ModelSerializer):
             'description', 'products', 'product_ids'
         ]
         read_only_fields = ['id', 'allergen_id']
+
+
+class AllergenPairSerializer(serializers.Serializer):
+    """A (product, allergen) pair; the allergen may be given by id or name"""
+    product = serializers.IntegerField()
+    allergen = serializers.CharField()
+
+
+class BulkAllergenAssignmentSerializer(serializers.Serializer):
+    """Serializer for adding/removing many product-allergen links at once"""
+    add = AllergenPairSerializer(many=True, required=False, default=list)
+    remove = AllergenPairSerializer(many=True, required=False, default=list)
+    
+    def validate(self, data):
+        pairs = data['add'] + data['remove']
+        if not pairs:
+            raise serializers.ValidationError("Provide at least one pair in 'add' or 'remove'.")
+        
+        allergens = {}
+        for allergen_id, allergen_name in AllergenInfo.objects.values_list('allergen_id', 'allergen_name'):
+            allergens[str(allergen_id)] = allergen_id
+            allergens[allergen_name] = allergen_id
+        
+        product_ids = {pair['product'] for pair in pairs}
+        products = Product.objects.filter(product_id__in=product_ids)
+        if current_branch() is not None:
+            products = products.filter(branch=current_branch())
+        existing_products = set(products.values_list('product_id', flat=True))
+        
+        errors = {}
+        unknown_products = sorted(product_ids - existing_products)
+        if unknown_products:
+            errors['products'] = f"Unknown product ids: {unknown_products}"
+        unknown_allergens = sorted({pair['allergen'] for pair in pairs} - allergens.keys())
+        if unknown_allergens:
+            errors['allergens'] = f"Unknown allergens: {unknown_allergens}"
+        if errors:
+            raise serializers.ValidationError(errors)
+        
+        for key in ('add', 'remove'):
+            data[key] = {(pair['product'], allergens[pair['allergen']]) for pair in data[key]}
+        return data
+
+
+class JobSerializer(serializers.ModelSerializer):
+    """Serializer for background Job status and progress"""
+    id = serializers.IntegerField(source='job_id', read_only=True)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    created_by = serializers.CharField(source='created_by.username', read_only=True, default=None)
+    branch = serializers.CharField(source='branch.code', read_only=True, default=None)
+    
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'job_id', 'name', 'kwargs', 'status', 'status_display',
+            'progress', 'progress_message', 'result', 'error',
+            'attempts', 'max_attempts', 'run_after', 'created_by', 'branch',
+            'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
@@ -0,0 +1,118 @@
+"""
+Model signal handlers for the API app.
+"""
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import capacity, read_models, working_set
+from .autocomplete import prefix_index_for
+from .models import Customer, Product, Order, OrderProduct, AllergenInfo, Tombstone
+
+
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Order)
+def record_tombstone(sender, instance, using='default', **kwargs):
+    """Remember deletions for delta sync clients"""
+    Tombstone.objects.using(using).create(
+        model_name=sender._meta.label_lower, object_id=instance.pk, branch_id=instance.branch_id
+    )
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=Product)
+def index_for_autocomplete(sender, instance, using, raw=False, **kwargs):
+    if not raw:
+        prefix_index_for(sender, using).update(instance)
+
+
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=Product)
+def forget_autocomplete(sender, instance, using, **kwargs):
+    prefix_index_for(sender, using).discard([instance.pk])
+
+
+@receiver(post_save, sender=Order)
+def move_order_capacity(sender, instance, using, raw=False, **kwargs):
+    """Keep the capacity calendar in step with an order's due time and status"""
+    if not raw:
+        capacity.order_saved(instance, using)
+
+
+@receiver(post_save, sender=OrderProduct)
+def count_line_capacity(sender, instance, created, using, raw=False, **kwargs):
+    if not raw:
+        capacity.line_saved(instance, created, using)
+
+
+@receiver(post_delete, sender=OrderProduct)
+def release_line_capacity(sender, instance, using, **kwargs):
+    capacity.line_deleted(instance, using)
+
+
+@receiver(post_save, sender=Order)
+def refresh_order_document(sender, instance, using, raw=False, **kwargs):
+    """Re-render the stored API document of a changed order"""
+    if not raw:
+        read_models.schedule_refresh([instance.pk], using)
+
+
+@receiver(post_save, sender=OrderProduct)
+def refresh_line_order_document(sender, instance, using, raw=False, **kwargs):
+    if not raw:
+        read_models.schedule_refresh([instance.order_id], using)
+
+
+@receiver(post_delete, sender=OrderProduct)
+def refresh_document_after_line_delete(sender, instance, using, origin=None, **kwargs):
+    # Lines deleted along with their order leave nothing to refresh
+    origin_model = getattr(origin, 'model', type(origin))
+    if origin_model is OrderProduct:
+        read_models.schedule_refresh([instance.order_id], using)
+
+
+@receiver(post_save, sender=Customer)
+def refresh_customer_order_documents(sender, instance, created, using, raw=False, **kwargs):
+    """Orders embed the customer's name"""
+    if raw or created or instance.full_name == getattr(instance, '_loaded_full_name', instance.full_name):
+        return
+    instance._loaded_full_name = instance.full_name
+    read_models.schedule_refresh(
+        Order.objects.using(using).filter(customer=instance).values_list('pk', flat=True), using
+    )
+
+
+@receiver(post_save, sender=Order)
+def track_working_set(sender, instance, using, raw=False, **kwargs):
+    """Keep this worker's in-memory active orders current"""
+    if not raw:
+        working_set.order_saved(instance, using)
+
+
+@receiver(post_delete, sender=Order)
+def forget_working_set(sender, instance, using, **kwargs):
+    working_set.orders_deleted([instance.pk], using)
+
+
+@receiver(post_save, sender=AllergenInfo)
+def mirror_allergen(sender, instance, using, raw=False, **kwargs):
+    """Copy central allergen reference data into each branch database"""
+    if raw or using != 'default':
+        return
+    for alias in getattr(settings, 'BRANCH_DATABASES', []):
+        AllergenInfo.objects.using(alias).update_or_create(
+            allergen_id=instance.allergen_id,
+            defaults={
+                'allergen_name': instance.allergen_name,
+                'description': instance.description,
+            }
+        )
+
+
+@receiver(post_delete, sender=AllergenInfo)
+def unmirror_allergen(sender, instance, using, **kwargs):
+    if using != 'default':
+        return
+    for alias in getattr(settings, 'BRANCH_DATABASES', []):
+        AllergenInfo.objects.using(alias).filter(allergen_id=instance.allergen_id).delete()
@@ -0,0 +1,56 @@
+"""
+Background tasks run by `manage.py run_worker`.
+"""
+from django.db.models import Max, Min
+
+from .analytics import recompute_segments
+from .branches import current_branch, current_database, use_branch
+from .dedupe import find_duplicates
+from .jobs import task, set_progress
+from .models import Order
+from .reconciliation import reconcile_order_totals
+
+
+@task('reconcile_order_totals', concurrency=1)
+def reconcile_order_totals_task(job, fix=False, batch_size=1000, branch=None):
+    """Recompute order totals in the background"""
+    with use_branch(branch):
+        return _reconcile(job, fix, batch_size)
+
+
+def _reconcile(job, fix, batch_size):
+    bounds = Order.objects.aggregate(low=Min('order_id'), high=Max('order_id'))
+    span = (bounds['high'] or 0) - (bounds['low'] or 0) + 1
+
+    def progress(checked, mismatched, upper_bound):
+        set_progress(
+            job,
+            upper_bound - bounds['low'],
+            span,
+            f"{checked} checked, {mismatched} mismatched",
+        )
+
+    return reconcile_order_totals(batch_size=batch_size, fix=fix, progress=progress)
+
+
+@task('recompute_customer_segments', concurrency=1)
+def recompute_customer_segments_task(job, branch=None):
+    """Recompute RFM customer segments in the background"""
+    with use_branch(branch):
+        return recompute_segments(
+            branch=current_branch(),
+            using=current_database(),
+            progress=lambda stored, total: set_progress(job, stored, total, f"{stored} of {total} stored"),
+        )
+
+
+@task('find_duplicate_customers', concurrency=1)
+def find_duplicate_customers_task(job, branch=None, min_score=None):
+    """Find probable duplicate customers in the background"""
+    with use_branch(branch):
+        return find_duplicates(
+            branch=current_branch(),
+            using=current_database(),
+            min_score=min_score,
+            progress=lambda step, steps: set_progress(job, step, steps, f"Step {step} of {steps}"),
+        )
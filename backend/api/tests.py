@@ -1,3 +1,1342 @@
-from django.test import TestCase
+"""
+Tests for the API app.
+"""
+import gzip
+import importlib
+import json
+import time
+from datetime import datetime, time as dt_time, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import msgpack
+import numpy as np
+from django.apps import apps
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.sessions.models import Session
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Sum
+from django.db.models.signals import post_delete
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from core.db_backends.sqlite3.base import DatabaseWrapper as HardenedSQLiteWrapper, pragma_statement
+
+from . import autocomplete, capacity, dedupe, read_models, recommendations, throttling, working_set
+from .admin import EstimatedCountPaginator, OrderProductInline
+from .analytics import compute_rfm, quintile_scores, recompute_segments
+from .branches import use_branch
+from .deletion import CHUNK_SIZE, can_fast_delete
+from .jobs import claim_next, enqueue, requeue_stale_jobs, run_job
+from .management.commands import load_test, purge_auth
+from .middleware import CompressionMiddleware, LoadSheddingMiddleware
+from .models import (
+    AllergenInfo, Branch, Staff, Customer, CustomerSegment, Product, Order, OrderProduct, OrderDocument,
+    CapacitySlot, Job, RequestProfile, Tombstone
+)
+from .reconciliation import reconcile_order_totals
+from .renderers import ORJSONRenderer
+from .routers import BranchRouter
+from .utils import normalize_phone
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+
+class APITestCase(TestCase):
+    """A superuser client, a customer and two products in the default branch"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = Branch.objects.get(code='main')
+        cls.staff = Staff.objects.create_user(
+            username='staff', password='pw12345!', is_staff=True, is_superuser=True
+        )
+        cls.customer = Customer.objects.create(
+            first_name='Ada', last_name='Lovelace', phone_number='07700 900123',
+            email='ada@example.com', branch=cls.branch
+        )
+        cls.cake = Product.objects.create(
+            product_name='Carrot Cake', product_price=Decimal('3.50'), product_type='dessert', branch=cls.branch
+        )
+        cls.pie = Product.objects.create(
+            product_name='Pork Pie', product_price=Decimal('4.25'), product_type='main', branch=cls.branch
+        )
+
+    def setUp(self):
+        # Per-process indexes would otherwise outlive each test's rolled-back rows
+        recommendations._indexes.clear()
+        autocomplete._indexes.clear()
+        working_set._sets.clear()
+        throttling.counter.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def create_order(self, customer=None, lines=None, status='pending', due_in=timedelta(hours=2), **extra):
+        """Create an order through the API and return it"""
+        now = timezone.now()
+        lines = lines if lines is not None else [(self.cake, 2), (self.pie, 1)]
+        response = self.client.post('/api/orders/', {
+            'customer': (customer or self.customer).pk,
+            'method_of_payment': 'cash',
+            'order_placed': now.isoformat(),
+            'order_due': (now + due_in).isoformat(),
+            'status': status,
+            'products': [{'product': product.pk, 'quantity': quantity} for product, quantity in lines],
+            **extra,
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return Order.objects.latest('order_id')
+
+
+class RendererTests(APITestCase):
+
+    def test_orjson_matches_drf_json(self):
+        self.create_order()
+        data = self.client.get('/api/orders/').data
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_messagepack_negotiation(self):
+        order = self.create_order()
+        response = self.client.get(f'/api/orders/{order.pk}/', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        payload = msgpack.unpackb(response.content, raw=False)
+        self.assertEqual(payload['order_id'], order.pk)
+        self.assertEqual(payload['total_price'], '11.25')
+
+    def test_messagepack_request_body(self):
+        response = self.client.post(
+            '/api/customers/',
+            msgpack.packb({'first_name': 'Grace', 'last_name': 'Hopper', 'phone_number': '07700 900456'}),
+            content_type='application/msgpack'
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertTrue(Customer.objects.filter(last_name='Hopper').exists())
+
+
+@override_settings(RESPONSE_COMPRESSION_MIN_SIZE=200)
+class CompressionTests(APITestCase):
+
+    def test_large_response_is_compressed(self):
+        for _ in range(3):
+            self.create_order()
+        response = self.client.get('/api/orders/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content))['count'], 3)
+
+    def test_brotli_preferred(self):
+        if brotli is None:
+            self.skipTest('brotli is not installed')
+        for _ in range(3):
+            self.create_order()
+        response = self.client.get('/api/orders/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(json.loads(brotli.decompress(response.content))['count'], 3)
+
+    def test_brotli_output_is_padded(self):
+        if brotli is None:
+            self.skipTest('brotli is not installed')
+        middleware = CompressionMiddleware(lambda request: None)
+        content = b'{"csrf": "secret"}' * 100
+        outputs = [middleware.brotli_compress(content) for _ in range(20)]
+        self.assertTrue(all(brotli.decompress(output) == content for output in outputs))
+        self.assertGreater(len({len(output) for output in outputs}), 1)
+
+    def test_small_response_is_not_compressed(self):
+        response = self.client.get('/api/auth/me/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class ReconciliationTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.good = self.create_order()
+        self.bad = self.create_order(lines=[(self.pie, 3)])
+        Order.objects.filter(pk=self.bad.pk).update(total_price=Decimal('1.00'))
+
+    def test_reports_mismatches(self):
+        summary = reconcile_order_totals(batch_size=1)
+        self.assertEqual(summary['checked'], 2)
+        self.assertEqual(summary['mismatched'], 1)
+        self.assertEqual(summary['fixed'], 0)
+        self.assertEqual(summary['mismatches'], [{
+            'order_id': self.bad.pk,
+            'stored_total': Decimal('1.00'),
+            'computed_total': Decimal('12.75'),
+        }])
+        self.bad.refresh_from_db()
+        self.assertEqual(self.bad.total_price, Decimal('1.00'))
+
+    def test_fix_repairs_totals(self):
+        summary = reconcile_order_totals(fix=True)
+        self.assertEqual(summary['fixed'], 1)
+        self.bad.refresh_from_db()
+        self.assertEqual(self.bad.total_price, Decimal('12.75'))
+        self.assertEqual(reconcile_order_totals()['mismatched'], 0)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('reconcile_order_totals', '--fix', stdout=out)
+        self.assertIn(f"Order #{self.bad.pk}: stored £1.00, computed £12.75", out.getvalue())
+        self.assertIn('Checked 2 orders, 1 mismatched, 1 repaired', out.getvalue())
+
+    def test_endpoint_queues_job(self):
+        response = self.client.post('/api/orders/reconcile_totals/', {'fix': 'true'}, format='json')
+        self.assertEqual(response.status_code, 202)
+        job = Job.objects.get(pk=response.data['job_id'])
+        self.assertEqual(job.name, 'reconcile_order_totals')
+        self.assertEqual(job.kwargs, {'fix': True, 'batch_size': 1000, 'branch': 'main'})
+
+    def test_endpoint_rejects_bad_batch_size(self):
+        response = self.client.post('/api/orders/reconcile_totals/', {'batch_size': 0}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class CoPurchaseTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.tea = Product.objects.create(
+            product_name='Tea', product_price=Decimal('1.20'), product_type='beverage', branch=cls.branch
+        )
+
+    def related(self, product):
+        response = self.client.get(f'/api/products/{product.pk}/related/')
+        self.assertEqual(response.status_code, 200)
+        return [(item['product_id'], item['times_ordered_together']) for item in response.data]
+
+    def test_ranks_products_ordered_together(self):
+        self.create_order(lines=[(self.cake, 1), (self.tea, 1)])
+        self.create_order(lines=[(self.cake, 1), (self.tea, 2), (self.pie, 1)])
+        self.assertEqual(self.related(self.cake), [(self.tea.pk, 2), (self.pie.pk, 1)])
+        self.assertEqual(self.related(self.pie), [(self.cake.pk, 1), (self.tea.pk, 1)])
+
+    def test_new_and_edited_orders_update_built_index(self):
+        self.create_order(lines=[(self.cake, 1), (self.tea, 1)])
+        self.assertEqual(self.related(self.cake), [(self.tea.pk, 1)])
+        with self.captureOnCommitCallbacks(execute=True):
+            order = self.create_order(lines=[(self.cake, 1), (self.pie, 1)])
+        self.assertEqual(self.related(self.cake), [(self.pie.pk, 1), (self.tea.pk, 1)])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/orders/{order.pk}/', {
+                'products': [{'product': self.cake.pk, 'quantity': 1}, {'product': self.tea.pk, 'quantity': 1}]
+            }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.related(self.cake), [(self.tea.pk, 2)])
+
+    @override_settings(COPURCHASE_DELTA_LIMIT=1)
+    def test_overlay_folds_into_matrix(self):
+        self.create_order(lines=[(self.cake, 1), (self.tea, 1)])
+        index = recommendations.copurchase_index_for()
+        index.build()
+        index.record_order([self.cake.pk, self.pie.pk])
+        self.assertEqual(index._delta_size, 0)
+        self.assertEqual(index.related(self.pie.pk), [(self.cake.pk, 1)])
+
+    def test_stale_index_refreshed_in_background(self):
+        self.create_order(lines=[(self.cake, 1), (self.tea, 1)])
+        index = recommendations.copurchase_index_for()
+        index.build()
+        self.create_order(lines=[(self.cake, 1), (self.pie, 1)])
+        index._built_at -= index.max_age + 1
+        with mock.patch.object(recommendations.threading, 'Thread') as thread:
+            self.assertEqual(self.related(self.cake), [(self.tea.pk, 1)])
+            self.related(self.cake)
+        thread.assert_called_once()
+        self.assertTrue(index._refreshing)
+        with mock.patch.object(recommendations, 'connections'):
+            thread.call_args.kwargs['target']()
+        self.assertFalse(index._refreshing)
+        self.assertEqual(self.related(self.cake), [(self.pie.pk, 1), (self.tea.pk, 1)])
+
+    def test_rejects_bad_k(self):
+        response = self.client.get(f'/api/products/{self.cake.pk}/related/?k=lots')
+        self.assertEqual(response.status_code, 400)
+
+
+class PhoneLookupTests(APITestCase):
+
+    def test_normalize_phone(self):
+        for raw, normalized in [
+            ('07700 900123', '+447700900123'),
+            ('+44 (0)7700 900-123', '+447700900123'),
+            ('0044 7700 900123', '+447700900123'),
+            ('447700900123', '+447700900123'),
+            ('+1 (415) 555-0100', '+14155550100'),
+            ('n/a', ''),
+            ('', ''),
+        ]:
+            self.assertEqual(normalize_phone(raw), normalized, raw)
+
+    def test_longest_number_fits_column(self):
+        phone_number = '0' + '9' * 19
+        normalized = normalize_phone(phone_number)
+        self.assertLessEqual(len(normalized), Customer._meta.get_field('phone_normalized').max_length)
+        customer = Customer.objects.create(first_name='Long', last_name='Number', phone_number=phone_number)
+        customer.refresh_from_db()
+        self.assertEqual(customer.phone_normalized, normalized)
+
+    def test_lookup_in_any_format(self):
+        order = self.create_order()
+        response = self.client.get('/api/customers/lookup/', {'phone': '+44 7700-900-123'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['customer']['customer_id'], self.customer.pk)
+        self.assertEqual([o['order_id'] for o in response.data['recent_orders']], [order.pk])
+
+    def test_lookup_misses(self):
+        self.assertEqual(self.client.get('/api/customers/lookup/', {'phone': '07700 900999'}).status_code, 404)
+        self.assertEqual(self.client.get('/api/customers/lookup/').status_code, 400)
+
+    def test_search_matches_normalized_phone(self):
+        response = self.client.get('/api/customers/', {'search': '0044 7700 900123'})
+        self.assertEqual([c['customer_id'] for c in response.data['results']], [self.customer.pk])
+
+
+class JobQueueTests(APITestCase):
+
+    def test_claim_respects_concurrency_cap(self):
+        first = enqueue('reconcile_order_totals')
+        second = enqueue('reconcile_order_totals')
+        self.assertEqual(claim_next('worker-1'), first)
+        self.assertIsNone(claim_next('worker-2'))
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'queued')
+        Job.objects.filter(pk=first.pk).update(status='succeeded')
+        self.assertEqual(claim_next('worker-2'), second)
+
+    def test_stale_jobs_requeued_until_out_of_attempts(self):
+        stale_at = timezone.now() - timedelta(hours=1)
+        retry = enqueue('reconcile_order_totals')
+        spent = enqueue('recompute_customer_segments')
+        Job.objects.filter(pk=retry.pk).update(status='running', attempts=1, heartbeat_at=stale_at)
+        Job.objects.filter(pk=spent.pk).update(status='running', attempts=3, heartbeat_at=stale_at)
+        self.assertEqual(requeue_stale_jobs(), 1)
+        retry.refresh_from_db()
+        spent.refresh_from_db()
+        self.assertEqual(retry.status, 'queued')
+        self.assertEqual(spent.status, 'failed')
+        self.assertEqual(spent.error, 'Worker stopped responding')
+
+    def test_list_scoped_to_branch_and_user(self):
+        other_branch = Branch.objects.create(code='north', name='North')
+        clerk = Staff.objects.create_user(username='clerk', password='pw12345!')
+        with use_branch(self.branch):
+            own = enqueue('reconcile_order_totals', user=clerk)
+            enqueue('reconcile_order_totals', user=self.staff)
+        with use_branch(other_branch):
+            enqueue('reconcile_order_totals', user=clerk)
+
+        response = self.client.get('/api/jobs/', HTTP_X_BRANCH='main')
+        self.assertEqual(response.data['count'], 2)
+        self.client.force_authenticate(clerk)
+        response = self.client.get('/api/jobs/', HTTP_X_BRANCH='main')
+        self.assertEqual([job['job_id'] for job in response.data['results']], [own.pk])
+        self.assertEqual(response.data['results'][0]['branch'], 'main')
+
+    def test_endpoint_records_branch(self):
+        response = self.client.post('/api/orders/reconcile_totals/', {}, format='json')
+        self.assertEqual(Job.objects.get(pk=response.data['job_id']).branch, self.branch)
+
+    def test_cancel(self):
+        with use_branch(self.branch):
+            job = enqueue('reconcile_order_totals', user=self.staff)
+        response = self.client.post(f'/api/jobs/{job.pk}/cancel/')
+        self.assertEqual(response.status_code, 200)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'cancelled')
+        self.assertEqual(self.client.post(f'/api/jobs/{job.pk}/cancel/').status_code, 409)
+
+
+class DeltaSyncTests(APITestCase):
+
+    def sync(self, token, branch='main'):
+        response = self.client.get('/api/customers/', {'updated_since': token}, HTTP_X_BRANCH=branch)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_changes_and_deletions_since_token(self):
+        grace = Customer.objects.create(first_name='Grace', last_name='Hopper', branch=self.branch)
+        self.assertEqual(self.client.delete(f'/api/customers/{self.customer.pk}/').status_code, 204)
+        data = self.sync((timezone.now() - timedelta(minutes=1)).isoformat())
+        self.assertEqual([c['customer_id'] for c in data['results']], [grace.pk])
+        self.assertEqual(data['deleted'], [self.customer.pk])
+        self.assertFalse(data['has_more'])
+        self.assertRegex(data['sync_token'], r'^\d+-\d+$')
+
+    def test_deletions_scoped_to_branch(self):
+        north = Branch.objects.create(code='north', name='North')
+        other = Customer.objects.create(first_name='Alan', last_name='Turing', branch=north)
+        since = (timezone.now() - timedelta(minutes=1)).isoformat()
+        self.client.delete(f'/api/customers/{other.pk}/', HTTP_X_BRANCH='north')
+        self.client.delete(f'/api/customers/{self.customer.pk}/')
+        self.assertEqual(self.sync(since)['deleted'], [self.customer.pk])
+        self.assertEqual(self.sync(since, branch='north')['deleted'], [other.pk])
+
+    def test_expired_token(self):
+        response = self.client.get('/api/customers/', {'updated_since': '2000-01-01T00:00:00Z'})
+        self.assertEqual(response.status_code, 410)
+
+    def test_purge_tombstones(self):
+        Tombstone.objects.create(model_name='api.customer', object_id=1, deleted_at=timezone.now() - timedelta(days=60))
+        Tombstone.objects.create(model_name='api.customer', object_id=2)
+        out = StringIO()
+        call_command('purge_tombstones', '--branch', 'main', stdout=out)
+        self.assertIn("Purged 1 tombstone(s) on 'default'.", out.getvalue())
+        self.assertEqual(list(Tombstone.objects.values_list('object_id', flat=True)), [2])
+
+
+class DeletionTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.today = working_set.today_bounds()
+        due = (self.today[0] + timedelta(hours=12)).isoformat()
+        self.orders = [self.create_order(order_due=due), self.create_order(lines=[(self.pie, 4)], order_due=due)]
+        self.keep = self.create_order(order_due=due)
+        self.active = working_set.working_set_for()
+        self.active.load()
+
+    def assert_deleted(self, order_ids):
+        self.assertFalse(Order.objects.filter(pk__in=order_ids).exists())
+        self.assertFalse(OrderProduct.objects.filter(order_id__in=order_ids).exists())
+        self.assertFalse(OrderDocument.objects.filter(order_id__in=order_ids).exists())
+        self.assertEqual(
+            sorted(Tombstone.objects.filter(model_name='api.order').values_list('object_id', flat=True)),
+            sorted(order_ids)
+        )
+        active = [record.order_id for record in self.active.select(['pending'], *self.today)]
+        self.assertEqual(active, [self.keep.pk])
+        self.assertTrue(OrderDocument.objects.filter(order=self.keep).exists())
+
+    def bulk_delete(self):
+        order_ids = [order.pk for order in self.orders]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/orders/bulk_delete/', {'order_ids': order_ids}, format='json')
+        self.assertEqual(response.data['deleted'], 2)
+        return order_ids
+
+    def test_raw_delete(self):
+        self.assertTrue(can_fast_delete(Order, OrderProduct, OrderDocument))
+        self.assert_deleted(self.bulk_delete())
+        self.assertEqual(CapacitySlot.objects.aggregate(total=Sum('quantity'))['total'], 3)
+
+    def test_falls_back_to_collector_for_other_receivers(self):
+        seen = []
+
+        def receiver(sender, instance, **kwargs):
+            seen.append(instance.pk)
+
+        post_delete.connect(receiver, sender=Order)
+        self.addCleanup(post_delete.disconnect, receiver, sender=Order)
+        self.assertFalse(can_fast_delete(Order, OrderProduct, OrderDocument))
+        order_ids = self.bulk_delete()
+        self.assertEqual(sorted(seen), sorted(order_ids))
+        self.assert_deleted(order_ids)
+
+    def test_delete_customer_with_orders(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f'/api/customers/{self.customer.pk}/').status_code, 204)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Tombstone.objects.filter(model_name='api.customer').count(), 1)
+        self.assertEqual(Tombstone.objects.filter(model_name='api.order').count(), 3)
+
+    def test_editing_lines_replaces_them(self):
+        order = self.keep
+        response = self.client.patch(f'/api/orders/{order.pk}/', {
+            'products': [{'product': self.cake.pk, 'quantity': 5}]
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(list(order.order_products.values_list('product_id', 'quantity')), [(self.cake.pk, 5)])
+        booked = dict(CapacitySlot.objects.values_list('product_type').annotate(total=Sum('quantity')))
+        self.assertEqual(booked, {'dessert': 7, 'main': 5})
+        self.assertEqual(self.client.get(f'/api/orders/{order.pk}/').data['total_price'], '17.50')
+
+
+class BulkAllergenTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.eggs = AllergenInfo.objects.create(allergen_name='eggs')
+        cls.gluten = AllergenInfo.objects.create(allergen_name='gluten')
+
+    def bulk_assign(self, **payload):
+        return self.client.post('/api/allergens/bulk_assign/', payload, format='json')
+
+    def test_add_and_remove(self):
+        self.cake.allergens.add(self.gluten)
+        response = self.bulk_assign(
+            add=[
+                {'product': self.cake.pk, 'allergen': 'eggs'},
+                {'product': self.pie.pk, 'allergen': str(self.gluten.pk)},
+                {'product': self.cake.pk, 'allergen': 'eggs'},
+            ],
+            remove=[{'product': self.cake.pk, 'allergen': 'gluten'}],
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual((response.data['added'], response.data['removed']), (2, 1))
+        self.assertEqual(list(self.cake.allergens.all()), [self.eggs])
+        self.assertEqual(list(self.pie.allergens.all()), [self.gluten])
+
+    def test_existing_links_not_duplicated(self):
+        self.cake.allergens.add(self.eggs)
+        response = self.bulk_assign(add=[{'product': self.cake.pk, 'allergen': 'eggs'}])
+        self.assertEqual(response.data['added'], 0)
+        self.assertEqual(self.cake.allergens.count(), 1)
+
+    def test_unknown_ids_rejected(self):
+        response = self.bulk_assign(add=[{'product': 999999, 'allergen': 'mustard'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data['errors']), {'products', 'allergens'})
+        self.assertEqual(self.bulk_assign().status_code, 400)
+
+
+class AdminTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.staff)
+
+    def test_changelists(self):
+        order = self.create_order()
+        enqueue('reconcile_order_totals', user=self.staff)
+        for url in ['/admin/api/order/', '/admin/api/customer/', '/admin/api/job/',
+                    f'/admin/api/order/{order.pk}/change/']:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+        self.assertContains(self.client.get('/admin/api/order/'), 'Ada Lovelace')
+
+    def test_inline_selects_order_customer(self):
+        request = RequestFactory().get('/admin/api/order/')
+        request.user = self.staff
+        queryset = OrderProductInline(Order, admin.site).get_queryset(request)
+        self.assertEqual(queryset.query.select_related, {'order': {'customer': {}}})
+
+    def test_estimated_count_falls_back_to_exact_count(self):
+        for _ in range(2):
+            self.create_order()
+        paginator = EstimatedCountPaginator(Order.objects.all(), 100)
+        self.assertEqual(paginator.count, 2)
+
+
+class BranchTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.north = Branch.objects.create(code='north', name='North')
+        cls.clerk = Staff.objects.create_user(username='clerk', password='pw12345!')
+        cls.clerk.branches.add(cls.north)
+
+    def customer_ids(self, **headers):
+        response = self.client.get('/api/customers/', **headers)
+        self.assertEqual(response.status_code, 200)
+        return [customer['customer_id'] for customer in response.data['results']]
+
+    def test_data_scoped_to_branch(self):
+        self.client.force_authenticate(self.clerk)
+        response = self.client.post('/api/customers/', {
+            'first_name': 'Alan', 'last_name': 'Turing', 'phone_number': '07700 900789'
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        alan = Customer.objects.get(last_name='Turing')
+        self.assertEqual(alan.branch, self.north)
+        self.assertEqual(self.customer_ids(), [alan.pk])
+
+        self.client.force_authenticate(self.staff)
+        self.assertEqual(self.customer_ids(), [self.customer.pk])
+        self.assertEqual(self.customer_ids(HTTP_X_BRANCH='north'), [alan.pk])
+
+    def test_staff_limited_to_assigned_branches(self):
+        self.client.force_authenticate(self.clerk)
+        self.assertEqual(self.client.get('/api/customers/', HTTP_X_BRANCH='main').status_code, 403)
+        self.assertEqual(self.client.get('/api/customers/', HTTP_X_BRANCH='south').status_code, 404)
+
+    def test_router_uses_branch_database(self):
+        router = BranchRouter()
+        self.assertIsNone(router.db_for_read(Customer))
+        self.assertEqual(router.db_for_write(Job), 'default')
+        with use_branch(Branch(code='west', database='west_db')):
+            self.assertEqual(router.db_for_read(Order), 'west_db')
+            self.assertEqual(router.db_for_write(Tombstone), 'west_db')
+            self.assertEqual(router.db_for_read(Staff), 'default')
+
+
+class ProfilingTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+    def get(self, user, params=None, **extra):
+        token = Token.objects.get_or_create(user=user)[0]
+        return self.client.get('/api/customers/', params, HTTP_AUTHORIZATION=f'Token {token.key}', **extra)
+
+    def test_staff_can_profile_a_request(self):
+        response = self.get(self.staff, HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual((profile.method, profile.path, profile.status_code), ('GET', '/api/customers/', 200))
+        self.assertEqual(profile.user, self.staff)
+        self.assertEqual(profile.sql_count, len(profile.queries))
+        self.assertTrue(any('tbl_customers' in query['sql'] for query in profile.queries))
+        self.assertIn('function calls', profile.stats)
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+, sql;dur=[\d.]+;desc="\d+ queries"$')
+
+    def test_unflagged_and_non_staff_requests_not_profiled(self):
+        clerk = Staff.objects.create_user(username='clerk', password='pw12345!')
+        self.assertFalse(self.get(self.staff).has_header('X-Profile-Id'))
+        self.assertFalse(self.get(clerk, HTTP_X_PROFILE='1').has_header('X-Profile-Id'))
+        for flag in ('0', 'false', 'no', 'off'):
+            self.assertFalse(self.get(self.staff, HTTP_X_PROFILE=flag).has_header('X-Profile-Id'))
+            self.assertFalse(self.get(self.staff, {'profile': flag}).has_header('X-Profile-Id'))
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_query_flag(self):
+        self.assertTrue(self.get(self.staff, {'profile': 'true'}).has_header('X-Profile-Id'))
+
+    @override_settings(REQUEST_PROFILE_KEEP=2)
+    def test_keeps_newest_profiles(self):
+        ids = [int(self.get(self.staff, HTTP_X_PROFILE='1')['X-Profile-Id']) for _ in range(3)]
+        self.assertEqual(sorted(RequestProfile.objects.values_list('pk', flat=True)), ids[1:])
+
+
+class AutocompleteTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.grace = Customer.objects.create(
+            first_name='Grace', last_name='Hopper', phone_number='07700 900456', branch=cls.branch
+        )
+
+    def names(self, url, q):
+        response = self.client.get(url, {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [row['name'] for row in response.data]
+
+    def test_customer_prefixes(self):
+        url = '/api/customers/autocomplete/'
+        self.assertEqual(self.names(url, 'ada'), ['Ada Lovelace'])
+        self.assertEqual(self.names(url, 'hop'), ['Grace Hopper'])
+        self.assertEqual(self.names(url, '07700 900'), ['Ada Lovelace', 'Grace Hopper'])
+        self.assertEqual(self.names(url, 'ada@'), ['Ada Lovelace'])
+        self.assertEqual(self.names(url, ''), [])
+
+    def test_product_prefixes(self):
+        self.assertEqual(self.names('/api/products/autocomplete/', 'cak'), ['Carrot Cake'])
+
+    def test_saves_and_deletes_update_index(self):
+        url = '/api/customers/autocomplete/'
+        self.assertEqual(self.names(url, 'lin'), [])
+        Customer.objects.create(first_name='Linus', last_name='Pauling', phone_number='07700 900001',
+                                branch=self.branch)
+        self.assertEqual(self.names(url, 'lin'), ['Linus Pauling'])
+        self.grace.delete()
+        self.assertEqual(self.names(url, 'gra'), [])
+
+    @override_settings(AUTOCOMPLETE_INDEX_MAX_ROWS=1)
+    def test_database_fallback(self):
+        self.assertEqual(self.names('/api/customers/autocomplete/', 'grace hop'), ['Grace Hopper'])
+
+    def test_stale_index_refreshed_in_background(self):
+        index = autocomplete.prefix_index_for(Customer)
+        index.build()
+        Customer.objects.filter(pk=self.grace.pk).update(first_name='Gracie')
+        index._built_at -= index.max_age + 1
+        with mock.patch.object(autocomplete.threading, 'Thread') as thread:
+            self.assertEqual(index.search('grace'), [self.grace.pk])
+            index.search('grace')
+        thread.assert_called_once()
+        self.assertTrue(index._refreshing)
+        with mock.patch.object(autocomplete, 'connections'):
+            thread.call_args.kwargs['target']()
+        self.assertFalse(index._refreshing)
+        self.assertEqual(index.search('gracie'), [self.grace.pk])
+
+
+class OrderLineSnapshotTests(APITestCase):
+
+    def lines(self, order):
+        response = self.client.get(f'/api/orders/{order.pk}/')
+        return [(line['product_name'], line['product_type'], line['product_price'])
+                for line in response.data['order_products']]
+
+    def test_catalogue_changes_leave_past_orders_alone(self):
+        order = self.create_order()
+        Product.objects.filter(pk=self.cake.pk).update(product_name='Vegan Carrot Cake', product_price=Decimal('4.00'))
+        read_models.refresh([order.pk])
+        self.assertEqual(self.lines(order), [('Carrot Cake', 'dessert', '3.50'), ('Pork Pie', 'main', '4.25')])
+
+    def test_changing_the_product_resnapshots(self):
+        order = self.create_order(lines=[(self.cake, 1)])
+        line = order.order_products.get()
+        line.product = self.pie
+        line.save()
+        line.refresh_from_db()
+        self.assertEqual((line.product_name, line.product_type), ('Pork Pie', 'main'))
+
+    def test_migration_backfills_lines(self):
+        order = self.create_order()
+        OrderProduct.objects.filter(order=order).update(product_name='', product_type='', product_suitability='')
+        migration = importlib.import_module('api.migrations.0007_order_product_snapshot')
+        migration.snapshot_products(apps, mock.Mock(connection=connection))
+        self.assertEqual(
+            sorted(OrderProduct.objects.filter(order=order).values_list('product_name', 'product_type')),
+            [('Carrot Cake', 'dessert'), ('Pork Pie', 'main')]
+        )
+
+
+class BulkStatusTests(APITestCase):
+
+    def bulk_status(self, order_ids, new_status):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/orders/bulk_status/', {'order_ids': order_ids, 'status': new_status},
+                                    format='json')
+
+    def test_outcomes(self):
+        pending = self.create_order()
+        confirmed = self.create_order(status='confirmed')
+        done = self.create_order(status='completed')
+        response = self.bulk_status([pending.pk, confirmed.pk, done.pk, 999999, pending.pk], 'confirmed')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual([(r['order_id'], r['outcome'], r['previous_status']) for r in response.data['results']], [
+            (pending.pk, 'updated', 'pending'),
+            (confirmed.pk, 'unchanged', 'confirmed'),
+            (done.pk, 'invalid_transition', 'completed'),
+            (999999, 'not_found', None),
+        ])
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, 'confirmed')
+        self.assertGreater(pending.updated_at, confirmed.updated_at)
+
+    def test_cancel_releases_capacity_and_refreshes_documents(self):
+        order = self.create_order()
+        self.bulk_status([order.pk], 'cancelled')
+        self.assertEqual(CapacitySlot.objects.aggregate(total=Sum('quantity'))['total'], 0)
+        self.assertEqual(self.client.get(f'/api/orders/{order.pk}/').data['status'], 'cancelled')
+
+    def test_rejects_bad_payload(self):
+        self.assertEqual(self.bulk_status([], 'confirmed').status_code, 400)
+        self.assertEqual(self.bulk_status([1], 'lost').status_code, 400)
+
+
+class LoadTestCommandTests(APITestCase):
+
+    def test_seed(self):
+        out = StringIO()
+        call_command('load_test', '--seed-only', '--customers', '5', '--products', '3', '--orders', '4',
+                     '--staff', '2', stdout=out)
+        seeded = json.loads(out.getvalue())
+        self.assertEqual(seeded['last_order'] - seeded['first_order'], 3)
+        self.assertEqual(Staff.objects.filter(username__startswith='loadtest').count(), 2)
+        self.assertEqual(Customer.objects.count(), 6)
+        self.assertEqual(Order.objects.count(), 4)
+        self.assertEqual(OrderDocument.objects.count(), 4)
+        self.assertEqual(reconcile_order_totals()['mismatched'], 0)
+
+    def test_rejects_unknown_mix_entry(self):
+        with self.assertRaisesMessage(CommandError, "Unknown mix entry 'orders.explode'"):
+            call_command('load_test', '--mix', 'orders.explode=5')
+
+    def test_report(self):
+        command = load_test.Command()
+        command.mix = dict(load_test.DEFAULT_MIX)
+        command.samples = {'orders.list': [(0.010, 200), (0.020, 200), (0.030, 503), (0.040, 200)]}
+        command.statuses = {'orders.list': {200: 3, 503: 1}}
+        options = {'server': 'gunicorn', 'workers': 2, 'threads': 1, 'postgres_db': None, 'users': 4,
+                   'duration': 2, 'think_time': 0, 'customers': 1, 'products': 1, 'orders': 1}
+        report = command.build_report(options, measured=2.0)
+        stats = report['endpoints']['orders.list']
+        self.assertEqual((stats['requests'], stats['errors'], stats['error_rate']), (4, 1, 0.25))
+        self.assertEqual(stats['throughput_rps'], 2.0)
+        self.assertEqual(stats['latency_ms']['p50'], 25.0)
+        self.assertEqual(stats['status_codes'], {'200': 3, '503': 1})
+        self.assertEqual(report['total']['requests'], 4)
+
+
+class HardenedSQLiteTests(TestCase):
+
+    def wrapper(self, **options):
+        return HardenedSQLiteWrapper({
+            'ENGINE': 'core.db_backends.sqlite3', 'NAME': ':memory:', 'OPTIONS': options,
+            'TIME_ZONE': None, 'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'AUTOCOMMIT': True,
+            'ATOMIC_REQUESTS': False, 'TEST': {},
+        }, alias='hardened')
+
+    def test_pragma_statements(self):
+        self.assertEqual(pragma_statement('journal_mode', 'wal'), 'PRAGMA journal_mode = WAL')
+        self.assertEqual(pragma_statement('cache_size', '-64000'), 'PRAGMA cache_size = -64000')
+
+    def test_rejects_unknown_pragmas_and_values(self):
+        for pragma, value in [('journal_mode; DROP TABLE tbl_orders', 'WAL'), ('synchronous', 'NORMAL; --'),
+                              ('busy_timeout', '5000 OR 1'), ('key', 'secret')]:
+            with self.assertRaises(ImproperlyConfigured):
+                pragma_statement(pragma, value)
+
+    def test_connection_applies_pragmas(self):
+        wrapper = self.wrapper(pragmas={'busy_timeout': 1234, 'temp_store': 'MEMORY'}, transaction_mode='IMMEDIATE')
+        try:
+            with wrapper.cursor() as cursor:
+                self.assertEqual(cursor.execute('PRAGMA busy_timeout').fetchone(), (1234,))
+                self.assertEqual(cursor.execute('PRAGMA temp_store').fetchone(), (2,))
+        finally:
+            wrapper.close()
+
+    def test_rejects_bad_transaction_mode(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.wrapper(transaction_mode='IMMEDIATE; DROP TABLE tbl_orders').get_connection_params()
+
+
+class SegmentationTests(APITestCase):
+
+    def test_quintile_scores(self):
+        values = np.array([1, 2, 3, 4, 5, 6, 7, 8, 9, 10])
+        self.assertEqual(quintile_scores(values).tolist(), [1, 1, 2, 2, 3, 3, 4, 4, 5, 5])
+        self.assertEqual(quintile_scores(values, higher_is_better=False).tolist(), [5, 5, 4, 4, 3, 3, 2, 2, 1, 1])
+        self.assertEqual(len(set(quintile_scores(np.array([3, 3, 3, 3])).tolist())), 1)
+
+    def test_compute_rfm(self):
+        now = timezone.now()
+        day = 86400
+        columns = np.array([
+            [1, now.timestamp() - 10 * day, 20.0],
+            [1, now.timestamp() - 1 * day, 30.0],
+            [2, now.timestamp() - 100 * day, 5.0],
+        ])
+        rfm = compute_rfm(columns, now)
+        self.assertEqual(rfm['customer_id'].tolist(), [1, 2])
+        self.assertEqual(rfm['frequency'].tolist(), [2, 1])
+        self.assertEqual(rfm['monetary'].tolist(), [50.0, 5.0])
+        self.assertAlmostEqual(rfm['recency_days'][0], 1.0, places=3)
+        self.assertEqual(rfm['segment'].tolist(), ['champions', 'hibernating'])
+
+    def test_recompute_stores_segments_and_filters_customers(self):
+        regular = Customer.objects.create(first_name='Grace', last_name='Hopper', phone_number='07700 900456',
+                                          branch=self.branch)
+        for _ in range(3):
+            self.create_order(customer=regular)
+        self.create_order(status='cancelled')
+        summary = recompute_segments(branch=self.branch)
+        self.assertEqual((summary['orders'], summary['customers']), (3, 1))
+        self.assertEqual(CustomerSegment.objects.get().customer, regular)
+
+        response = self.client.get('/api/customers/', {'segment': CustomerSegment.objects.get().segment})
+        self.assertEqual([c['customer_id'] for c in response.data['results']], [regular.pk])
+        counts = self.client.get('/api/customers/segments/').data['segments']
+        self.assertEqual(counts['unsegmented'], 1)
+        self.assertEqual(sum(counts.values()), 2)
+
+    def test_command_and_endpoint(self):
+        self.create_order()
+        out = StringIO()
+        call_command('compute_segments', '--branch', 'main', stdout=out)
+        self.assertIn('Segmented 1 customers from 1 orders', out.getvalue())
+        response = self.client.post('/api/customers/recompute_segments/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(Job.objects.get(pk=response.data['job_id']).kwargs, {'branch': 'main'})
+
+
+class RepriceTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.pending = self.create_order()
+        self.later = self.create_order(status='confirmed', due_in=timedelta(days=3))
+        self.done = self.create_order(status='completed')
+        Product.objects.filter(pk=self.cake.pk).update(product_price=Decimal('4.00'))
+
+    def reprice(self, **payload):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'/api/products/{self.cake.pk}/reprice_orders/', payload, format='json')
+
+    def totals(self):
+        return {order.pk: order.total_price for order in Order.objects.order_by('pk')}
+
+    def test_reprices_open_orders(self):
+        response = self.reprice()
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual((response.data['orders_affected'], response.data['lines_repriced']), (2, 2))
+        self.assertEqual(response.data['orders'][0], {
+            'order_id': self.pending.pk, 'previous_total': Decimal('11.25'), 'total_price': Decimal('12.25')
+        })
+        self.assertEqual(self.totals(), {
+            self.pending.pk: Decimal('12.25'), self.later.pk: Decimal('12.25'), self.done.pk: Decimal('11.25')
+        })
+        self.assertEqual(self.client.get(f'/api/orders/{self.pending.pk}/').data['total_price'], '12.25')
+        self.assertEqual(reconcile_order_totals()['mismatched'], 0)
+
+    def test_dry_run_and_due_range(self):
+        before = self.totals()
+        response = self.reprice(dry_run=True)
+        self.assertEqual(response.data['orders_affected'], 2)
+        self.assertEqual(self.totals(), before)
+
+        response = self.reprice(due_to=(timezone.now() + timedelta(days=1)).isoformat())
+        self.assertEqual([order['order_id'] for order in response.data['orders']], [self.pending.pk])
+        self.assertEqual(self.totals()[self.later.pk], Decimal('11.25'))
+
+    def test_rejects_closed_statuses(self):
+        self.assertEqual(self.reprice(statuses=['completed']).status_code, 400)
+
+
+class ThrottlingTests(APITestCase):
+
+    def test_retry_after_within_window(self):
+        counter = throttling.SlidingWindowCounter()
+        counter.hit('key', 2, 60, now=0)
+        counter.hit('key', 2, 60, now=1)
+        # At 60s the previous window still weighs 2: one slot frees up at 90s
+        self.assertEqual(counter.hit('key', 2, 60, now=60), 30)
+        self.assertTrue(counter.hit('key', 2, 60, now=89))
+        self.assertFalse(counter.hit('key', 2, 60, now=90))
+
+    def test_retry_after_when_current_window_is_full(self):
+        counter = throttling.SlidingWindowCounter()
+        counter.hit('key', 2, 60, now=0)
+        counter.hit('key', 2, 60, now=1)
+        wait = counter.hit('key', 2, 60, now=2)
+        self.assertEqual(wait, 88)
+        self.assertTrue(counter.hit('key', 2, 60, now=2 + wait - 1))
+        self.assertFalse(counter.hit('key', 2, 60, now=2 + wait))
+
+    def test_dashboard_has_its_own_scope(self):
+        rates = dict(settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], dashboard='2/min', heavy='1/min')
+        with override_settings(REST_FRAMEWORK=dict(
+            settings.REST_FRAMEWORK,
+            DEFAULT_THROTTLE_CLASSES=['api.throttling.SlidingWindowThrottle'],
+            DEFAULT_THROTTLE_RATES=rates,
+        )):
+            self.assertEqual(self.client.get('/api/customers/segments/').status_code, 200)
+            for _ in range(2):
+                self.assertEqual(self.client.get('/api/dashboard/stats/').status_code, 200)
+            response = self.client.get('/api/dashboard/stats/')
+            self.assertEqual(response.status_code, 429)
+            self.assertGreater(int(response['Retry-After']), 0)
+            self.assertEqual(self.client.get('/api/customers/segments/').status_code, 429)
+
+
+class LoadSheddingTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    @override_settings(LOAD_SHED_MAX_QUEUE_MS=100, LOAD_SHED_MAX_IN_FLIGHT=0)
+    def test_sheds_reads_that_queued_too_long(self):
+        middleware = LoadSheddingMiddleware(lambda request: HttpResponse('ok'))
+        queued = {'HTTP_X_REQUEST_START': f't={int((time.time() - 1) * 1000)}'}
+        response = middleware(self.factory.get('/api/customers/', **queued))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], str(settings.LOAD_SHED_RETRY_AFTER))
+        self.assertEqual(middleware(self.factory.post('/api/orders/', **queued)).status_code, 200)
+        self.assertEqual(middleware(self.factory.get('/api/auth/me/', **queued)).status_code, 200)
+        self.assertEqual(middleware(self.factory.get('/api/customers/')).status_code, 200)
+
+    @override_settings(LOAD_SHED_MAX_QUEUE_MS=0, LOAD_SHED_MAX_IN_FLIGHT=1)
+    def test_sheds_reads_over_in_flight_limit(self):
+        nested = []
+
+        def get_response(request):
+            if not nested:
+                nested.append(middleware(self.factory.get('/api/customers/')).status_code)
+            return HttpResponse('ok')
+
+        middleware = LoadSheddingMiddleware(get_response)
+        self.assertEqual(middleware(self.factory.get('/api/customers/')).status_code, 200)
+        self.assertEqual(nested, [503])
+        self.assertEqual(middleware.in_flight, 0)
+
+    def test_in_flight_check_off_by_default(self):
+        self.assertEqual(settings.LOAD_SHED_MAX_IN_FLIGHT, 0)
+
+
+class CapacityTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.start = capacity.slot_start(timezone.now())
+        self.day = timezone.localdate() + timedelta(days=1)
+        self.noon = timezone.make_aware(datetime.combine(self.day, dt_time(12)))
+
+    def booked(self):
+        slots = CapacitySlot.objects.filter(quantity__gt=0)
+        return sorted((timezone.localtime(slot.slot_start).hour, slot.product_type, slot.quantity) for slot in slots)
+
+    def order_due_at(self, when, lines, expect=201, **extra):
+        response = self.client.post('/api/orders/', {
+            'customer': self.customer.pk,
+            'method_of_payment': 'cash',
+            'order_placed': timezone.now().isoformat(),
+            'order_due': when.isoformat(),
+            'products': [{'product': product.pk, 'quantity': quantity} for product, quantity in lines],
+            **extra,
+        }, format='json')
+        self.assertEqual(response.status_code, expect, response.content)
+        return response
+
+    def test_adjust_merges_into_one_slot_per_key(self):
+        for branch_id in (None, self.branch.pk):
+            capacity.adjust({(branch_id, self.start, 'main'): 2})
+            capacity.adjust({(branch_id, self.start, 'main'): 3})
+        self.assertEqual(
+            sorted(CapacitySlot.objects.values_list('branch_id', 'quantity'), key=lambda row: row[0] or 0),
+            [(None, 5), (self.branch.pk, 5)]
+        )
+
+    def test_duplicate_slots_are_rejected_with_or_without_branch(self):
+        for branch in (None, self.branch):
+            CapacitySlot.objects.create(branch=branch, slot_start=self.start, product_type='main', quantity=1)
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                CapacitySlot.objects.create(branch=branch, slot_start=self.start, product_type='main', quantity=1)
+        self.assertEqual(CapacitySlot.objects.count(), 2)
+
+    def test_rebuild(self):
+        self.create_order()
+        CapacitySlot.objects.update(quantity=0)
+        call_command('rebuild_capacity', stdout=StringIO())
+        booked = dict(CapacitySlot.objects.values_list('product_type').annotate(total=Sum('quantity')))
+        self.assertEqual(booked, {'dessert': 2, 'main': 1})
+
+    @override_settings(KITCHEN_SLOT_MINUTES=15, KITCHEN_SLOT_CAPACITY={'main': 3},
+                       KITCHEN_OPENING_HOURS=('07:00', '19:00'))
+    def test_availability_grid(self):
+        self.order_due_at(self.noon + timedelta(minutes=5), [(self.cake, 2), (self.pie, 1)])
+        response = self.client.get('/api/orders/availability/', {'date': self.day.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['slot_minutes'], response.data['capacity']), (15, {'main': 3}))
+        slots = response.data['slots']
+        self.assertEqual(len(slots), 48)
+        self.assertEqual(slots[0]['start'], timezone.make_aware(datetime.combine(self.day, dt_time(7))))
+        noon = next(slot for slot in slots if slot['start'] == self.noon)
+        self.assertEqual(noon['booked'], {'dessert': 2, 'main': 1})
+        self.assertEqual((noon['available'], noon['full']), ({'main': 2}, False))
+        self.assertEqual(slots[1]['available'], {'main': 3})
+        self.assertEqual(self.client.get('/api/orders/availability/', {'date': 'soon'}).status_code, 400)
+
+    @override_settings(KITCHEN_SLOT_CAPACITY={'main': 3})
+    def test_create_checks_capacity(self):
+        self.order_due_at(self.noon, [(self.pie, 1)])
+        response = self.order_due_at(self.noon, [(self.pie, 3), (self.cake, 9)], expect=400, check_capacity=True)
+        self.assertIn('main (3 requested, 2 free)', response.data['order_due'][0])
+        self.order_due_at(self.noon, [(self.pie, 2), (self.cake, 9)], check_capacity=True)
+        # The check is opt-in
+        self.order_due_at(self.noon, [(self.pie, 3)])
+        self.assertEqual(self.booked(), [(12, 'dessert', 9), (12, 'main', 6)])
+
+    @override_settings(KITCHEN_SLOT_CAPACITY={'main': 3})
+    def test_update_checks_capacity_without_counting_its_own_lines(self):
+        self.order_due_at(self.noon, [(self.pie, 3)])
+        order = Order.objects.latest('order_id')
+        url = f'/api/orders/{order.pk}/'
+        response = self.client.patch(url, {'comments': 'Extra gravy', 'check_capacity': True}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.order_due_at(self.noon + timedelta(hours=1), [(self.pie, 1)])
+        response = self.client.patch(url, {'order_due': (self.noon + timedelta(hours=1)).isoformat(),
+                                           'check_capacity': True}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_changing_due_time_moves_capacity(self):
+        self.order_due_at(self.noon, [(self.cake, 2), (self.pie, 1)])
+        order = Order.objects.latest('order_id')
+        response = self.client.patch(f'/api/orders/{order.pk}/', {
+            'order_due': (self.noon + timedelta(hours=2)).isoformat()
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.booked(), [(14, 'dessert', 2), (14, 'main', 1)])
+
+    def test_cancelling_releases_capacity(self):
+        self.order_due_at(self.noon, [(self.cake, 2), (self.pie, 1)])
+        order = Order.objects.latest('order_id')
+        response = self.client.patch(f'/api/orders/{order.pk}/', {'status': 'cancelled'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.booked(), [])
+
+
+class OrderDocumentTests(APITestCase):
+
+    def document(self, order):
+        return read_models.decode(OrderDocument.objects.get(order=order).document)
+
+    def test_written_with_the_order(self):
+        order = self.create_order()
+        document = self.document(order)
+        self.assertEqual((document['customer_name'], document['total_price']), ('Ada Lovelace', '11.25'))
+        self.assertEqual(len(document['order_products']), 2)
+
+    def test_customer_rename_refreshes_documents(self):
+        order = self.create_order()
+        response = self.client.patch(f'/api/customers/{self.customer.pk}/', {'first_name': 'Augusta'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.document(order)['customer_name'], 'Augusta Lovelace')
+
+    def test_reads_serve_stored_documents(self):
+        order = self.create_order()
+        OrderDocument.objects.filter(order=order).update(document=json.dumps({'order_id': order.pk, 'stored': True}))
+        self.assertTrue(self.client.get(f'/api/orders/{order.pk}/').data['stored'])
+        self.assertTrue(self.client.get('/api/orders/').data['results'][0]['stored'])
+
+    def test_missing_documents_render_on_the_fly(self):
+        order = self.create_order()
+        OrderDocument.objects.all().delete()
+        self.assertEqual(self.client.get(f'/api/orders/{order.pk}/').data['total_price'], '11.25')
+        self.assertEqual(self.client.get('/api/orders/999999/').status_code, 404)
+
+    def test_write_transaction_renders_each_order_once(self):
+        with mock.patch.object(read_models, 'render', wraps=read_models.render) as render:
+            response = self.client.post('/api/orders/', {
+                'customer': self.customer.pk,
+                'order_placed': timezone.now().isoformat(),
+                'order_due': (timezone.now() + timedelta(hours=2)).isoformat(),
+                'products': [{'product': self.cake.pk, 'quantity': 1}, {'product': self.pie.pk, 'quantity': 1}],
+            }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(self.document(Order.objects.get())['total_price'], '7.75')
+
+    def test_rebuild_command(self):
+        order = self.create_order()
+        OrderDocument.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_order_documents', stdout=out)
+        self.assertIn("Rebuilt 1 order document(s) on 'default'", out.getvalue())
+        self.assertEqual(self.document(order)['order_id'], order.pk)
+
+
+class WorkingSetTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.active = working_set.working_set_for()
+        self.today = working_set.today_bounds()
+
+    def create_order(self, due=timedelta(hours=12), **kwargs):
+        """An order due `due` after the start of today"""
+        return super().create_order(order_due=(self.today[0] + due).isoformat(), **kwargs)
+
+    def active_ids(self, statuses=('pending', 'confirmed', 'in_progress'), today=True, **filters):
+        if today:
+            filters.setdefault('due_from', self.today[0])
+            filters.setdefault('due_to', self.today[1])
+        records = self.active.select(statuses, **filters)
+        return None if records is None else [record.order_id for record in records]
+
+    def test_own_writes_apply_on_commit(self):
+        first = self.create_order()
+        self.active.load()
+        with self.captureOnCommitCallbacks(execute=True):
+            second = self.create_order(status='confirmed')
+        self.assertEqual(self.active_ids(), [second.pk, first.pk])
+        self.assertEqual(self.active_ids(['confirmed']), [second.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.filter(pk=first.pk).transition('confirmed')
+            second.status = 'completed'
+            second.save()
+        self.assertEqual(self.active_ids(), [first.pk])
+
+    def test_polls_changes_from_other_workers(self):
+        gone = self.create_order()
+        self.active.load()
+        # Neither change runs its on-commit callbacks, as if made by another worker
+        added = self.create_order()
+        Order.objects.filter(pk=gone.pk).delete()
+        self.assertEqual(self.active_ids(), [gone.pk])
+        self.active._polled_at = 0.0
+        self.assertEqual(self.active_ids(), [added.pk])
+
+    def test_holds_only_orders_due_today(self):
+        today = self.create_order()
+        yesterday = self.create_order(due=timedelta(hours=-1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_order(due=timedelta(days=1, hours=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.filter(pk=yesterday.pk).update(order_due=self.today[0] + timedelta(hours=8))
+            working_set.orders_updated([yesterday.pk])
+        self.assertEqual(self.active_ids(), [yesterday.pk, today.pk])
+        self.assertEqual(set(self.active._records), {today.pk, yesterday.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            today.order_due = self.today[1]
+            today.save()
+        self.assertEqual(self.active_ids(), [yesterday.pk])
+
+    def test_reloads_when_the_day_changes(self):
+        self.create_order()
+        self.active.load()
+        tomorrow = self.create_order(due=timedelta(days=1, hours=9))
+        next_day = (self.today[1], self.today[1] + timedelta(days=1))
+        with mock.patch.object(working_set, 'today_bounds', return_value=next_day):
+            self.assertEqual(self.active_ids(due_from=next_day[0], due_to=next_day[1]), [tomorrow.pk])
+
+    def test_filters(self):
+        order = self.create_order(due=timedelta(hours=9))
+        other = Customer.objects.create(first_name='Grace', last_name='Hopper', phone_number='07700 900456')
+        self.create_order(customer=other, due=timedelta(hours=15))
+        morning = (self.today[0], self.today[0] + timedelta(hours=12))
+        self.assertEqual(self.active_ids(customer_id=self.customer.pk), [order.pk])
+        self.assertEqual(self.active_ids(due_from=morning[0], due_to=morning[1]), [order.pk])
+        self.assertEqual(self.active_ids(branch_id=self.branch.pk + 1), [])
+
+    def test_falls_back_to_database(self):
+        self.create_order()
+        self.create_order()
+        self.assertIsNone(self.active_ids(['pending', 'completed']))
+        self.assertIsNone(self.active_ids(today=False))
+        self.assertIsNone(self.active_ids(due_to=self.today[1] + timedelta(days=1)))
+        with override_settings(WORKING_SET_ENABLED=False):
+            self.assertIsNone(self.active_ids())
+        with override_settings(WORKING_SET_MAX_ORDERS=1):
+            self.active.load()
+            self.assertIsNone(self.active_ids())
+            response = self.client.get('/api/orders/', {'status': 'pending', 'due_date': 'today'})
+        self.assertEqual(response.data['count'], 2)
+
+    def test_order_list_uses_working_set(self):
+        order = self.create_order()
+        self.create_order(status='completed')
+        later = super().create_order(due_in=timedelta(days=2))
+        params = {'status': 'pending,confirmed', 'due_date': 'today'}
+        response = self.client.get('/api/orders/', params)
+        self.assertEqual([document['order_id'] for document in response.data['results']], [order.pk])
+        self.assertTrue(self.active.loaded)
+        # Without a due date today's set can't answer, so the database does
+        response = self.client.get('/api/orders/', {'status': 'pending'})
+        self.assertEqual(sorted(document['order_id'] for document in response.data['results']),
+                         sorted([order.pk, later.pk]))
+
+class SessionTests(APITestCase):
+
+    def login(self):
+        client = APIClient()
+        response = client.post('/api/auth/login/', {'username': 'staff', 'password': 'pw12345!'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return client, response
+
+    def test_login_creates_session_by_default(self):
+        self.assertFalse(settings.API_STATELESS)
+        self.login()
+        self.assertEqual(Session.objects.count(), 1)
+
+    @override_settings(API_STATELESS=True)
+    def test_stateless_only_for_token_requests(self):
+        client, response = self.login()
+        self.assertFalse(Session.objects.exists())
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+        # Session logins (the browsable API) keep working without a token
+        client.login(username='staff', password='pw12345!')
+        self.assertEqual(client.get('/api/auth/me/').status_code, 200)
+        self.assertEqual(Session.objects.count(), 1)
+
+        client.credentials(HTTP_AUTHORIZATION=f"Token {response.data['token']}")
+        response = client.get('/api/customers/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.wsgi_request.stateless_session)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+
+class PurgeAuthTests(APITestCase):
+
+    def test_purges_expired_sessions_and_stale_tokens(self):
+        now = timezone.now()
+        Session.objects.create(session_key='expired', session_data='', expire_date=now - timedelta(days=1))
+        Session.objects.create(session_key='current', session_data='', expire_date=now + timedelta(days=1))
+        inactive = Staff.objects.create_user(username='gone', password='pw12345!', is_active=False)
+        idle = Staff.objects.create_user(username='idle', password='pw12345!')
+        Staff.objects.filter(pk=idle.pk).update(last_login=now - timedelta(days=120))
+        for user in (self.staff, inactive, idle):
+            Token.objects.create(user=user)
+        Staff.objects.filter(pk=self.staff.pk).update(last_login=now)
+
+        out = StringIO()
+        call_command('purge_auth', batch_size=1, stdout=out)
+        self.assertIn('Purged 1 session(s) and 1 token(s)', out.getvalue())
+        call_command('purge_auth', token_idle_days=90, stdout=out)
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['current'])
+        self.assertEqual(list(Token.objects.values_list('user_id', flat=True)), [self.staff.pk])
+
+    def test_default_batch_size(self):
+        parser = purge_auth.Command().create_parser('manage.py', 'purge_auth')
+        self.assertEqual(parser.parse_args([]).batch_size, CHUNK_SIZE)
+
+
+class DedupeTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_order()
+        self.duplicate = Customer.objects.create(
+            first_name='Ada', last_name='Lovelace', phone_number='+44 7700 900123', email='ada@example.com',
+            branch=self.branch
+        )
+        self.namesake = Customer.objects.create(first_name='Adah', last_name='Lovelace', phone_number='07700 900999',
+                                                branch=self.branch)
+        Customer.objects.create(first_name='Grace', last_name='Hopper', phone_number='07700 900456', branch=self.branch)
+
+    def test_soundex(self):
+        for name, code in [('Robert', 'R163'), ('Rupert', 'R163'), ('Ashcraft', 'A261'), ('Tymczak', 'T522'),
+                           ('Pfister', 'P236'), ("O'Brien", 'O165'), ('Lee', 'L000'), ('123', '')]:
+            self.assertEqual(dedupe.soundex(name), code, name)
+
+    def test_blocking(self):
+        self.assertEqual(
+            dedupe.blocking_keys('Ada', 'Lovelace', '+447700900123', ' Ada@Example.com '),
+            ['p:+447700900123', 'e:ada@example.com', 'n:L142a']
+        )
+        left, right, oversized = dedupe.candidate_pairs([['a'], ['a', 'b'], ['a', 'b'], ['c']], max_block_size=2)
+        self.assertEqual((list(left), list(right), oversized), ([1], [2], 1))
+
+    def test_find_duplicates(self):
+        summary = dedupe.find_duplicates()
+        self.assertEqual(summary['customers'], 4)
+        self.assertEqual(summary['duplicates'], [
+            {'survivor': self.customer.pk, 'duplicate_ids': [self.duplicate.pk], 'score': 1.0}
+        ])
+        # A similar name alone isn't enough
+        self.assertNotIn(self.namesake.pk, summary['duplicates'][0]['duplicate_ids'])
+        self.assertEqual(dedupe.find_duplicates(min_score=0.4)['duplicates'][0]['duplicate_ids'],
+                         [self.duplicate.pk, self.namesake.pk])
+        oversized = dedupe.find_duplicates(max_block_size=1)
+        self.assertEqual((oversized['candidate_pairs'], oversized['oversized_blocks']), (0, 3))
+
+    def test_find_duplicates_job(self):
+        response = self.client.post('/api/customers/find_duplicates/', {}, format='json')
+        self.assertEqual(response.status_code, 202, response.content)
+        job = claim_next('worker-1')
+        self.assertEqual(job.pk, response.data['job_id'])
+        self.assertTrue(run_job(job))
+        job.refresh_from_db()
+        self.assertEqual(job.result['groups'], 1)
+        self.assertEqual(self.client.post('/api/customers/find_duplicates/', {'min_score': 2}, format='json')
+                         .status_code, 400)
+
+    def test_merge(self):
+        order = self.create_order(customer=self.duplicate)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/customers/{self.customer.pk}/merge/',
+                                        {'duplicate_ids': [self.duplicate.pk, self.customer.pk]}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data['orders_moved'], 1)
+        order.refresh_from_db()
+        self.assertEqual(order.customer_id, self.customer.pk)
+        self.assertFalse(Customer.objects.filter(pk=self.duplicate.pk).exists())
+        self.assertTrue(Tombstone.objects.filter(model_name='api.customer', object_id=self.duplicate.pk).exists())
+        self.assertEqual(self.client.get(f'/api/orders/{order.pk}/').data['customer_name'], 'Ada Lovelace')
+
+    def test_merge_rejects_unknown_customers(self):
+        url = f'/api/customers/{self.customer.pk}/merge/'
+        response = self.client.post(url, {'duplicate_ids': [self.namesake.pk, 999999]}, format='json')
+        self.assertEqual((response.status_code, response.data['missing']), (400, [999999]))
+        self.assertEqual(self.client.post(url, {'duplicate_ids': [self.customer.pk]}, format='json').status_code, 400)
+        self.assertTrue(Customer.objects.filter(pk=self.namesake.pk).exists())
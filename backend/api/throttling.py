@@ -0,0 +1,140 @@
+"""
+Per-client request throttling held in process memory.
+
+Every request is counted against a (scope, client) pair, where the client
+is the auth token (or the session user, or the address for anonymous
+requests) and the scope is the endpoint class: `throttle_scope` on the view
+or `@action`, else `default`. Rates come from `DEFAULT_THROTTLE_RATES`, so
+cheap type-ahead lookups can be allowed far more often than heavy reports
+without either using up the other's budget.
+
+Counts use a sliding window approximated from the current and previous
+fixed windows, which keeps two integers per key instead of a timestamp per
+request and needs no cache round trip. Limits apply per worker process.
+"""
+import math
+import threading
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'120/min' -> (120, 60)"""
+    if rate is None:
+        return None, None
+    num, period = rate.split('/')
+    return int(num), DURATIONS[period[0]]
+
+
+class SlidingWindowCounter:
+    """Request counts per key over a sliding window, approximated from two fixed windows"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._windows = {}
+        self._next_sweep = 0.0
+
+    def hit(self, key, limit, duration, now=None):
+        """
+        Count a request for `key` if it is under `limit` per `duration`.
+
+        Returns 0 when the request is allowed, else the seconds until it
+        would be.
+        """
+        now = time.monotonic() if now is None else now
+        window = int(now // duration)
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            start, current, previous, key_duration = self._windows.get(key, (window, 0, 0, duration))
+            if window != start:
+                previous = current if window == start + 1 else 0
+                current = 0
+            elapsed = now / duration - window
+            weighted = previous * (1 - elapsed) + current
+            if weighted + 1 > limit:
+                self._windows[key] = (window, current, previous, duration)
+                if current < limit:
+                    # Wait until enough of the previous window has slid out
+                    wait = (1 - (limit - 1 - current) / previous - elapsed) * duration
+                else:
+                    # The previous window is all gone at the next boundary; then
+                    # wait until enough of this one has slid out too
+                    wait = (1 - elapsed + max(1 - (limit - 1) / current, 0)) * duration
+                return max(wait, 0.001)
+            self._windows[key] = (window, current + 1, previous, duration)
+            return 0
+
+    def _sweep(self, now):
+        """Drop keys that have been idle for two full windows"""
+        self._windows = {
+            key: entry for key, entry in self._windows.items()
+            if int(now // entry[3]) <= entry[0] + 1
+        }
+        self._next_sweep = now + 60
+
+    def clear(self):
+        with self._lock:
+            self._windows.clear()
+
+
+counter = SlidingWindowCounter()
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    Throttle requests per client and endpoint scope using in-memory counts.
+
+    The scope is the view's `throttle_scope` (set it per action with
+    `@action(..., throttle_scope='cheap')`), falling back to the throttle
+    class's own `scope`. A scope with no configured rate, or a rate of None,
+    is not throttled.
+    """
+    scope = 'default'
+    counter = counter
+
+    def get_scope(self, view):
+        return getattr(view, 'throttle_scope', None) or self.scope
+
+    def get_client(self, request):
+        auth = getattr(request, 'auth', None)
+        if auth is not None and hasattr(auth, 'pk'):
+            return f'token:{auth.pk}'
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return f'user:{user.pk}'
+        return f'addr:{self.get_ident(request)}'
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(view)
+        try:
+            rate = api_settings.DEFAULT_THROTTLE_RATES[scope]
+        except KeyError:
+            raise ImproperlyConfigured(f"No throttle rate set for '{scope}' scope")
+        self.limit, self.duration = parse_rate(rate)
+        if self.limit is None:
+            return True
+        self.retry_after = self.counter.hit(
+            (scope, self.get_client(request)), self.limit, self.duration
+        )
+        return not self.retry_after
+
+    def wait(self):
+        return math.ceil(self.retry_after)
+
+
+class FixedScopeThrottle(SlidingWindowThrottle):
+    """For function views, which can't set `throttle_scope`: always the class's `scope`"""
+
+    def get_scope(self, view):
+        return self.scope
+
+
+class DashboardThrottle(FixedScopeThrottle):
+    """Dashboard polling, kept apart from the 'heavy' budget of reports and bulk jobs"""
+    scope = 'dashboard'
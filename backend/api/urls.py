@@ -4,10 +4,12 @@ from . import views
 
 # Create a router and register viewsets
 router = DefaultRouter()
+router.register(r'branches', views.BranchViewSet, basename='branch')
 router.register(r'customers', views.CustomerViewSet, basename='customer')
 router.register(r'products', views.ProductViewSet, basename='product')
 router.register(r'orders', views.OrderViewSet, basename='order')
 router.register(r'allergens', views.AllergenInfoViewSet, basename='allergen')
+router.register(r'jobs', views.JobViewSet, basename='job')
 
 urlpatterns = [
     # Authentication endpoints
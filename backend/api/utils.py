@@ -0,0 +1,38 @@
+"""
+Shared helpers for the API app.
+"""
+import re
+
+from django.conf import settings
+
+
+_non_digits = re.compile(r'\D')
+
+
+def normalize_phone(raw):
+    """
+    Normalize a phone number to E.164 (e.g. '+447700900123').
+
+    Spaces, dashes and brackets are ignored, a '00' international prefix is
+    treated as '+', and national numbers with a leading trunk '0' get
+    `PHONE_DEFAULT_COUNTRY_CODE` (UK by default). Returns '' when the input
+    contains no digits.
+    """
+    if not raw:
+        return ''
+    # '+44 (0)7700 900123' style numbers repeat the trunk prefix
+    raw = raw.strip().replace('(0)', '')
+    digits = _non_digits.sub('', raw)
+    if not digits:
+        return ''
+
+    country_code = getattr(settings, 'PHONE_DEFAULT_COUNTRY_CODE', '44')
+    if raw.startswith('+'):
+        return '+' + digits
+    if digits.startswith('00'):
+        return '+' + digits[2:]
+    if digits.startswith('0'):
+        return '+' + country_code + digits[1:]
+    if digits.startswith(country_code) and len(digits) > 10:
+        return '+' + digits
+    return '+' + country_code + digits
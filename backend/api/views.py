@@ -1,18 +1,39 @@
+from datetime import datetime, timedelta
+
 from rest_framework import viewsets, status, generics
-from rest_framework.decorators import api_view, action
+from rest_framework.decorators import api_view, action, throttle_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.authtoken.models import Token
-from django.db.models import Q
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, Max, OuterRef, Prefetch, Q
 from django.contrib.auth import login, logout
+from django.contrib.auth.models import update_last_login
+from django.http import Http404
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 
-from .models import Staff, Customer, Product, Order, OrderProduct, AllergenInfo
+from .models import Branch, Staff, Customer, CustomerSegment, Product, Order, OrderProduct, AllergenInfo, Job
+from .autocomplete import autocomplete
+from .capacity import day_grid, slot_capacity, slot_length
+from .branches import BranchScopedMixin, current_database, resolve_branch, use_branch
+from .db import write_transaction
+from .deletion import delete_customers, delete_orders
+from .jobs import enqueue
+from .sync import DeltaSyncMixin
+from .throttling import DashboardThrottle
+from .read_models import documents_for
+from .working_set import working_set_for
+from .recommendations import copurchase_index_for
+from .utils import normalize_phone
 from .serializers import (
-    StaffSerializer, StaffLoginSerializer, StaffRegistrationSerializer,
-    CustomerSerializer, CustomerListSerializer,
+    BranchSerializer, StaffSerializer, StaffLoginSerializer, StaffRegistrationSerializer,
+    CustomerSerializer, CustomerListSerializer, CustomerAutocompleteSerializer,
     ProductSerializer, ProductListSerializer,
-    OrderSerializer, OrderCreateSerializer, OrderProductSerializer,
-    AllergenInfoSerializer
+    OrderSerializer, OrderSummarySerializer, OrderCreateSerializer, OrderProductSerializer,
+    BulkOrderStatusSerializer, RepriceOrdersSerializer, MergeCustomersSerializer, FindDuplicatesSerializer,
+    AllergenInfoSerializer, BulkAllergenAssignmentSerializer, JobSerializer
 )
 
 
@@ -22,12 +43,16 @@ class LoginView(generics.GenericAPIView):
     """Handle staff login"""
     serializer_class = StaffLoginSerializer
     permission_classes = [AllowAny]
+    throttle_scope = 'login'
     
     def post(self, request):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
             user = serializer.validated_data['user']
-            login(request, user)
+            if getattr(settings, 'API_STATELESS', False):
+                update_last_login(None, user)
+            else:
+                login(request, user)
             token, created = Token.objects.get_or_create(user=user)
             return Response({
                 'success': True,
@@ -62,6 +87,7 @@ class RegisterView(generics.CreateAPIView):
     """Handle staff registration"""
     serializer_class = StaffRegistrationSerializer
     permission_classes = [AllowAny]
+    throttle_scope = 'login'
     
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -90,46 +116,213 @@ class CurrentUserView(generics.RetrieveAPIView):
         return self.request.user
 
 
+# ==================== Branch Views ====================
+
+class BranchViewSet(viewsets.ReadOnlyModelViewSet):
+    """Branches the current user may work in (send as the X-Branch header)"""
+    serializer_class = BranchSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        user = self.request.user
+        if user.is_superuser:
+            return Branch.objects.filter(is_active=True)
+        branches = user.branches.filter(is_active=True)
+        if not branches.exists():
+            return Branch.objects.filter(code=settings.DEFAULT_BRANCH, is_active=True)
+        return branches
+
+
 # ==================== Customer Views ====================
 
-class CustomerViewSet(viewsets.ModelViewSet):
+def _autocomplete(request, model, branch):
+    """Rows matching the `q` prefix, at most `limit` (capped by AUTOCOMPLETE_MAX_LIMIT)"""
+    query = request.query_params.get('q', '')
+    max_limit = getattr(settings, 'AUTOCOMPLETE_MAX_LIMIT', 50)
+    try:
+        limit = min(max(int(request.query_params.get('limit', 10)), 1), max_limit)
+    except ValueError:
+        limit = 10
+    return autocomplete(
+        model, query,
+        using=current_database(),
+        branch_id=branch.pk if branch is not None else None,
+        limit=limit,
+    )
+
+
+class CustomerViewSet(BranchScopedMixin, DeltaSyncMixin, viewsets.ModelViewSet):
     """ViewSet for Customer CRUD operations"""
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
     permission_classes = [IsAuthenticated]
+    throttle_scope = 'default'
     
     def get_queryset(self):
-        queryset = Customer.objects.all()
+        queryset = self.branch_filter(Customer.objects.select_related('segment'))
         search = self.request.query_params.get('search', None)
+        segment = self.request.query_params.get('segment', None)
+        
+        if segment:
+            queryset = queryset.filter(segment__segment__in=segment.split(','))
         
         if search:
-            queryset = queryset.filter(
+            search_filter = (
                 Q(first_name__icontains=search) |
                 Q(last_name__icontains=search) |
                 Q(email__icontains=search) |
                 Q(phone_number__icontains=search)
             )
+            phone = normalize_phone(search)
+            if len(phone) > 8:
+                search_filter |= Q(phone_normalized=phone)
+            queryset = queryset.filter(search_filter)
         
         return queryset
     
-    @action(detail=False, methods=['get'])
+    def perform_destroy(self, instance):
+        delete_customers([instance.pk])
+    
+    @action(detail=False, methods=['get'], throttle_scope='cheap')
+    def lookup(self, request):
+        """Find a customer by exact phone number, with their most recent orders"""
+        phone = normalize_phone(request.query_params.get('phone', ''))
+        if not phone:
+            return Response({
+                'success': False,
+                'message': 'A phone number is required'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        customer = self.branch_filter(
+            Customer.objects.filter(phone_normalized=phone)
+        ).order_by('-updated_at').first()
+        if customer is None:
+            return Response({
+                'success': False,
+                'message': 'No customer with that phone number'
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        try:
+            limit = min(max(int(request.query_params.get('orders', 5)), 0), 50)
+        except ValueError:
+            limit = 5
+        recent_orders = Order.objects.filter(customer=customer).order_by('-order_placed')[:limit]
+        return Response({
+            'customer': CustomerSerializer(customer).data,
+            'recent_orders': OrderSummarySerializer(recent_orders, many=True).data
+        })
+    
+    @action(detail=False, methods=['get'], throttle_scope='heavy')
+    def segments(self, request):
+        """Get customer counts per RFM segment"""
+        counts = self.branch_filter(Customer.objects.all()).values('segment__segment').annotate(
+            count=Count('pk')
+        ).order_by()
+        computed_at = CustomerSegment.objects.filter(
+            customer__in=self.branch_filter(Customer.objects.all())
+        ).aggregate(latest=Max('computed_at'))['latest']
+        return Response({
+            'segments': {row['segment__segment'] or 'unsegmented': row['count'] for row in counts},
+            'labels': dict(CustomerSegment.SEGMENTS),
+            'computed_at': computed_at
+        })
+    
+    @action(detail=False, methods=['post'], throttle_scope='heavy')
+    def recompute_segments(self, request):
+        """Queue a job that recomputes RFM segments from order history"""
+        job = enqueue(
+            'recompute_customer_segments',
+            user=request.user,
+            branch=self.branch.code if self.branch else None
+        )
+        return Response({
+            'success': True,
+            'message': 'Segment recompute queued',
+            'job_id': job.job_id
+        }, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=False, methods=['post'], throttle_scope='heavy')
+    def find_duplicates(self, request):
+        """Queue a job that finds groups of probable duplicate customers"""
+        serializer = FindDuplicatesSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({
+                'success': False,
+                'message': 'Invalid duplicate search',
+                'errors': serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        job = enqueue(
+            'find_duplicate_customers',
+            user=request.user,
+            branch=self.branch.code if self.branch else None,
+            min_score=serializer.validated_data.get('min_score')
+        )
+        return Response({
+            'success': True,
+            'message': 'Duplicate search queued',
+            'job_id': job.job_id
+        }, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=True, methods=['post'])
+    @write_transaction
+    def merge(self, request, pk=None):
+        """Merge duplicates into this customer: their orders move here and they are deleted"""
+        survivor = self.get_object()
+        serializer = MergeCustomersSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({
+                'success': False,
+                'message': 'Invalid merge request',
+                'errors': serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        duplicate_ids = set(serializer.validated_data['duplicate_ids']) - {survivor.pk}
+        found = set(
+            self.branch_filter(Customer.objects.filter(pk__in=duplicate_ids)).values_list('pk', flat=True)
+        )
+        if not duplicate_ids or found != duplicate_ids:
+            return Response({
+                'success': False,
+                'message': 'Unknown duplicate customer(s)',
+                'missing': sorted(duplicate_ids - found)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        moved = Order.objects.filter(customer_id__in=found).reassign(survivor)
+        delete_customers(list(found))
+        return Response({
+            'success': True,
+            'message': f'Merged {len(found)} customer(s) into {survivor.full_name}',
+            'orders_moved': moved,
+            'customer': CustomerSerializer(survivor).data
+        })
+    
+    @action(detail=False, methods=['get'], throttle_scope='cheap')
+    def autocomplete(self, request):
+        """Get the top matches for a name, phone or email prefix"""
+        customers = _autocomplete(request, Customer, self.branch)
+        serializer = CustomerAutocompleteSerializer(customers, many=True)
+        return Response(serializer.data)
+    
+    @action(detail=False, methods=['get'], throttle_scope='cheap')
     def list_simple(self, request):
         """Get simplified customer list for dropdowns"""
-        customers = Customer.objects.all()
+        customers = self.branch_filter(Customer.objects.all())
         serializer = CustomerListSerializer(customers, many=True)
         return Response(serializer.data)
 
 
 # ==================== Product Views ====================
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(BranchScopedMixin, DeltaSyncMixin, viewsets.ModelViewSet):
     """ViewSet for Product CRUD operations"""
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticated]
+    throttle_scope = 'default'
     
     def get_queryset(self):
-        queryset = Product.objects.all()
+        queryset = self.branch_filter(Product.objects.all())
         search = self.request.query_params.get('search', None)
         product_type = self.request.query_params.get('type', None)
         suitability = self.request.query_params.get('suitability', None)
@@ -153,13 +346,95 @@ class ProductViewSet(viewsets.ModelViewSet):
         
         return queryset
     
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['get'], throttle_scope='cheap')
+    def autocomplete(self, request):
+        """Get the top active products matching a name prefix"""
+        products = _autocomplete(request, Product, self.branch)
+        serializer = ProductListSerializer(products, many=True)
+        return Response(serializer.data)
+    
+    @action(detail=False, methods=['get'], throttle_scope='cheap')
     def list_simple(self, request):
         """Get simplified product list for dropdowns"""
-        products = Product.objects.filter(is_active=True)
+        products = self.branch_filter(Product.objects.filter(is_active=True))
         serializer = ProductListSerializer(products, many=True)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['get'], throttle_scope='cheap')
+    def related(self, request, pk=None):
+        """Get products most often ordered together with this one"""
+        try:
+            product_id = int(pk)
+            k = min(max(int(request.query_params.get('k', 10)), 1), 50)
+        except (TypeError, ValueError):
+            return Response({
+                'success': False,
+                'message': 'Invalid product id or k'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        scores = copurchase_index_for(current_database()).related(product_id, k=k)
+        products = self.branch_filter(
+            Product.objects.filter(pk__in=[pid for pid, _ in scores], is_active=True)
+        ).in_bulk()
+        data = []
+        for pid, count in scores:
+            if pid in products:
+                item = ProductListSerializer(products[pid]).data
+                item['times_ordered_together'] = count
+                data.append(item)
+        return Response(data)
+    
+    @action(detail=True, methods=['post'], throttle_scope='heavy')
+    @write_transaction
+    def reprice_orders(self, request, pk=None):
+        """Apply the product's current price to its lines on open orders"""
+        product = self.get_object()
+        serializer = RepriceOrdersSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({
+                'success': False,
+                'message': 'Invalid repricing scope',
+                'errors': serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        scope = serializer.validated_data
+        stale_lines = OrderProduct.objects.filter(order=OuterRef('pk'), product=product).exclude(
+            unit_price=product.product_price
+        )
+        orders = self.branch_filter(Order.objects.filter(status__in=scope['statuses'])).filter(Exists(stale_lines))
+        if 'due_from' in scope:
+            orders = orders.filter(order_due__gte=scope['due_from'])
+        if 'due_to' in scope:
+            orders = orders.filter(order_due__lte=scope['due_to'])
+        
+        previous_totals = dict(orders.order_by('pk').values_list('pk', 'total_price'))
+        repriced = 0
+        new_totals = previous_totals
+        if previous_totals and not scope['dry_run']:
+            affected = Order.objects.filter(pk__in=list(previous_totals))
+            repriced = affected.reprice(product)
+            new_totals = dict(affected.values_list('pk', 'total_price'))
+        
+        return Response({
+            'success': True,
+            'message': (
+                f"{len(previous_totals)} order(s) would be repriced" if scope['dry_run']
+                else f"{len(previous_totals)} order(s) repriced to {product.product_price}"
+            ),
+            'unit_price': product.product_price,
+            'dry_run': scope['dry_run'],
+            'orders_affected': len(previous_totals),
+            'lines_repriced': repriced,
+            'orders': [
+                {
+                    'order_id': order_id,
+                    'previous_total': previous_total,
+                    'total_price': new_totals[order_id],
+                }
+                for order_id, previous_total in previous_totals.items()
+            ]
+        })
+    
     @action(detail=False, methods=['get'])
     def types(self, request):
         """Get available product types"""
@@ -173,10 +448,25 @@ class ProductViewSet(viewsets.ModelViewSet):
 
 # ==================== Order Views ====================
 
-class OrderViewSet(viewsets.ModelViewSet):
+def _day_bounds(value):
+    """Aware [start, end) of a local day given as YYYY-MM-DD or 'today'; None if invalid"""
+    if not value:
+        return None
+    try:
+        day = timezone.localdate() if value == 'today' else parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        return None
+    start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), datetime.min.time()))
+
+
+class OrderViewSet(BranchScopedMixin, DeltaSyncMixin, viewsets.ModelViewSet):
     """ViewSet for Order CRUD operations"""
     queryset = Order.objects.all()
     permission_classes = [IsAuthenticated]
+    throttle_scope = 'default'
     
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
@@ -184,7 +474,9 @@ class OrderViewSet(viewsets.ModelViewSet):
         return OrderSerializer
     
     def get_queryset(self):
-        queryset = Order.objects.select_related('customer').prefetch_related('order_products__product')
+        queryset = self.branch_filter(
+            Order.objects.select_related('customer').prefetch_related('order_products')
+        )
         
         customer_id = self.request.query_params.get('customer', None)
         status_filter = self.request.query_params.get('status', None)
@@ -194,8 +486,10 @@ class OrderViewSet(viewsets.ModelViewSet):
         if customer_id:
             queryset = queryset.filter(customer_id=customer_id)
         
+        due_bounds = _day_bounds(self.request.query_params.get('due_date', None))
+        
         if status_filter:
-            queryset = queryset.filter(status=status_filter)
+            queryset = queryset.filter(status__in=status_filter.split(','))
         
         if date_from:
             queryset = queryset.filter(order_placed__gte=date_from)
@@ -203,8 +497,73 @@ class OrderViewSet(viewsets.ModelViewSet):
         if date_to:
             queryset = queryset.filter(order_placed__lte=date_to)
         
+        if due_bounds:
+            queryset = queryset.filter(order_due__gte=due_bounds[0], order_due__lt=due_bounds[1])
+        
         return queryset
     
+    def _active_order_ids(self):
+        """
+        Ids of the orders to list, newest placed first, from the in-memory
+        working set when the query only concerns active orders; else None
+        """
+        params = self.request.query_params
+        statuses = [value for value in params.get('status', '').split(',') if value]
+        if not statuses or params.get('date_from') or params.get('date_to'):
+            return None
+        filters = {'branch_id': self.branch.pk if self.branch is not None else None}
+        if params.get('customer'):
+            try:
+                filters['customer_id'] = int(params['customer'])
+            except ValueError:
+                return None
+        if params.get('due_date'):
+            due_bounds = _day_bounds(params['due_date'])
+            if due_bounds is None:
+                return None
+            filters['due_from'], filters['due_to'] = due_bounds
+        records = working_set_for(current_database()).select(statuses, **filters)
+        return None if records is None else [record.order_id for record in records]
+    
+    def list(self, request, *args, **kwargs):
+        if 'updated_since' in request.query_params:
+            return super().list(request, *args, **kwargs)
+        # Serve the stored order documents; only the ids come from memory or tbl_orders
+        order_ids = self._active_order_ids()
+        if order_ids is None:
+            order_ids = self.filter_queryset(self.get_queryset()).prefetch_related(None).values_list('pk', flat=True)
+        page = self.paginate_queryset(order_ids)
+        if page is not None:
+            return self.get_paginated_response(documents_for(page, using=current_database()))
+        return Response(documents_for(order_ids, using=current_database()))
+    
+    def retrieve(self, request, *args, **kwargs):
+        lookup = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        try:
+            order_ids = list(queryset.filter(pk=lookup).values_list('pk', flat=True))
+        except (TypeError, ValueError):
+            order_ids = []
+        documents = documents_for(order_ids, using=current_database()) if order_ids else []
+        if not documents:
+            raise Http404('No Order matches the given query.')
+        return Response(documents[0])
+    
+    @write_transaction
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+    
+    @write_transaction
+    def update(self, request, *args, **kwargs):
+        return super().update(request, *args, **kwargs)
+    
+    @write_transaction
+    def destroy(self, request, *args, **kwargs):
+        return super().destroy(request, *args, **kwargs)
+    
+    def perform_destroy(self, instance):
+        delete_orders([instance.pk])
+    
     @action(detail=True, methods=['get'])
     def products(self, request, pk=None):
         """Get products for a specific order"""
@@ -214,6 +573,7 @@ class OrderViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
     
     @action(detail=True, methods=['post'])
+    @write_transaction
     def add_product(self, request, pk=None):
         """Add a product to an order"""
         order = self.get_object()
@@ -221,7 +581,7 @@ class OrderViewSet(viewsets.ModelViewSet):
         quantity = request.data.get('quantity', 1)
         
         try:
-            product = Product.objects.get(pk=product_id)
+            product = self.branch_filter(Product.objects.all()).get(pk=product_id)
             order_product, created = OrderProduct.objects.get_or_create(
                 order=order,
                 product=product,
@@ -231,6 +591,14 @@ class OrderViewSet(viewsets.ModelViewSet):
             if not created:
                 order_product.quantity += quantity
                 order_product.save()
+            else:
+                product_ids = list(order.order_products.values_list('product_id', flat=True))
+                old_product_ids = [pid for pid in product_ids if pid != product.pk]
+                index = copurchase_index_for(current_database())
+                transaction.on_commit(
+                    lambda: index.replace_order(old_product_ids, product_ids),
+                    using=current_database()
+                )
             
             # Recalculate total
             order.calculate_total()
@@ -247,6 +615,7 @@ class OrderViewSet(viewsets.ModelViewSet):
             }, status=status.HTTP_404_NOT_FOUND)
     
     @action(detail=True, methods=['post'])
+    @write_transaction
     def remove_product(self, request, pk=None):
         """Remove a product from an order"""
         order = self.get_object()
@@ -256,6 +625,14 @@ class OrderViewSet(viewsets.ModelViewSet):
             order_product = OrderProduct.objects.get(order=order, product_id=product_id)
             order_product.delete()
             
+            product_ids = list(order.order_products.values_list('product_id', flat=True))
+            removed_product_id = order_product.product_id
+            index = copurchase_index_for(current_database())
+            transaction.on_commit(
+                lambda: index.replace_order(product_ids + [removed_product_id], product_ids),
+                using=current_database()
+            )
+            
             # Recalculate total
             order.calculate_total()
             order.save()
@@ -270,6 +647,104 @@ class OrderViewSet(viewsets.ModelViewSet):
                 'message': 'Product not found in order'
             }, status=status.HTTP_404_NOT_FOUND)
     
+    @action(detail=False, methods=['post'], throttle_scope='heavy')
+    @write_transaction
+    def bulk_delete(self, request):
+        """Delete many orders (and their lines) in one request"""
+        order_ids = request.data.get('order_ids')
+        if not isinstance(order_ids, list) or not all(isinstance(i, int) for i in order_ids):
+            return Response({
+                'success': False,
+                'message': 'order_ids must be a list of order ids'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        deleted = delete_orders(
+            self.branch_filter(Order.objects.filter(pk__in=order_ids)).values_list('pk', flat=True)
+        )
+        return Response({
+            'success': True,
+            'message': f'{deleted} order(s) deleted',
+            'deleted': deleted
+        })
+    
+    @action(detail=False, methods=['post'])
+    @write_transaction
+    def bulk_status(self, request):
+        """Move many orders to a status, allowing only legal transitions"""
+        serializer = BulkOrderStatusSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({
+                'success': False,
+                'message': 'Invalid status change',
+                'errors': serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        order_ids = list(dict.fromkeys(serializer.validated_data['order_ids']))
+        new_status = serializer.validated_data['status']
+        allowed_from = Order.predecessors(new_status)
+        orders = self.branch_filter(Order.objects.filter(pk__in=order_ids)).order_by()
+        
+        before = dict(orders.values_list('pk', 'status'))
+        updated = orders.transition(new_status)
+        if updated != sum(1 for current in before.values() if current in allowed_from):
+            # Some orders changed status since we read them; report what stuck
+            after = dict(orders.values_list('pk', 'status'))
+        else:
+            after = None
+        
+        results = []
+        for order_id in order_ids:
+            previous = before.get(order_id)
+            if previous is None:
+                outcome = 'not_found'
+            elif previous == new_status:
+                outcome = 'unchanged'
+            elif previous not in allowed_from:
+                outcome = 'invalid_transition'
+            elif after is not None and after.get(order_id) != new_status:
+                outcome = 'conflict'
+            else:
+                outcome = 'updated'
+            results.append({
+                'order_id': order_id,
+                'outcome': outcome,
+                'previous_status': previous,
+            })
+        
+        return Response({
+            'success': True,
+            'message': f'{updated} order(s) moved to {new_status}',
+            'updated': updated,
+            'results': results
+        })
+    
+    @action(detail=False, methods=['post'], throttle_scope='heavy')
+    def reconcile_totals(self, request):
+        """Report (or repair, with fix=true) orders whose total doesn't match their lines"""
+        fix = str(request.data.get('fix', 'false')).lower() == 'true'
+        try:
+            batch_size = int(request.data.get('batch_size', 1000))
+        except (TypeError, ValueError):
+            batch_size = 0
+        if batch_size < 1:
+            return Response({
+                'success': False,
+                'message': 'batch_size must be a positive integer'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        job = enqueue(
+            'reconcile_order_totals',
+            user=request.user,
+            fix=fix,
+            batch_size=batch_size,
+            branch=self.branch.code if self.branch else None
+        )
+        return Response({
+            'success': True,
+            'message': 'Reconciliation queued',
+            'job_id': job.job_id
+        }, status=status.HTTP_202_ACCEPTED)
+    
     @action(detail=False, methods=['get'])
     def payment_methods(self, request):
         """Get available payment methods"""
@@ -279,25 +754,102 @@ class OrderViewSet(viewsets.ModelViewSet):
     def statuses(self, request):
         """Get available order statuses"""
         return Response(dict(Order.ORDER_STATUS))
+    
+    @action(detail=False, methods=['get'])
+    def status_transitions(self, request):
+        """Get the statuses each order status may move to"""
+        return Response(Order.STATUS_TRANSITIONS)
+    
+    @action(detail=False, methods=['get'], throttle_scope='cheap')
+    def availability(self, request):
+        """Get a day's kitchen slots with booked and free quantity per product type"""
+        day = request.query_params.get('date')
+        try:
+            day = parse_date(day) if day else timezone.localdate()
+        except ValueError:
+            day = None
+        if day is None:
+            return Response({
+                'success': False,
+                'message': 'date must be YYYY-MM-DD'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'date': day,
+            'slot_minutes': int(slot_length().total_seconds() // 60),
+            'capacity': slot_capacity(),
+            'slots': day_grid(day, branch=self.branch, using=current_database())
+        })
 
 
 # ==================== Allergen Views ====================
 
-class AllergenInfoViewSet(viewsets.ModelViewSet):
+class AllergenInfoViewSet(BranchScopedMixin, viewsets.ModelViewSet):
     """ViewSet for AllergenInfo CRUD operations"""
     queryset = AllergenInfo.objects.all()
     serializer_class = AllergenInfoSerializer
     permission_classes = [IsAuthenticated]
     
+    def get_queryset(self):
+        # Allergens are shared; only list the products of the active branch
+        return AllergenInfo.objects.prefetch_related(
+            Prefetch('products', queryset=self.branch_filter(Product.objects.all()))
+        )
+    
     @action(detail=False, methods=['get'])
     def types(self, request):
         """Get available allergen types"""
         return Response(dict(AllergenInfo.ALLERGEN_TYPES))
     
+    @action(detail=False, methods=['post'])
+    def bulk_assign(self, request):
+        """Add and remove many (product, allergen) links in one transaction"""
+        serializer = BulkAllergenAssignmentSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({
+                'success': False,
+                'message': 'Invalid allergen assignments',
+                'errors': serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        Link = AllergenInfo.products.through
+        to_add = serializer.validated_data['add']
+        to_remove = serializer.validated_data['remove'] - to_add
+        
+        with transaction.atomic(using=current_database()):
+            removed = 0
+            by_allergen = {}
+            for product_id, allergen_id in to_remove:
+                by_allergen.setdefault(allergen_id, []).append(product_id)
+            for allergen_id, product_ids in by_allergen.items():
+                removed += Link.objects.filter(
+                    allergeninfo_id=allergen_id, product_id__in=product_ids
+                ).delete()[0]
+            
+            existing = set()
+            for allergen_id in {allergen_id for _, allergen_id in to_add}:
+                product_ids = [product_id for product_id, a in to_add if a == allergen_id]
+                existing.update(
+                    (product_id, allergen_id) for product_id in Link.objects.filter(
+                        allergeninfo_id=allergen_id, product_id__in=product_ids
+                    ).values_list('product_id', flat=True)
+                )
+            new_links = [
+                Link(product_id=product_id, allergeninfo_id=allergen_id)
+                for product_id, allergen_id in sorted(to_add - existing)
+            ]
+            Link.objects.bulk_create(new_links, batch_size=500)
+        
+        return Response({
+            'success': True,
+            'added': len(new_links),
+            'removed': removed
+        })
+    
     @action(detail=False, methods=['get'])
     def all_info(self, request):
         """Get all allergen information formatted for display"""
-        allergens = AllergenInfo.objects.prefetch_related('products').all()
+        allergens = self.get_queryset()
         data = []
         for allergen in allergens:
             data.append({
@@ -308,21 +860,69 @@ class AllergenInfoViewSet(viewsets.ModelViewSet):
         return Response(data)
 
 
+# ==================== Job Views ====================
+
+class JobViewSet(BranchScopedMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet for background job status and progress.
+    Staff see the jobs they queued in their branch; superusers see every
+    job of the branch.
+    """
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        queryset = self.branch_filter(Job.objects.select_related('created_by', 'branch'))
+        if not self.request.user.is_superuser:
+            queryset = queryset.filter(created_by=self.request.user)
+        status_filter = self.request.query_params.get('status', None)
+        name = self.request.query_params.get('name', None)
+        
+        if status_filter:
+            queryset = queryset.filter(status=status_filter)
+        
+        if name:
+            queryset = queryset.filter(name=name)
+        
+        return queryset
+    
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        """Cancel a job that hasn't started yet"""
+        job = self.get_object()
+        cancelled = Job.objects.filter(pk=job.pk, status='queued').update(status='cancelled')
+        if not cancelled:
+            return Response({
+                'success': False,
+                'message': f'Job is {job.status} and can no longer be cancelled'
+            }, status=status.HTTP_409_CONFLICT)
+        return Response({
+            'success': True,
+            'message': 'Job cancelled'
+        })
+
+
 # ==================== Dashboard/Stats Views ====================
 
 @api_view(['GET'])
+@throttle_classes([DashboardThrottle])
 def dashboard_stats(request):
     """Get dashboard statistics"""
     if not request.user.is_authenticated:
         return Response({'error': 'Not authenticated'}, status=401)
     
-    total_customers = Customer.objects.count()
-    total_products = Product.objects.filter(is_active=True).count()
-    total_orders = Order.objects.count()
-    pending_orders = Order.objects.filter(status='pending').count()
+    branch = resolve_branch(request)
+    scope = {'branch': branch} if branch is not None else {}
     
-    recent_orders = Order.objects.select_related('customer').order_by('-created_at')[:5]
-    recent_orders_data = OrderSerializer(recent_orders, many=True).data
+    with use_branch(branch):
+        total_customers = Customer.objects.filter(**scope).count()
+        total_products = Product.objects.filter(is_active=True, **scope).count()
+        total_orders = Order.objects.filter(**scope).count()
+        pending_orders = Order.objects.filter(status='pending', **scope).count()
+        
+        recent_orders = Order.objects.filter(**scope).select_related('customer').order_by('-created_at')[:5]
+        recent_orders_data = OrderSerializer(recent_orders, many=True).data
     
     return Response({
         'total_customers': total_customers,
@@ -0,0 +1,266 @@
+"""
+In-process working set of active orders.
+
+Nearly all operational reads - kitchen screens, front-of-house polling of
+the order list by status - are about the few hundred orders due today that
+are pending, confirmed or in progress. Each worker keeps those orders in
+memory as compact slotted records (ids, status and times only), so such
+queries are answered without touching the database; the matching order
+documents are then fetched by primary key. Only orders due today are held,
+so a backlog of older or future active orders can't crowd them out of
+`WORKING_SET_MAX_ORDERS`; queries must be limited to a due range within
+today to be answered from memory.
+
+The set is loaded when the worker starts (see `preload`) and kept current
+two ways: this worker's own saves and deletes are applied via signals once
+they commit, and changes made by other workers are pulled from a change
+feed - orders with a newer `updated_at` plus order tombstones - at most
+every `WORKING_SET_POLL_INTERVAL` seconds. The feed re-reads a short
+trailing window so rows from transactions still committing aren't missed,
+and the whole set is reloaded every `WORKING_SET_MAX_AGE` seconds and when
+the local day changes. When more than `WORKING_SET_MAX_ORDERS` active orders
+are due today, or a query involves other statuses or days, callers fall back
+to the database.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, time as dt_time, timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.utils import timezone
+
+from .models import Order, Tombstone
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = frozenset(('pending', 'confirmed', 'in_progress'))
+
+def today_bounds():
+    """Aware [start, end) of the current local day"""
+    today = timezone.localdate()
+    return (
+        timezone.make_aware(datetime.combine(today, dt_time())),
+        timezone.make_aware(datetime.combine(today + timedelta(days=1), dt_time())),
+    )
+
+
+FIELDS = ('order_id', 'branch_id', 'customer_id', 'status', 'order_placed', 'order_due', 'updated_at')
+
+
+class OrderRecord:
+    """The fields of an active order that working-set queries filter and sort on"""
+    __slots__ = FIELDS
+
+    def __init__(self, order_id, branch_id, customer_id, status, order_placed, order_due, updated_at):
+        self.order_id = order_id
+        self.branch_id = branch_id
+        self.customer_id = customer_id
+        self.status = status
+        self.order_placed = order_placed
+        self.order_due = order_due
+        self.updated_at = updated_at
+
+    @classmethod
+    def from_order(cls, order):
+        return cls(*(getattr(order, field) for field in FIELDS))
+
+    def matches(self, branch_id=None, statuses=None, customer_id=None,
+                placed_from=None, placed_to=None, due_from=None, due_to=None):
+        return (
+            (branch_id is None or self.branch_id == branch_id)
+            and (statuses is None or self.status in statuses)
+            and (customer_id is None or self.customer_id == customer_id)
+            and (placed_from is None or self.order_placed >= placed_from)
+            and (placed_to is None or self.order_placed <= placed_to)
+            and (due_from is None or self.order_due >= due_from)
+            and (due_to is None or self.order_due < due_to)
+        )
+
+
+class WorkingSet:
+    """Today's active orders of one database, held in this process"""
+
+    def __init__(self, using='default'):
+        self.using = using
+        self._lock = threading.Lock()
+        self._records = {}
+        self._available = False
+        self._loaded_at = None
+        self._polled_at = 0.0
+        self._cursor = None
+        self._day = None
+
+    @property
+    def max_orders(self):
+        return getattr(settings, 'WORKING_SET_MAX_ORDERS', 20000)
+
+    @property
+    def poll_interval(self):
+        return getattr(settings, 'WORKING_SET_POLL_INTERVAL', 1.0)
+
+    @property
+    def max_age(self):
+        return getattr(settings, 'WORKING_SET_MAX_AGE', 300)
+
+    @property
+    def safety_window(self):
+        return timedelta(seconds=getattr(settings, 'SYNC_SAFETY_WINDOW', 2))
+
+    @property
+    def loaded(self):
+        return self._loaded_at is not None
+
+    def load(self):
+        """Read every active order due today"""
+        started = timezone.now()
+        day = today_bounds()
+        rows = list(
+            Order.objects.using(self.using)
+            .filter(status__in=ACTIVE_STATUSES, order_due__gte=day[0], order_due__lt=day[1])
+            .order_by().values_list(*FIELDS)[:self.max_orders + 1]
+        )
+        available = len(rows) <= self.max_orders
+        records = {row[0]: OrderRecord(*row) for row in rows} if available else {}
+        with self._lock:
+            self._records = records
+            self._available = available
+            self._day = day
+            self._cursor = started - self.safety_window
+            self._loaded_at = self._polled_at = time.monotonic()
+
+    def poll(self):
+        """Apply orders changed and deleted (by any worker) since the last poll"""
+        started = timezone.now()
+        since = self._cursor
+        limit = self.max_orders
+        changed = list(
+            Order.objects.using(self.using).filter(updated_at__gte=since)
+            .order_by('updated_at', 'order_id').values_list(*FIELDS)[:limit + 1]
+        )
+        if len(changed) > limit:
+            # Too much changed to catch up row by row
+            self.load()
+            return
+        deleted = list(
+            Tombstone.objects.using(self.using)
+            .filter(model_name=Order._meta.label_lower, deleted_at__gte=since)
+            .values_list('object_id', flat=True)
+        )
+        with self._lock:
+            for row in changed:
+                self._apply(OrderRecord(*row))
+            for order_id in deleted:
+                self._records.pop(order_id, None)
+            self._cursor = max(since, started - self.safety_window)
+            self._polled_at = time.monotonic()
+
+    def ensure_current(self):
+        now = time.monotonic()
+        if self._loaded_at is None or now - self._loaded_at > self.max_age or self._day != today_bounds():
+            self.load()
+        elif now - self._polled_at >= self.poll_interval:
+            self.poll()
+
+    def _apply(self, record):
+        current = self._records.get(record.order_id)
+        if current is not None and current.updated_at > record.updated_at:
+            return
+        start, end = self._day
+        if record.status in ACTIVE_STATUSES and start <= record.order_due < end:
+            if current is None and len(self._records) >= self.max_orders:
+                self._available = False
+            self._records[record.order_id] = record
+        else:
+            self._records.pop(record.order_id, None)
+
+    def apply(self, record):
+        if self.loaded:
+            with self._lock:
+                self._apply(record)
+
+    def discard(self, order_ids):
+        if self.loaded:
+            with self._lock:
+                for order_id in order_ids:
+                    self._records.pop(order_id, None)
+
+    def reload(self, order_ids):
+        """Re-read specific orders, e.g. after a set-based status change"""
+        if not self.loaded or not order_ids:
+            return
+        rows = Order.objects.using(self.using).filter(pk__in=list(order_ids)).values_list(*FIELDS)
+        records = [OrderRecord(*row) for row in rows]
+        with self._lock:
+            found = set()
+            for record in records:
+                self._apply(record)
+                found.add(record.order_id)
+            for order_id in set(order_ids) - found:
+                self._records.pop(order_id, None)
+
+    def select(self, statuses, due_from=None, due_to=None, **filters):
+        """
+        Records with one of `statuses` due in [due_from, due_to) matching the
+        filters, newest placed first; None if this can't be answered from
+        memory, e.g. because the due range isn't within today.
+        """
+        statuses = set(statuses)
+        if not getattr(settings, 'WORKING_SET_ENABLED', True) or not statuses or not statuses <= ACTIVE_STATUSES:
+            return None
+        start, end = today_bounds()
+        if due_from is None or due_to is None or due_from < start or due_to > end:
+            return None
+        self.ensure_current()
+        with self._lock:
+            if not self._available:
+                return None
+            records = [
+                record for record in self._records.values()
+                if record.matches(statuses=statuses, due_from=due_from, due_to=due_to, **filters)
+            ]
+        records.sort(key=lambda record: (record.order_placed, record.order_id), reverse=True)
+        return records
+
+
+_sets = {}
+_sets_lock = threading.Lock()
+
+
+def working_set_for(using='default'):
+    """The active-order working set for a database alias"""
+    working_set = _sets.get(using)
+    if working_set is None:
+        with _sets_lock:
+            working_set = _sets.setdefault(using, WorkingSet(using))
+    return working_set
+
+
+def order_saved(order, using='default'):
+    """Apply a saved order once its transaction commits"""
+    record = OrderRecord.from_order(order)
+    transaction.on_commit(lambda: working_set_for(using).apply(record), using=using)
+
+
+def orders_deleted(order_ids, using='default'):
+    order_ids = list(order_ids)
+    transaction.on_commit(lambda: working_set_for(using).discard(order_ids), using=using)
+
+
+def orders_updated(order_ids, using='default'):
+    """Re-read orders changed by a queryset UPDATE once it commits"""
+    order_ids = list(order_ids)
+    transaction.on_commit(lambda: working_set_for(using).reload(order_ids), using=using)
+
+
+def preload(using='default'):
+    """Load the working set when a worker starts, without holding on to the connection"""
+    if not (getattr(settings, 'WORKING_SET_ENABLED', True) and getattr(settings, 'WORKING_SET_PRELOAD', True)):
+        return
+    try:
+        working_set_for(using).load()
+    except DatabaseError:
+        logger.warning("Couldn't preload the active order working set", exc_info=True)
+    finally:
+        connections[using].close()
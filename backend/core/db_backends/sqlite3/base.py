@@ -0,0 +1,88 @@
+"""
+SQLite backend tuned for serving several gunicorn workers from one file.
+
+Adds two OPTIONS keys on top of Django's SQLite backend:
+
+- `pragmas`: PRAGMA name -> value, applied to every new connection (WAL
+  journaling, busy_timeout, synchronous, mmap_size, cache_size, ...).
+- `transaction_mode`: how `atomic()` begins transactions (DEFERRED,
+  IMMEDIATE or EXCLUSIVE; default DEFERRED).
+
+`api.db.immediate_atomic()` asks for a single BEGIN IMMEDIATE regardless of
+`transaction_mode`, so write paths take the write lock up front (waiting up
+to busy_timeout) instead of failing when a read transaction later tries to
+upgrade to a write.
+
+PRAGMAs can't take bound parameters, so names and values are checked
+against `PRAGMAS` before they are formatted into the statement.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+# Allowed pragma -> allowed keyword values, or int for an integer value
+PRAGMAS = {
+    'journal_mode': {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'},
+    'synchronous': {'OFF', 'NORMAL', 'FULL', 'EXTRA'},
+    'temp_store': {'DEFAULT', 'FILE', 'MEMORY'},
+    'busy_timeout': int,
+    'mmap_size': int,
+    'cache_size': int,
+    'wal_autocheckpoint': int,
+    'journal_size_limit': int,
+    'foreign_keys': {'ON', 'OFF'},
+}
+
+TRANSACTION_MODES = {'DEFERRED', 'IMMEDIATE', 'EXCLUSIVE'}
+
+
+def pragma_statement(pragma, value):
+    """`PRAGMA name = value` for an allowed pragma and value"""
+    allowed = PRAGMAS.get(pragma)
+    if allowed is None:
+        raise ImproperlyConfigured(f"Unsupported SQLite pragma '{pragma}'")
+    if allowed is int:
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ImproperlyConfigured(f"SQLite pragma '{pragma}' needs an integer, got {value!r}")
+    else:
+        value = str(value).upper()
+        if value not in allowed:
+            raise ImproperlyConfigured(
+                f"Invalid value {value!r} for SQLite pragma '{pragma}'; choose from {', '.join(sorted(allowed))}"
+            )
+    return f'PRAGMA {pragma} = {value}'
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # Set by api.db.immediate_atomic() for the next BEGIN on this connection
+    begin_immediate = False
+
+    def get_connection_params(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode', 'DEFERRED')
+        if mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f"Invalid SQLite transaction_mode {mode!r}; choose from {', '.join(sorted(TRANSACTION_MODES))}"
+            )
+        params = super().get_connection_params()
+        params.pop('pragmas', None)
+        params.pop('transaction_mode', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        statements = [
+            pragma_statement(pragma, value)
+            for pragma, value in self.settings_dict['OPTIONS'].get('pragmas', {}).items()
+        ]
+        conn = super().get_new_connection(conn_params)
+        for statement in statements:
+            conn.execute(statement)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.begin_immediate:
+            mode = 'IMMEDIATE'
+        else:
+            mode = self.settings_dict['OPTIONS'].get('transaction_mode', 'DEFERRED')
+        self.begin_immediate = False
+        self.cursor().execute(f'BEGIN {mode}')
@@ -41,11 +41,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'api.middleware.LoadSheddingMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'api.middleware.CompressionMiddleware',
+    'api.middleware.APISessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -83,14 +86,88 @@ DATABASES = {
     }
 }
 
-# For development without PostgreSQL, fallback to SQLite
+# Without PostgreSQL, fall back to SQLite. SQLITE_HARDENED=true switches it
+# to a mode suited to several gunicorn workers: WAL journaling (readers
+# never wait for writers), a busy timeout instead of instant "database is
+# locked" errors, and order writes in BEGIN IMMEDIATE transactions (see
+# api.db). WAL leaves -wal/-shm files next to the database, so the default
+# is Django's stock SQLite settings.
 if os.environ.get('USE_SQLITE', 'false').lower() == 'true':
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
-            'NAME': BASE_DIR / 'db.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
         }
     }
+    if os.environ.get('SQLITE_HARDENED', 'false').lower() == 'true':
+        DATABASES['default'].update({
+            'ENGINE': 'core.db_backends.sqlite3',
+            'OPTIONS': {
+                'pragmas': {
+                    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+                    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', '5000')),
+                    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+                    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+                    # Negative values are KiB: 64 MB of page cache per connection
+                    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', '-64000')),
+                    'temp_store': 'MEMORY',
+                },
+            },
+        })
+
+# Retries for SQLite order writes that still find the database locked
+SQLITE_WRITE_RETRIES = int(os.environ.get('SQLITE_WRITE_RETRIES', '5'))
+SQLITE_WRITE_RETRY_BACKOFF = float(os.environ.get('SQLITE_WRITE_RETRY_BACKOFF', '0.05'))
+
+# Per-branch databases - comma-separated aliases, e.g. "north,south". Each
+# gets its own SQLite file, its own PostgreSQL database (<DB_NAME>_<alias>)
+# or, with BRANCH_DB_MODE=schema, its own PostgreSQL schema. Point a
+# Branch at an alias to move its data there (see api.routers).
+BRANCH_DATABASES = [
+    alias.strip() for alias in os.environ.get('BRANCH_DATABASES', '').split(',') if alias.strip()
+]
+BRANCH_DB_MODE = os.environ.get('BRANCH_DB_MODE', 'database')
+
+for _alias in BRANCH_DATABASES:
+    _branch_db = dict(DATABASES['default'])
+    if _branch_db['ENGINE'].endswith('sqlite3'):
+        _branch_db['NAME'] = BASE_DIR / f'db_{_alias}.sqlite3'
+    elif BRANCH_DB_MODE == 'schema':
+        _branch_db['OPTIONS'] = {'options': f'-c search_path={_alias},public'}
+    else:
+        _branch_db['NAME'] = f"{_branch_db['NAME']}_{_alias}"
+    DATABASES[_alias] = _branch_db
+
+DATABASE_ROUTERS = ['api.routers.BranchRouter']
+
+# Branch used when a request names none and the user has no assigned branch
+DEFAULT_BRANCH = os.environ.get('DEFAULT_BRANCH', 'main')
+
+
+# Admin changelists above this many rows (PostgreSQL estimate) skip COUNT(*)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = int(os.environ.get('ADMIN_ESTIMATED_COUNT_THRESHOLD', '10000'))
+
+# Type-ahead autocomplete: in-process prefix index, rebuilt every N seconds;
+# tables larger than the row limit are searched in the database instead
+AUTOCOMPLETE_MAX_AGE = int(os.environ.get('AUTOCOMPLETE_MAX_AGE', '300'))
+AUTOCOMPLETE_INDEX_MAX_ROWS = int(os.environ.get('AUTOCOMPLETE_INDEX_MAX_ROWS', '500000'))
+AUTOCOMPLETE_MAX_LIMIT = int(os.environ.get('AUTOCOMPLETE_MAX_LIMIT', '50'))
+
+# Kitchen capacity calendar: slot length, maximum line quantity per slot by
+# product type (e.g. "main=40,dessert=60"; unlisted types are unlimited) and
+# the hours shown in the availability grid
+KITCHEN_SLOT_MINUTES = int(os.environ.get('KITCHEN_SLOT_MINUTES', '15'))
+KITCHEN_SLOT_CAPACITY = {
+    product_type.strip(): int(limit)
+    for product_type, _, limit in (
+        item.partition('=') for item in os.environ.get('KITCHEN_SLOT_CAPACITY', '').split(',') if item.strip()
+    )
+}
+KITCHEN_OPENING_HOURS = tuple(os.environ.get('KITCHEN_OPENING_HOURS', '07:00-19:00').split('-', 1))
+
+# On-demand request profiling (staff send X-Profile: 1); keep the newest N
+REQUEST_PROFILE_KEEP = int(os.environ.get('REQUEST_PROFILE_KEEP', '200'))
+REQUEST_PROFILE_TOP_FUNCTIONS = int(os.environ.get('REQUEST_PROFILE_TOP_FUNCTIONS', '60'))
 
 
 # Custom user model
@@ -113,6 +190,10 @@ USE_I18N = True
 USE_TZ = True
 
 
+# Country calling code assumed for national phone numbers (leading '0')
+PHONE_DEFAULT_COUNTRY_CODE = os.environ.get('PHONE_DEFAULT_COUNTRY_CODE', '44')
+
+
 # Static files
 STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
@@ -120,6 +201,16 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# Stateless API - requests under these paths that send `Authorization: Token`
+# neither load nor save a session, and logins don't create one. Requests
+# without a token (the browsable API) still use session authentication.
+API_STATELESS = os.environ.get('API_STATELESS', 'false').lower() == 'true'
+API_STATELESS_PATHS = [
+    prefix.strip() for prefix in os.environ.get('API_STATELESS_PATHS', '/api/').split(',')
+    if prefix.strip()
+]
+
+
 # Django REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
@@ -129,14 +220,92 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'api.renderers.MessagePackRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.renderers.ORJSONParser',
+        'api.renderers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'api.throttling.SlidingWindowThrottle',
+    ] if os.environ.get('THROTTLING_ENABLED', 'true').lower() == 'true' else [],
+    # Per token and endpoint class; 'cheap' is type-ahead and dropdown
+    # lookups, 'dashboard' is dashboard polling, 'heavy' is reports and bulk jobs
+    'DEFAULT_THROTTLE_RATES': {
+        'default': os.environ.get('THROTTLE_RATE_DEFAULT', '300/min'),
+        'cheap': os.environ.get('THROTTLE_RATE_CHEAP', '1200/min'),
+        'heavy': os.environ.get('THROTTLE_RATE_HEAVY', '20/min'),
+        'dashboard': os.environ.get('THROTTLE_RATE_DASHBOARD', '60/min'),
+        'login': os.environ.get('THROTTLE_RATE_LOGIN', '10/min'),
+    },
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
 }
 
 
+# Load shedding: GET/HEAD requests outside the protected paths get 503 when
+# the request queued longer than N ms before reaching the worker, or when
+# the worker has more than N requests in flight (0 disables either check).
+# In-flight counts are per process, so that check only does anything with
+# threaded (gunicorn --threads) or ASGI workers; it is off by default.
+LOAD_SHED_MAX_IN_FLIGHT = int(os.environ.get('LOAD_SHED_MAX_IN_FLIGHT', '0'))
+LOAD_SHED_MAX_QUEUE_MS = int(os.environ.get('LOAD_SHED_MAX_QUEUE_MS', '1000'))
+LOAD_SHED_RETRY_AFTER = int(os.environ.get('LOAD_SHED_RETRY_AFTER', '2'))
+LOAD_SHED_PROTECTED_PATHS = [
+    prefix.strip() for prefix in os.environ.get('LOAD_SHED_PROTECTED_PATHS', '/api/auth/,/admin/').split(',')
+    if prefix.strip()
+]
+
+
+# Response compression - responses smaller than this many bytes are sent as-is
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.environ.get('RESPONSE_COMPRESSION_MIN_SIZE', '1024'))
+RESPONSE_COMPRESSION_BROTLI_QUALITY = int(os.environ.get('RESPONSE_COMPRESSION_BROTLI_QUALITY', '4'))
+
+
 # CORS settings - restrict to specific origins in production
 CORS_ALLOWED_ORIGINS = os.environ.get(
     'CORS_ALLOWED_ORIGINS',
     'http://localhost:3000,http://localhost:5173'
 ).split(',')
 CORS_ALLOW_CREDENTIALS = True
+
+
+# Co-purchase recommendations - in-memory index rebuild interval (seconds)
+# and overlay size at which incremental updates are merged into the matrix
+COPURCHASE_MAX_AGE = int(os.environ.get('COPURCHASE_MAX_AGE', '3600'))
+COPURCHASE_DELTA_LIMIT = int(os.environ.get('COPURCHASE_DELTA_LIMIT', '10000'))
+
+
+# Active order working set - in-memory pending/confirmed/in-progress orders
+# due today, per worker: cap before falling back to the database, change feed poll
+# interval and full reload interval (seconds), and whether to load at startup
+WORKING_SET_ENABLED = os.environ.get('WORKING_SET_ENABLED', 'true').lower() == 'true'
+WORKING_SET_MAX_ORDERS = int(os.environ.get('WORKING_SET_MAX_ORDERS', '20000'))
+WORKING_SET_POLL_INTERVAL = float(os.environ.get('WORKING_SET_POLL_INTERVAL', '1'))
+WORKING_SET_MAX_AGE = int(os.environ.get('WORKING_SET_MAX_AGE', '300'))
+WORKING_SET_PRELOAD = os.environ.get('WORKING_SET_PRELOAD', 'true').lower() == 'true'
+
+
+# Duplicate customer search - minimum pair score (0-1) to report, and the
+# size above which a blocking key group is skipped as too common
+DEDUPE_MIN_SCORE = float(os.environ.get('DEDUPE_MIN_SCORE', '0.6'))
+DEDUPE_MAX_BLOCK_SIZE = int(os.environ.get('DEDUPE_MAX_BLOCK_SIZE', '200'))
+
+
+# Background jobs (manage.py run_worker)
+JOB_WORKER_PROCESSES = int(os.environ.get('JOB_WORKER_PROCESSES', '2'))
+JOB_RETRY_BACKOFF = int(os.environ.get('JOB_RETRY_BACKOFF', '30'))
+JOB_STALE_AFTER = int(os.environ.get('JOB_STALE_AFTER', '600'))
+JOB_REQUEUE_INTERVAL = int(os.environ.get('JOB_REQUEUE_INTERVAL', '60'))
+
+
+# Delta sync (?updated_since=) - rows per sync response, seconds the final
+# token trails the clock, and how long deletions are remembered
+SYNC_MAX_RESULTS = int(os.environ.get('SYNC_MAX_RESULTS', '1000'))
+SYNC_SAFETY_WINDOW = int(os.environ.get('SYNC_SAFETY_WINDOW', '2'))
+SYNC_TOMBSTONE_RETENTION_DAYS = int(os.environ.get('SYNC_TOMBSTONE_RETENTION_DAYS', '30'))
@@ -0,0 +1,96 @@
+import { useState, useEffect, useRef } from 'react';
+import { Search } from 'lucide-react';
+
+const DEBOUNCE_MS = 200;
+
+// Type-ahead picker: asks the server for matches as the user types, rather
+// than loading every option up front. `search(q)` returns a promise of options.
+export default function AutocompleteInput({
+  search,
+  selectedLabel,
+  onSelect,
+  renderOption,
+  placeholder,
+  required = false
+}) {
+  const [query, setQuery] = useState(selectedLabel || '');
+  const [options, setOptions] = useState([]);
+  const [open, setOpen] = useState(false);
+  const [loading, setLoading] = useState(false);
+  const requestId = useRef(0);
+
+  useEffect(() => {
+    setQuery(selectedLabel || '');
+  }, [selectedLabel]);
+
+  useEffect(() => {
+    if (!open || !query.trim()) {
+      setOptions([]);
+      return undefined;
+    }
+    const id = ++requestId.current;
+    const timer = setTimeout(async () => {
+      setLoading(true);
+      try {
+        const results = await search(query.trim());
+        // Ignore responses to keystrokes that have since been superseded
+        if (id === requestId.current) {
+          setOptions(results);
+        }
+      } catch (error) {
+        console.error('Autocomplete failed:', error);
+      } finally {
+        if (id === requestId.current) {
+          setLoading(false);
+        }
+      }
+    }, DEBOUNCE_MS);
+    return () => clearTimeout(timer);
+  }, [query, open]);
+
+  const choose = (option) => {
+    onSelect(option);
+    setOpen(false);
+  };
+
+  return (
+    <div className="relative">
+      <Search className="absolute left-4 top-1/2 -translate-y-1/2 w-5 h-5 text-surface-400" />
+      <input
+        type="text"
+        value={query}
+        onChange={(e) => {
+          setQuery(e.target.value);
+          setOpen(true);
+        }}
+        onFocus={() => setOpen(true)}
+        onBlur={() => setTimeout(() => {
+          setOpen(false);
+          setQuery(selectedLabel || '');
+        }, 150)}
+        placeholder={placeholder}
+        className="input pl-12"
+        required={required && !selectedLabel}
+      />
+      {open && query.trim() && (
+        <ul className="absolute z-20 mt-1 w-full max-h-60 overflow-y-auto bg-white border border-surface-200 rounded-xl shadow-lg">
+          {options.map(option => (
+            <li key={option.id}>
+              <button
+                type="button"
+                onMouseDown={(e) => e.preventDefault()}
+                onClick={() => choose(option)}
+                className="w-full text-left px-4 py-2 hover:bg-surface-50"
+              >
+                {renderOption(option)}
+              </button>
+            </li>
+          ))}
+          {!loading && options.length === 0 && (
+            <li className="px-4 py-2 text-sm text-surface-500">No matches</li>
+          )}
+        </ul>
+      )}
+    </div>
+  );
+}
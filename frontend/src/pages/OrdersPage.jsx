@@ -1,6 +1,7 @@
 import { useState, useEffect } from 'react';
 import { ordersAPI, customersAPI, productsAPI } from '../services/api';
 import { useToast } from '../context/ToastContext';
+import AutocompleteInput from '../components/AutocompleteInput';
 import { format } from 'date-fns';
 import {
   ShoppingCart,
@@ -21,8 +22,6 @@ import {
 
 export default function OrdersPage() {
   const [orders, setOrders] = useState([]);
-  const [customers, setCustomers] = useState([]);
-  const [products, setProducts] = useState([]);
   const [loading, setLoading] = useState(true);
   const [searchTerm, setSearchTerm] = useState('');
   const [statusFilter, setStatusFilter] = useState('');
@@ -40,6 +39,7 @@ export default function OrdersPage() {
 
   const [formData, setFormData] = useState({
     customer: '',
+    customer_name: '',
     status: 'pending',
     method_of_payment: 'cash',
     order_due: '',
@@ -57,24 +57,25 @@ export default function OrdersPage() {
 
   const loadInitialData = async () => {
     try {
-      const [statusesRes, paymentRes, customersRes, productsRes] = await Promise.all([
+      const [statusesRes, paymentRes] = await Promise.all([
         ordersAPI.getStatuses(),
-        ordersAPI.getPaymentMethods(),
-        customersAPI.getSimpleList(),
-        productsAPI.getSimpleList()
+        ordersAPI.getPaymentMethods()
       ]);
       const normalize = (data) => Array.isArray(data)
         ? data
         : Object.entries(data || {}).map(([value, label]) => ({ value, label }));
       setStatuses(normalize(statusesRes.data));
       setPaymentMethods(normalize(paymentRes.data));
-      setCustomers(customersRes.data?.results || customersRes.data || []);
-      setProducts(productsRes.data?.results || productsRes.data || []);
     } catch (error) {
       console.error('Failed to load initial data:', error);
     }
   };
 
+  // Customers and products are searched as the user types instead of
+  // loading every row into the form
+  const searchCustomers = async (q) => (await customersAPI.autocomplete(q)).data;
+  const searchProducts = async (q) => (await productsAPI.autocomplete(q)).data;
+
   const loadOrders = async () => {
     try {
       setLoading(true);
@@ -144,6 +145,7 @@ export default function OrdersPage() {
 
     setFormData({
       customer: order.customer || '',
+      customer_name: order.customer_name || '',
       status: order.status || 'pending',
       method_of_payment: order.method_of_payment || 'cash',
       order_due: order.order_due ? order.order_due.slice(0, 16) : '',
@@ -177,6 +179,7 @@ export default function OrdersPage() {
   const resetForm = () => {
     setFormData({
       customer: '',
+      customer_name: '',
       status: 'pending',
       method_of_payment: 'cash',
       order_due: '',
@@ -202,15 +205,19 @@ export default function OrdersPage() {
     setFormData(prev => {
       const updated = [...prev.orderProducts];
       updated[index] = { ...updated[index], [field]: value };
-      
-      if (field === 'product') {
-        const product = products.find(p => p.id === parseInt(value));
-        if (product) {
-          updated[index].product_name = product.product_name || product.name;
-          updated[index].unit_price = product.product_price;
-        }
-      }
-      
+      return { ...prev, orderProducts: updated };
+    });
+  };
+
+  const selectOrderProduct = (index, product) => {
+    setFormData(prev => {
+      const updated = [...prev.orderProducts];
+      updated[index] = {
+        ...updated[index],
+        product: product.id,
+        product_name: product.product_name || product.name,
+        unit_price: product.product_price
+      };
       return { ...prev, orderProducts: updated };
     });
   };
@@ -224,8 +231,7 @@ export default function OrdersPage() {
 
   const calculateTotal = () => {
     return formData.orderProducts.reduce((total, op) => {
-      const product = products.find(p => p.id === parseInt(op.product));
-      return total + (product ? product.product_price * op.quantity : 0);
+      return total + (op.unit_price ? parseFloat(op.unit_price) * op.quantity : 0);
     }, 0);
   };
 
@@ -441,17 +447,25 @@ export default function OrdersPage() {
             <form onSubmit={handleSubmit} className="p-6 space-y-6">
               <div>
                 <label className="label">Customer *</label>
-                <select
-                  value={formData.customer}
-                  onChange={(e) => setFormData({ ...formData, customer: e.target.value })}
-                  className="select"
+                <AutocompleteInput
+                  search={searchCustomers}
+                  selectedLabel={formData.customer_name}
+                  onSelect={(customer) => setFormData(prev => ({
+                    ...prev,
+                    customer: customer.id,
+                    customer_name: customer.name
+                  }))}
+                  renderOption={(customer) => (
+                    <>
+                      <span className="font-medium">{customer.name}</span>
+                      <span className="block text-xs text-surface-500">
+                        {[customer.phone_number, customer.email].filter(Boolean).join(' · ')}
+                      </span>
+                    </>
+                  )}
+                  placeholder="Search by name, phone or email..."
                   required
-                >
-                  <option value="">Select customer...</option>
-                  {customers.map(customer => (
-                    <option key={customer.id} value={customer.id}>{customer.name}</option>
-                  ))}
-                </select>
+                />
               </div>
               
               <div className="grid grid-cols-2 gap-4">
@@ -509,19 +523,16 @@ export default function OrdersPage() {
                     {formData.orderProducts.map((op, index) => (
                       <div key={index} className="flex items-center gap-3 p-3 bg-surface-50 rounded-xl">
                         <div className="flex-1">
-                          <select
-                            value={op.product}
-                            onChange={(e) => updateOrderProduct(index, 'product', e.target.value)}
-                            className="select"
+                          <AutocompleteInput
+                            search={searchProducts}
+                            selectedLabel={op.product_name}
+                            onSelect={(product) => selectOrderProduct(index, product)}
+                            renderOption={(product) => (
+                              <>{product.product_name || product.name} - £{product.product_price ?? product.price}</>
+                            )}
+                            placeholder="Search products..."
                             required
-                          >
-                            <option value="">Select product...</option>
-                            {products.map(product => (
-                              <option key={product.id} value={product.id}>
-                                  {product.product_name || product.name} - £{product.product_price ?? product.price}
-                              </option>
-                            ))}
-                          </select>
+                          />
                         </div>
                         <div className="w-24">
                           <input
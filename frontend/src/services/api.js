@@ -51,6 +51,7 @@ export const customersAPI = {
   update: (id, data) => api.put(`/customers/${id}/`, data),
   delete: (id) => api.delete(`/customers/${id}/`),
   getSimpleList: () => api.get('/customers/list_simple/'),
+  autocomplete: (q, params) => api.get('/customers/autocomplete/', { params: { q, ...params } }),
 };
 
 // Products API
@@ -61,6 +62,7 @@ export const productsAPI = {
   update: (id, data) => api.put(`/products/${id}/`, data),
   delete: (id) => api.delete(`/products/${id}/`),
   getSimpleList: () => api.get('/products/list_simple/'),
+  autocomplete: (q, params) => api.get('/products/autocomplete/', { params: { q, ...params } }),
   getTypes: () => api.get('/products/types/'),
   getSuitabilities: () => api.get('/products/suitabilities/'),
 };